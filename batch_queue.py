@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# chatterblez - persistent batch job queue
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from logs import get_logger
+
+log = get_logger('batch')
+
+JOB_DB_NAME = "chatterblez_jobs.sqlite3"
+
+# Book / chapter states
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    path            TEXT PRIMARY KEY,
+    priority        INTEGER NOT NULL DEFAULT 0,
+    state           TEXT NOT NULL DEFAULT 'pending',
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error      TEXT,
+    updated_at      REAL
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    book_path     TEXT NOT NULL,
+    chapter_index INTEGER NOT NULL,
+    state         TEXT NOT NULL,
+    updated_at    REAL,
+    PRIMARY KEY (book_path, chapter_index)
+);
+"""
+
+
+class JobStore:
+    """
+    Durable record of a batch, kept as SQLite next to the audiobooks.
+    Books are claimed by priority (highest first), failed books are retried
+    with exponential backoff and per-chapter progress is recorded from the
+    events posted by core.main. Books left 'running' by a crashed or
+    interrupted process go back to 'pending' when the store is reopened.
+    """
+
+    def __init__(self, output_folder, max_attempts=3, retry_backoff=30.0):
+        Path(output_folder).mkdir(parents=True, exist_ok=True)
+        self.db_path = Path(output_folder) / JOB_DB_NAME
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        with self._lock:
+            self._conn.execute("UPDATE books SET state=?, updated_at=? WHERE state=?", (PENDING, time.time(), RUNNING))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add_books(self, paths, priority=0):
+        """Queue new books. Books already known keep their state; their priority is updated."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO books (path, priority, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET priority=excluded.priority",
+                [(str(p), priority, now) for p in paths]
+            )
+
+    def retry_failed(self):
+        """Give books that exhausted their retries another full set of attempts."""
+        with self._lock:
+            self._conn.execute("UPDATE books SET state=?, attempts=0, next_attempt_at=0, updated_at=? WHERE state=?",
+                               (PENDING, time.time(), FAILED))
+
+    def claim_next(self):
+        """Atomically mark the highest priority runnable book as running and return its path."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT path FROM books WHERE state=? AND next_attempt_at<=? "
+                    "ORDER BY priority DESC, path LIMIT 1", (PENDING, now)
+                ).fetchone()
+                if row:
+                    self._conn.execute("UPDATE books SET state=?, attempts=attempts+1, updated_at=? WHERE path=?",
+                                       (RUNNING, now, row[0]))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row[0] if row else None
+
+    def peek_runnable(self, limit=1):
+        """Paths of the next `limit` books claim_next() would return, without claiming them."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM books WHERE state=? AND next_attempt_at<=? "
+                "ORDER BY priority DESC, path LIMIT ?", (PENDING, time.time(), limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def next_wakeup(self):
+        """
+        Seconds until a pending book becomes runnable, 0 if one is runnable now,
+        or None if nothing is pending.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(next_attempt_at) FROM books WHERE state=?", (PENDING,)).fetchone()
+        if row[0] is None:
+            return None
+        return max(row[0] - time.time(), 0.0)
+
+    def has_running(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM books WHERE state=? LIMIT 1", (RUNNING,)).fetchone() is not None
+
+    def mark_done(self, path):
+        self._set_book(path, DONE, last_error=None)
+
+    def mark_interrupted(self, path):
+        """Put a book back in the queue without counting the attempt."""
+        with self._lock:
+            self._conn.execute("UPDATE books SET state=?, attempts=MAX(attempts-1, 0), updated_at=? WHERE path=?",
+                               (PENDING, time.time(), str(path)))
+
+    def mark_failed(self, path, error):
+        """Schedule a retry with exponential backoff, or fail the book after max_attempts."""
+        with self._lock:
+            (attempts,) = self._conn.execute("SELECT attempts FROM books WHERE path=?", (str(path),)).fetchone()
+            now = time.time()
+            if attempts < self.max_attempts:
+                delay = self.retry_backoff * 2 ** (attempts - 1)
+                self._conn.execute("UPDATE books SET state=?, next_attempt_at=?, last_error=?, updated_at=? "
+                                   "WHERE path=?", (PENDING, now + delay, error, now, str(path)))
+            else:
+                self._conn.execute("UPDATE books SET state=?, last_error=?, updated_at=? WHERE path=?",
+                                   (FAILED, error, now, str(path)))
+
+    def set_chapter_state(self, path, chapter_index, state):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO chapters (book_path, chapter_index, state, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(book_path, chapter_index) DO UPDATE SET state=excluded.state, "
+                "updated_at=excluded.updated_at",
+                (str(path), chapter_index, state, time.time())
+            )
+
+    def summary(self):
+        """Return {state: count} over all books."""
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM books GROUP BY state").fetchall()
+        return dict(rows)
+
+    def _set_book(self, path, state, last_error=None):
+        with self._lock:
+            self._conn.execute("UPDATE books SET state=?, last_error=?, updated_at=? WHERE path=?",
+                               (state, last_error, time.time(), str(path)))
+
+
+def run_batch(store, concurrency=None, post_event=None, should_stop=None, prefetch=None, **main_kwargs):
+    """
+    Process every runnable book in `store` with up to `concurrency` books
+    converting at once (default: the workers of the saved thread topology,
+    see core.apply_topology, or 1). main_kwargs are passed to core.main for
+    each book. Each worker loads its model once (unless main_kwargs has a
+    cb_model to share) and reuses it for every book it converts. Returns when
+    the queue is drained or should_stop() becomes True.
+
+    As in core.run_batch_pipeline, the stages overlap: a parser thread fills
+    the preprocessing cache of the next `prefetch` runnable books (default:
+    core.BATCH_PREFETCH per worker) while the workers synthesize, and a
+    packaging thread runs ffmpeg for a finished book while its worker starts
+    on the next one. A book is marked done once it is packaged.
+    """
+    import core
+
+    topology = core.apply_topology(getattr(main_kwargs.get('cb_model'), 'device', None))
+    if concurrency is None:
+        concurrency = topology.workers if topology else 1
+    concurrency = max(1, concurrency)
+    if prefetch is None:
+        prefetch = core.BATCH_PREFETCH * concurrency
+    lexicon = main_kwargs.get('lexicon')
+    if lexicon is not None and not isinstance(lexicon, core.Lexicon):
+        # Loaded once, so the parser and every book key the preprocessing cache on the same entries
+        lexicon = main_kwargs['lexicon'] = core.load_lexicon(lexicon)
+
+    interrupted = threading.Event()
+    user_should_stop = should_stop or (lambda: False)
+    should_stop = lambda: interrupted.is_set() or user_should_stop()
+    wakeup = threading.Event()
+    parse_wakeup = threading.Event()
+    packaging = queue.Queue(maxsize=concurrency * core.BATCH_PACKAGE_BACKLOG)
+    workers_done = threading.Event()
+
+    def parse_stage():
+        parsed = set()
+        core.load_spacy()
+        while not (should_stop() or workers_done.is_set()):
+            for path in store.peek_runnable(prefetch):
+                if should_stop() or path in parsed:
+                    continue
+                parsed.add(path)
+                try:
+                    core.preprocess_book(path, main_kwargs.get('output_folder', '.'), lexicon,
+                                         main_kwargs.get('ignore_list'))
+                except Exception as e:
+                    log.debug("Batch: could not parse %s ahead: %s", path, e)  # main() reports it
+            parse_wakeup.wait(timeout=core.STOP_POLL_SECONDS)
+            parse_wakeup.clear()
+
+    def package_stage():
+        while (item := packaging.get()) is not None:
+            path, package, finish = item
+            try:
+                package()
+            except Exception as e:
+                log.exception('Batch: packaging %s failed', path)
+                finish(error=str(e))
+            else:
+                finish()
+
+    def run_one(path, load_model):
+        outcome = {}
+
+        def book_event(evt_name, **kwargs):
+            if evt_name == 'CORE_CHAPTER_STARTED':
+                store.set_chapter_state(path, kwargs.get('chapter_index', -1), RUNNING)
+            elif evt_name == 'CORE_CHAPTER_FINISHED':
+                store.set_chapter_state(path, kwargs.get('chapter_index', -1), DONE)
+            elif evt_name == 'CORE_FINISHED':
+                outcome['finished'] = True
+            elif evt_name == 'CORE_ERROR':
+                outcome['error'] = kwargs.get('message', 'Unknown error')
+            if post_event:
+                post_event(evt_name, file_path=path, **kwargs)
+
+        def finish(error=None):
+            if error is not None:
+                outcome['error'] = error
+            if outcome.get('finished'):
+                store.mark_done(path)
+                if post_event:
+                    post_event('CORE_FILE_FINISHED', file_path=path)
+            elif should_stop():
+                store.mark_interrupted(path)
+            else:
+                error = outcome.get('error', 'Conversion did not finish')
+                log.error("Batch: %s failed: %s", path, error)
+                store.mark_failed(path, error)
+            wakeup.set()  # a retry may have been scheduled or work may be finished
+
+        submitted = []
+        try:
+            core.main(file_path=path, pick_manually=False, post_event=book_event, should_stop=should_stop,
+                      **{**main_kwargs, 'cb_model': load_model(), 'packager': SimpleNamespace(submit=submitted.append)})
+        except Exception as e:
+            log.exception('Batch: %s raised', path)
+            outcome['error'] = str(e)
+            submitted.clear()
+        if submitted:
+            packaging.put((path, submitted[0], finish))
+        else:
+            finish()
+
+    def worker():
+        # One model per worker thread, loaded when it claims its first book and kept for the next ones
+        cb_model = main_kwargs.get('cb_model')
+
+        def load_model():
+            nonlocal cb_model
+            if cb_model is None:
+                cb_model = core.load_tts_model(accel=main_kwargs.get('accel', 'fp32'),
+                                               backend=main_kwargs.get('backend', 'torch'),
+                                               onnx_dir=main_kwargs.get('onnx_dir'))
+            return cb_model
+
+        while not should_stop():
+            path = store.claim_next()
+            if path is not None:
+                parse_wakeup.set()  # the next book in line changed
+                run_one(path, load_model)
+                continue
+            delay = store.next_wakeup()
+            if delay is None and not store.has_running():
+                wakeup.set()
+                return
+            # Sleep until a retry comes due, another book is packaged, or a stop check is due
+            wakeup.wait(timeout=min(delay if delay is not None else core.STOP_POLL_SECONDS, core.STOP_POLL_SECONDS))
+            wakeup.clear()
+
+    parser = threading.Thread(target=parse_stage, name='batch-parse', daemon=True)
+    packager = threading.Thread(target=package_stage, name='batch-package', daemon=True)
+    workers = [threading.Thread(target=worker, name=f"batch-worker-{i}", daemon=True)
+               for i in range(concurrency)]
+    def join(thread):
+        while thread.is_alive():
+            try:
+                thread.join(timeout=core.STOP_POLL_SECONDS)
+            except KeyboardInterrupt:
+                log.info("Batch interrupted, finishing the current sentence of each book...")
+                interrupted.set()
+                wakeup.set()
+
+    for t in [parser, packager, *workers]:
+        t.start()
+    for t in workers:
+        join(t)
+    # Workers only return once no book is running, so nothing is left to package
+    workers_done.set()
+    packaging.put(None)
+    join(packager)
+    join(parser)
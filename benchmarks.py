@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# chatterblez - benchmarks
+#
+#   python cli.py bench formats CHAPTER.wav [CHAPTER.wav ...]
+#   python cli.py bench lexicon [--entries 10000]
+#   python cli.py bench accel [--modes fp32,int8,...] [--cuda]
+#   python cli.py bench topology [--max-workers 4] [--cuda]
+#   python cli.py bench onnx [--onnx-dir FOLDER] [--sentences 10] [EPUB ...]
+#   python cli.py bench stop [--trials 10] [--step-ms 20]
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+
+def bench_formats(wav_files, profiles=None, output_folder=None):
+    """
+    Encode the same chapter WAVs with every output profile and report encode
+    time, output size and realtime factor. Returns a list of result dicts.
+    """
+    import core
+    from tabulate import tabulate
+
+    wav_files = [Path(f) for f in wav_files]
+    audio_seconds = sum(core.audio_duration(f) for f in wav_files)
+    profiles = profiles or list(core.OUTPUT_PROFILES)
+    results = []
+    with tempfile.TemporaryDirectory(dir=output_folder) as scratch:
+        for name in profiles:
+            profile = core.get_output_profile(name)
+            start = time.perf_counter()
+            out_path = core.concat_wavs_with_ffmpeg(wav_files, scratch, f'bench_{name}.wav', profile=profile)
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(out_path)
+            results.append({
+                'profile': name,
+                'codec': profile.codec,
+                'bitrate': profile.bitrate,
+                'encode_seconds': elapsed,
+                'size_bytes': size,
+                'x_realtime': audio_seconds / elapsed if elapsed else 0.0,
+            })
+    print(f"Reference audio: {len(wav_files)} files, {audio_seconds / 60:.1f} minutes")
+    print(tabulate([
+        [r['profile'], r['codec'], r['bitrate'], f"{r['encode_seconds']:.2f}", f"{r['size_bytes'] / 1e6:.2f}",
+         f"{r['x_realtime']:.0f}x"]
+        for r in results
+    ], headers=['Profile', 'Codec', 'Bitrate', 'Encode (s)', 'Size (MB)', 'Speed']))
+    return results
+
+
+def _sequential_replace(text, entries):
+    """The former replace_preserve_case loop: one regex compile and one pass over text per entry."""
+    import re
+    import core
+    for old, new in entries:
+        pattern = re.compile(rf'\b{re.escape(old)}\b', re.IGNORECASE)
+        text = pattern.sub(lambda m, new=new: core.match_case(m.group(), new), text)
+    return text
+
+
+def bench_lexicon(entries=10000, text_chars=200000, seed=0):
+    """
+    Time compiling and applying a lexicon of `entries` made-up words against
+    a text of about `text_chars` characters, compared with applying the
+    entries one regex at a time. Returns a dict of timings.
+    """
+    import random
+    import core
+
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+
+    def word():
+        return ''.join(rng.choice(letters) for _ in range(rng.randint(4, 10)))
+
+    pairs = {}
+    while len(pairs) < entries:
+        pairs[word()] = word()
+    pairs = list(pairs.items())
+    vocabulary = [old for old, _ in pairs[:entries // 10]] + [word() for _ in range(entries)]
+    words = []
+    while sum(map(len, words)) + len(words) < text_chars:
+        w = rng.choice(vocabulary)
+        words.append(w.capitalize() if rng.random() < 0.1 else w)
+    text = ' '.join(words)
+
+    start = time.perf_counter()
+    lexicon = core.Lexicon(pairs)
+    compile_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    lexicon.apply(text)
+    apply_seconds = time.perf_counter() - start
+    # The sequential baseline is O(entries x text); time a slice of the entries and extrapolate
+    sample = pairs[:max(entries // 20, 1)]
+    start = time.perf_counter()
+    _sequential_replace(text, sample)
+    sequential_seconds = (time.perf_counter() - start) * len(pairs) / len(sample)
+
+    check_text = text[:5000]
+    assert lexicon.apply(check_text) == _sequential_replace(check_text, pairs), "compiled lexicon output differs"
+
+    print(f"Lexicon: {entries:,} entries, text: {len(text):,} characters")
+    print(f"  compile:           {compile_seconds:.3f} s")
+    print(f"  apply (one pass):  {apply_seconds:.3f} s")
+    print(f"  sequential (est.): {sequential_seconds:.1f} s")
+    return {
+        'compile_seconds': compile_seconds,
+        'apply_seconds': apply_seconds,
+        'sequential_seconds': sequential_seconds,
+    }
+
+
+ACCEL_BENCH_MODES = ['inference', 'bf16', 'int8', 'compile', 'bf16,compile', 'int8,compile']
+
+
+def bench_accel(modes=None, device=None, sentences=None, seed=0, loader=None):
+    """
+    Render the accuracy guard sentences with an fp32 model and with each
+    acceleration setting in modes, each on a freshly loaded model, and report
+    throughput and the accuracy guard against fp32. One sentence is rendered
+    first as a warm-up, so torch.compile's graph building is not timed.
+    loader(accel) returns a model (default: core.load_tts_model). Returns a
+    list of result dicts and prints the fastest setting that passes the guard.
+    """
+    import core
+    from tabulate import tabulate
+
+    loader = loader or (lambda accel: core.load_tts_model(device, accel))
+    sentences = sentences or core.ACCEL_GUARD_SENTENCES
+    chars = sum(map(len, sentences))
+    reference = None
+    results = []
+    for accel in ['fp32'] + [m for m in (modes or ACCEL_BENCH_MODES) if core.parse_accel(m)]:
+        result = {'accel': accel, 'seconds': None, 'chars_per_sec': None, 'x_realtime': None,
+                  'spectral_distance': None, 'duration_ratio': None, 'ok': False, 'error': None}
+        results.append(result)
+        try:
+            model = loader(accel)
+            core.render_guard_sentences(model, sentences[:1], seed)
+            wavs, seconds = core.render_guard_sentences(model, sentences, seed)
+        except Exception as e:  # e.g. bf16 or quantized kernels missing on this CPU
+            result['error'] = str(e).splitlines()[0] if str(e) else type(e).__name__
+            if reference is None:
+                raise
+            continue
+        if reference is None:
+            reference = wavs
+        accuracy = core.accel_accuracy(reference, wavs)
+        result.update(seconds=seconds, chars_per_sec=chars / seconds,
+                      x_realtime=sum(map(len, wavs)) / model.sr / seconds,
+                      spectral_distance=accuracy.spectral_distance, duration_ratio=accuracy.duration_ratio,
+                      ok=accuracy.ok)
+        del model
+
+    print(f"Guard set: {len(sentences)} sentences, {chars} characters")
+    print(tabulate([
+        [r['accel'],
+         *(['-', '-', '-', '-', r['error']] if r['error'] else
+           [f"{r['chars_per_sec']:.1f}", f"{r['x_realtime']:.2f}x", f"{r['spectral_distance']:.2f}",
+            f"{r['duration_ratio']:.2f}", 'ok' if r['ok'] else 'REJECTED'])]
+        for r in results
+    ], headers=['Accel', 'Chars/s', 'Speed', 'Spectral dist. (dB)', 'Duration ratio', 'Guard']))
+    accepted = [r for r in results if r['ok']]
+    if accepted:
+        best = max(accepted, key=lambda r: r['chars_per_sec'])
+        print(f"Fastest accurate setting: --accel {best['accel']}")
+    return results
+
+
+def bench_topology(device=None, sentences=None, max_workers=4, seed=0, loader=None, save=True):
+    """
+    Render a reference passage with every (threads, workers) combination from
+    core.topology_candidates(): `workers` models each render the passage in
+    their own thread with torch using `threads` intra-op threads. The fastest
+    combination in sentences/sec is saved as this host's topology and applied
+    by later runs. loader() returns a model (default: core.load_tts_model).
+    Returns a list of result dicts.
+    """
+    import threading
+    import torch
+    import core
+    from tabulate import tabulate
+
+    device = device or core.default_device()
+    loader = loader or (lambda: core.load_tts_model(device))
+    sentences = sentences or core.ACCEL_GUARD_SENTENCES[:3]
+    models = []
+    results = []
+    for threads, workers in core.topology_candidates(max_workers=max_workers):
+        while len(models) < workers:
+            models.append(loader())
+            core.render_guard_sentences(models[-1], sentences[:1], seed)  # warm-up
+        core.set_torch_threads(threads)
+        errors = []
+
+        def render(model):
+            try:
+                core.render_guard_sentences(model, sentences, seed)
+            except Exception as e:
+                errors.append(e)
+
+        start = time.perf_counter()
+        pool = [threading.Thread(target=render, args=(m,)) for m in models[:workers]]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        seconds = time.perf_counter() - start
+        if errors:
+            raise errors[0]
+        results.append({'threads': threads, 'workers': workers, 'seconds': seconds,
+                        'sentences_per_sec': len(sentences) * workers / seconds})
+
+    best = max(results, key=lambda r: r['sentences_per_sec'])
+    print(f"Reference passage: {len(sentences)} sentences, {os.cpu_count()} cores, device {device}")
+    print(tabulate([
+        [r['threads'], r['workers'], f"{r['seconds']:.1f}", f"{r['sentences_per_sec']:.2f}", '*' if r is best else '']
+        for r in results
+    ], headers=['Threads/book', 'Books at once', 'Seconds', 'Sentences/s', 'Best']))
+    if save:
+        core.save_topology(SimpleNamespace(threads=best['threads'], workers=best['workers'],
+                                           sentences_per_sec=best['sentences_per_sec'], tuned_at=time.time()), device)
+        print(f"Saved {best['threads']} threads per book, {best['workers']} books at once to {core.TOPOLOGY_FILE}")
+    return results
+
+
+TEST_EPUBS = sorted((Path(__file__).parent / 'test_epubs').glob('*.epub'))
+
+
+def book_sentences(epub_paths, per_book=10):
+    """The first per_book sentences of each book, cleaned and split the way core.main prepares them."""
+    import core
+    nlp = core.get_nlp()
+    sentences = []
+    for path in epub_paths:
+        document = core.load_document(str(path))
+        book = []
+        for chapter in core.select_chapters(document):
+            text = core.normalize_chapter_text(chapter.extracted_text)
+            book.extend(text[start:end].strip() for start, end in core.split_sentences(nlp, text))
+            if len(book) >= per_book:
+                break
+        sentences.extend(book[:per_book])
+    return sentences
+
+
+def bench_onnx(epub_paths=None, onnx_dir=None, device=None, per_book=10, seed=0):
+    """
+    Render the opening sentences of the test EPUBs with the PyTorch backend
+    and with the ONNX Runtime backend and report sentences/sec, and the
+    accuracy guard of the ONNX renderings against PyTorch. Returns a list of
+    result dicts.
+    """
+    import core
+    from tabulate import tabulate
+
+    sentences = book_sentences(epub_paths or TEST_EPUBS, per_book)
+    reference = None
+    results = []
+    for backend in core.TTS_BACKENDS:
+        model = core.load_tts_model(device, backend=backend, onnx_dir=onnx_dir)
+        core.render_guard_sentences(model, sentences[:1], seed)
+        wavs, seconds = core.render_guard_sentences(model, sentences, seed)
+        reference = reference or wavs
+        accuracy = core.accel_accuracy(reference, wavs)
+        results.append({'backend': backend, 'seconds': seconds, 'sentences_per_sec': len(sentences) / seconds,
+                        'x_realtime': sum(map(len, wavs)) / model.sr / seconds,
+                        'spectral_distance': accuracy.spectral_distance, 'duration_ratio': accuracy.duration_ratio,
+                        'ok': accuracy.ok})
+        del model
+
+    print(f"Test set: {len(sentences)} sentences from {len(epub_paths or TEST_EPUBS)} books")
+    print(tabulate([
+        [r['backend'], f"{r['sentences_per_sec']:.2f}", f"{r['x_realtime']:.2f}x", f"{r['spectral_distance']:.2f}",
+         f"{r['duration_ratio']:.2f}", 'ok' if r['ok'] else 'REJECTED']
+        for r in results
+    ], headers=['Backend', 'Sentences/s', 'Speed', 'Spectral dist. (dB)', 'Duration ratio', 'Guard']))
+    return results
+
+
+def bench_stop(trials=10, step_seconds=0.02, steps=200, epub_path=None, seed=0):
+    """
+    Start converting a book with a weightless stand-in model whose sentences
+    take `steps` decoding steps of step_seconds, request a stop at a random
+    moment within a sentence, `trials` times; then do the same to an ffmpeg
+    encode. Reports the time from the stop request until main() (or the
+    ffmpeg run) returned. Returns a dict with the latencies in seconds.
+    """
+    import random
+    import threading
+    import torch
+    import core
+
+    class StepModule(torch.nn.Module):
+        def forward(self, x):
+            time.sleep(step_seconds)
+            return x
+
+    class SteppedModel:
+        """Stand-in for ChatterboxTTS: generate() runs `steps` transformer steps through t3.tfmr like the real decoding loop."""
+        sr = 24000
+        t3 = SimpleNamespace(tfmr=StepModule())
+
+        def generate(self, text, **kwargs):
+            x = torch.zeros(1)
+            for _ in range(steps):
+                x = self.t3.tfmr(x)
+            t = torch.arange(int(core.QA_TYPICAL_SECONDS_PER_CHAR * self.sr * max(len(text), 1))) / self.sr
+            return (0.3 * torch.sin(2 * torch.pi * 220 * t)).unsqueeze(0)
+
+    rng = random.Random(seed)
+    model = core.install_cancel_checkpoints(SteppedModel())
+    sentence_seconds = steps * step_seconds
+
+    def time_to_stop(run, delay):
+        stop = threading.Event()
+        worker = threading.Thread(target=run, args=(stop.is_set,))
+        worker.start()
+        time.sleep(delay)
+        requested = time.perf_counter()
+        stop.set()
+        worker.join()
+        return time.perf_counter() - requested
+
+    synthesis = []
+    with tempfile.TemporaryDirectory() as scratch:
+        for _ in range(trials):
+            synthesis.append(time_to_stop(
+                lambda should_stop: core.main(str(epub_path or TEST_EPUBS[0]), False, 1.0, output_folder=scratch,
+                                              cb_model=model, should_stop=should_stop),
+                2.0 + rng.uniform(0, sentence_seconds)))
+    encode = [time_to_stop(
+        lambda should_stop: core.run_media_command(
+            ['ffmpeg', '-nostdin', '-f', 'lavfi', '-i', 'sine=duration=36000', '-c:a', 'aac', '-f', 'null', '-'],
+            label='FFmpeg STOP', should_stop=should_stop),
+        rng.uniform(0.5, 1.5)) for _ in range(max(trials // 2, 1))]
+
+    print(f"Time to stop, {trials} trials, sentences of {sentence_seconds:.1f} s in steps of {step_seconds * 1000:.0f} ms:")
+    print(f"  synthesis: mean {sum(synthesis) / len(synthesis):.3f} s, max {max(synthesis):.3f} s")
+    print(f"  ffmpeg:    mean {sum(encode) / len(encode):.3f} s, max {max(encode):.3f} s")
+    return {'synthesis_seconds': synthesis, 'ffmpeg_seconds': encode}
+
+
+def bench_main(argv=None):
+    parser = argparse.ArgumentParser(prog='cli.py bench', description="Chatterblez benchmarks")
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+
+    formats = sub.add_parser('formats', help='Compare encode time and size of the output profiles')
+    formats.add_argument('wav_files', nargs='+', help='Chapter audio files (.flac or .wav) of a reference book')
+    formats.add_argument('--profiles', help='Comma-separated profile names (default: all)')
+
+    lexicon = sub.add_parser('lexicon', help='Compare the compiled lexicon against per-entry regex replacement')
+    lexicon.add_argument('--entries', type=int, default=10000, help='Number of lexicon entries (default: 10000)')
+    lexicon.add_argument('--chars', type=int, default=200000, help='Length of the generated text (default: 200000)')
+
+    accel = sub.add_parser('accel', help='Compare inference acceleration modes for speed and accuracy against fp32')
+    accel.add_argument('--modes', help=f"Semicolon-separated settings to try (default: {';'.join(ACCEL_BENCH_MODES)})")
+    accel.add_argument('--cuda', default=False, help='Benchmark on the GPU instead of the CPU', action='store_true')
+
+    topology = sub.add_parser('topology', help='Find and save the fastest torch thread count and number of concurrent books')
+    topology.add_argument('--max-workers', type=int, default=4, help='Most books converted at once to try (default: 4)')
+    topology.add_argument('--cuda', default=False, help='Tune for the GPU instead of the CPU', action='store_true')
+    topology.add_argument('--no-save', default=False, help='Only report, keep the saved topology', action='store_true')
+
+    onnx = sub.add_parser('onnx', help='Compare the ONNX Runtime backend with PyTorch on the test EPUBs')
+    onnx.add_argument('epubs', nargs='*', help='Books to take sentences from (default: the bundled test EPUBs)')
+    onnx.add_argument('--onnx-dir', help='Folder of the ONNX export (default: ~/.cache/chatterblez/onnx)')
+    onnx.add_argument('--sentences', type=int, default=10, help='Sentences rendered per book (default: 10)')
+    onnx.add_argument('--cuda', default=False, help='Benchmark on the GPU instead of the CPU', action='store_true')
+
+    stop = sub.add_parser('stop', help='Measure how long a stop request takes to end synthesis and ffmpeg, without the model')
+    stop.add_argument('--trials', type=int, default=10, help='Stop requests to time (default: 10)')
+    stop.add_argument('--step-ms', type=float, default=20.0, help='Duration of one simulated decoding step (default: 20)')
+    stop.add_argument('--epub', help='Book to convert (default: the first bundled test EPUB)')
+
+    args = parser.parse_args(argv)
+    if args.benchmark == 'formats':
+        missing = [f for f in args.wav_files if not os.path.isfile(f)]
+        if missing:
+            print(f"File does not exist: {missing[0]}", file=sys.stderr)
+            sys.exit(1)
+        bench_formats(args.wav_files, args.profiles.split(',') if args.profiles else None)
+    elif args.benchmark == 'lexicon':
+        bench_lexicon(args.entries, args.chars)
+    elif args.benchmark == 'accel':
+        bench_accel(args.modes.split(';') if args.modes else None, 'cuda' if args.cuda else 'cpu')
+    elif args.benchmark == 'topology':
+        bench_topology('cuda' if args.cuda else 'cpu', max_workers=args.max_workers, save=not args.no_save)
+    elif args.benchmark == 'onnx':
+        bench_onnx(args.epubs or None, args.onnx_dir, 'cuda' if args.cuda else 'cpu', args.sentences)
+    elif args.benchmark == 'stop':
+        bench_stop(args.trials, args.step_ms / 1000, epub_path=args.epub)
+
+
+if __name__ == '__main__':
+    bench_main()
@@ -4,9 +4,39 @@ import sys
 import os
 from pathlib import Path
 
+from logs import LOG_FORMATS, LOG_LEVELS, configure_logging, get_logger
+
+log = get_logger('cli')
+
+# Mirrors core.OUTPUT_PROFILES; core is imported only after the torch device is chosen
+OUTPUT_FORMATS = ['aac', 'opus', 'mp3']
+
+
 def cli_main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        from server import serve_main
+        serve_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] in ('bench', 'model-store', 'export-onnx'):
+        configure_logging()
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        from benchmarks import bench_main
+        bench_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'model-store':
+        from model_store import store_main
+        store_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'export-onnx':
+        from onnx_backend import export_main
+        export_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
         description="Chatterblez  CLI - Convert EPUB/PDF to Audiobook",
+        epilog="Run 'cli.py serve --help' to start the headless daemon, 'cli.py bench --help' for benchmarks, "
+               "'cli.py model-store --help' to pin the model for offline use, or 'cli.py export-onnx --help' to "
+               "export the model for --backend onnx.",
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
     group = parser.add_mutually_exclusive_group(required=True)
@@ -18,21 +48,50 @@ def cli_main():
     parser.add_argument('--wav', help='Path to a WAV file for voice conditioning (audio prompt)')
     parser.add_argument('--speed', type=float, default=1.0, help='Speech speed (default: 1.0)')
     parser.add_argument('--cuda', default=False, help='Use GPU via Cuda in Torch if available', action='store_true')
+    parser.add_argument('--accel', default='fp32', help='Inference acceleration: fp32, inference, bf16, int8 or compile, or a comma-separated combination such as "int8,compile"; "cli.py bench accel" finds the fastest accurate one (default: fp32)')
+    parser.add_argument('--backend', choices=['torch', 'onnx'], default='torch', help='Run the transformer and vocoder in PyTorch or in ONNX Runtime; onnx needs a "cli.py export-onnx" export first (default: torch)')
+    parser.add_argument('--onnx-dir', metavar='FOLDER', help='Folder of the ONNX export used by --backend onnx (default: ~/.cache/chatterblez/onnx)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='aac', help='Audiobook format: aac (m4b), opus (ogg/opus) or mp3, each with chapters (default: aac)')
+    parser.add_argument('--stream', choices=OUTPUT_FORMATS, help='Also encode each chapter as soon as it is finished and keep an .m3u playlist of them, so listening can start before the book is done')
+    parser.add_argument('--split-hours', type=float, metavar='HOURS', help='Split the audiobook at chapter boundaries into parts of at most this many hours, listed in a <book>_parts.m3u playlist')
+    parser.add_argument('--split-mb', type=float, metavar='MB', help='Split the audiobook at chapter boundaries into parts of at most about this many megabytes')
+    parser.add_argument('--intermediate', choices=['flac', 'wav'], default='flac', help='Format of the per-chapter files kept for resuming (default: flac, about half the size of wav)')
+    parser.add_argument('--pauses', help='Seconds of silence after a sentence, a paragraph and a chapter, e.g. "0.35,0.8,1.5"')
+    parser.add_argument('--no-trim', default=False, help='Keep the silence the model generates around each sentence', action='store_true')
+    parser.add_argument('--loudness', type=float, default=-18.0, help='Integrated loudness (LUFS) every chapter is normalized to (default: -18)')
+    parser.add_argument('--no-loudnorm', default=False, help='Keep the loudness of the generated audio unchanged', action='store_true')
+    parser.add_argument('--no-qa', default=False, help='Keep every sentence as first rendered, without checking its length and loudness', action='store_true')
+    parser.add_argument('--lexicon', action='append', metavar='FILE', help='Pronunciation dictionary with one "written=spoken" entry per line; may be given more than once')
+    parser.add_argument('--jobs', type=int, help='Batch: number of books to convert concurrently (default: as tuned by "cli.py bench topology", else 1)')
+    parser.add_argument('--priority', type=int, default=0, help='Batch: priority of the queued books, higher runs first (default: 0)')
+    parser.add_argument('--retries', type=int, default=2, help='Batch: retries per failed book before giving up (default: 2)')
+    parser.add_argument('--retry-backoff', type=float, default=30.0, help='Batch: seconds before the first retry, doubled on each further retry (default: 30)')
+    parser.add_argument('--retry-failed', default=False, help='Batch: re-queue books that failed in a previous run', action='store_true')
+    parser.add_argument('--farm', default=False, help='Render chapters together with other --farm workers (on this or other hosts) that share the output folder; all workers must use the same voice, model source, --accel, --backend and chapter settings', action='store_true')
+    parser.add_argument('--lease-seconds', type=float, default=120.0, help='Farm: seconds after which a chapter claimed by an unresponsive worker is taken over (default: 120)')
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='info', help='Least severe messages to log: info logs a summary line per book and chapter, debug adds the chapter text and ffmpeg output (default: info)')
+    parser.add_argument('--log-format', choices=LOG_FORMATS, default='text', help='Log as readable lines or as one JSON object per line for log collectors (default: text)')
 
     if len(sys.argv) == 1:
         parser.print_help(sys.stderr)
         sys.exit(1)
     args = parser.parse_args()
+    configure_logging(args.log_level, args.log_format)
 
     if args.cuda:
         import torch.cuda
         if torch.cuda.is_available():
-            print('CUDA GPU available')
+            log.info('CUDA GPU available')
             torch.set_default_device('cuda')
         else:
-            print('CUDA GPU not available. Defaulting to CPU')
+            log.warning('CUDA GPU not available. Defaulting to CPU')
 
-    from core import main
+    from core import main, parse_accel
+    try:
+        parse_accel(args.accel)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
 
     # Prepare ignore_list
     ignore_list = [s.strip() for s in args.filterlist.split(',')] if args.filterlist else None
@@ -47,6 +106,45 @@ def cli_main():
     # Prepare speed
     speed = args.speed
 
+    # Load the pronunciation dictionaries once for every book
+    lexicon = None
+    if args.lexicon:
+        missing = [f for f in args.lexicon if not os.path.isfile(f)]
+        if missing:
+            print(f"Lexicon file does not exist: {missing[0]}", file=sys.stderr)
+            sys.exit(1)
+        from core import load_lexicon
+        lexicon = load_lexicon(args.lexicon)
+
+    # Prepare pauses
+    pauses = None
+    if args.pauses:
+        try:
+            sentence, paragraph, chapter = (float(p) for p in args.pauses.split(','))
+        except ValueError:
+            print(f"--pauses expects three comma-separated numbers, got: {args.pauses}", file=sys.stderr)
+            sys.exit(1)
+        pauses = {'sentence': sentence, 'paragraph': paragraph, 'chapter': chapter}
+
+    main_kwargs = dict(
+        speed=speed,
+        ignore_list=ignore_list,
+        audio_prompt_wav=audio_prompt_wav,
+        stream_output=args.stream,
+        output_format=args.format,
+        pauses=pauses,
+        silence_trim=not args.no_trim,
+        intermediate_format=args.intermediate,
+        target_lufs=None if args.no_loudnorm else args.loudness,
+        lexicon=lexicon,
+        accel=args.accel,
+        backend=args.backend,
+        onnx_dir=args.onnx_dir,
+        max_part_hours=args.split_hours,
+        max_part_mb=args.split_mb,
+        qa=not args.no_qa
+    )
+
     # Batch mode
     if args.batch:
         folder = Path(args.batch)
@@ -62,29 +160,37 @@ def cli_main():
         if not batch_files:
             print("No supported files (.epub, .pdf) found in the selected folder.", file=sys.stderr)
             sys.exit(1)
-        main(
-            file_path=None,
-            pick_manually=False,
-            speed=speed,
-            output_folder=output_folder,
-            batch_files=batch_files,
-            ignore_list=ignore_list,
-            audio_prompt_wav=audio_prompt_wav
-        )
+        if args.farm:
+            from farm import run_farm_worker
+            run_farm_worker(sorted(batch_files), output_folder=output_folder, lease_seconds=args.lease_seconds,
+                            **main_kwargs)
+            return
+        from batch_queue import JobStore, run_batch
+        # Progress is kept in the output folder, so re-running the same command resumes the batch
+        store = JobStore(output_folder, max_attempts=args.retries + 1, retry_backoff=args.retry_backoff)
+        store.add_books(batch_files, priority=args.priority)
+        if args.retry_failed:
+            store.retry_failed()
+        log.info("Batch queue %s: %s", store.db_path, store.summary())
+        run_batch(store, concurrency=args.jobs, output_folder=output_folder, **main_kwargs)
+        log.info("Batch queue %s: %s", store.db_path, store.summary())
+        store.close()
     # Single file mode
     elif args.file:
         file_path = args.file
         if not os.path.isfile(file_path):
             print(f"File does not exist: {file_path}", file=sys.stderr)
             sys.exit(1)
+        if args.farm:
+            from farm import run_farm_worker
+            run_farm_worker([file_path], output_folder=output_folder, lease_seconds=args.lease_seconds, **main_kwargs)
+            return
         main(
             file_path=file_path,
             pick_manually=False,
-            speed=speed,
             output_folder=output_folder,
             batch_files=None,
-            ignore_list=ignore_list,
-            audio_prompt_wav=audio_prompt_wav
+            **main_kwargs
         )
 
 if __name__ == '__main__':
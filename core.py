@@ -6,7 +6,10 @@
 # by Claudio Santini 2025 - https://claudio.uk
 import os
 import sys
-import traceback
+import logging
+import hashlib
+import json
+import zlib
 from glob import glob
 
 import torch.cuda
@@ -28,11 +31,22 @@ from bs4 import BeautifulSoup
 from ebooklib import epub
 from pick import pick
 import threading
-import queue  # Import queue for concurrent reading
+import queue
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+from contextlib import contextmanager
 from functools import lru_cache
 
+from logs import get_logger
+
+log = get_logger('core')
+ffmpeg_log = get_logger('ffmpeg')
+model_log = get_logger('model')
+
 sample_rate = 24000
+DEFAULT_TARGET_LUFS = -18.0  # chapter loudness target, see LoudnessMeter
 
 import string
 
@@ -89,7 +103,7 @@ def update_stats(stats, added_chars):
 
 def load_spacy():
     if not spacy.util.is_package("en_core_web_trf"):
-        print("Downloading Spacy model en_core_web_trf...")
+        log.info("Downloading Spacy model en_core_web_trf...")
         spacy.cli.download("en_core_web_trf")
 
 
@@ -142,18 +156,16 @@ def set_espeak_library():
                 raise RuntimeError(
                     "eSpeak NG library not found in default paths. Please set ESPEAK_LIBRARY environment variable.")
         else:
-            print('Unsupported OS, please set the espeak library path manually')
+            log.warning('Unsupported OS, please set the espeak library path manually')
             return
-        print('Using espeak library:', library)
+        log.debug('Using espeak library: %s', library)
         from phonemizer.backend.espeak.wrapper import EspeakWrapper
         EspeakWrapper.set_library(library)
     except Exception:
-        traceback.print_exc()
-        print("Error finding espeak-ng library:")
-        print("Probably you haven't installed espeak-ng.")
-        print("On Mac: brew install espeak-ng")
-        print("On Linux: sudo apt install espeak-ng")
-        print("On Windows: Download from https://github.com/espeak-ng/espeak-ng/releases")
+        log.exception("Error finding espeak-ng library. Probably you haven't installed espeak-ng.\n"
+                      "On Mac: brew install espeak-ng\n"
+                      "On Linux: sudo apt install espeak-ng\n"
+                      "On Windows: Download from https://github.com/espeak-ng/espeak-ng/releases")
 
 
 def match_case(word, replacement):
@@ -170,16 +182,105 @@ def match_case(word, replacement):
 def replace_preserve_case(text, old, new):
     if len(old) != len(new):
         raise ValueError("Replacement arrays must be the same length.")
+    return _pair_lexicon(tuple(old), tuple(new)).apply(text)
 
-    for o, n in zip(old, new):
-        pattern = re.compile(rf'\b{re.escape(o)}\b', re.IGNORECASE)
 
-        def repl(match):
-            return match_case(match.group(), n)
+@lru_cache(maxsize=8)
+def _pair_lexicon(old, new):
+    return Lexicon(zip(old, new))
 
-        text = pattern.sub(repl, text)
 
-    return text
+def _trie_regex(words):
+    """
+    Build a regex matching any of words from a character trie, so matching
+    costs O(length of the longest word) per text position instead of one
+    attempt per word as with a flat alternation.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node):
+        optional = '' in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        single_chars = all(len(b) == 1 or (len(b) == 2 and b[0] == '\\') for b in branches)
+        group = f"[{''.join(branches)}]" if single_chars and len(branches) > 1 else f"(?:{'|'.join(branches)})"
+        return group + '?' if optional else group
+
+    return build(trie)
+
+
+class Lexicon:
+    """
+    Pronunciation / substitution dictionary compiled into a single
+    case-insensitive trie regex. apply() rewrites all entries in one pass over
+    the text, keeping the case of the matched word (see match_case). Entries
+    only match whole words; the longest entry wins where several match.
+    """
+
+    def __init__(self, entries=()):
+        self.replacements = {}
+        for old, new in entries:
+            if old.strip():
+                self.replacements[old.strip().lower()] = new.strip()
+        self.pattern = None
+        if self.replacements:
+            self.pattern = re.compile(rf'(?<!\w)(?:{_trie_regex(self.replacements)})(?!\w)', re.IGNORECASE)
+
+    def __len__(self):
+        return len(self.replacements)
+
+    def fingerprint(self):
+        """Digest of the entries, so cached text rewritten with this lexicon can be told apart."""
+        return hashlib.sha256(json.dumps(sorted(self.replacements.items())).encode('utf-8')).hexdigest()
+
+    def apply(self, text):
+        if self.pattern is None:
+            return text
+        replacements = self.replacements
+        return self.pattern.sub(lambda m: match_case(m.group(), replacements[m.group().lower()]), text)
+
+    @classmethod
+    def load(cls, *paths):
+        """
+        Read dictionary files with one `written=spoken` entry per line (a tab
+        may be used instead of '='). Blank lines and lines starting with # are
+        ignored. Later files override earlier ones.
+        """
+        entries = []
+        for path in paths:
+            with open(path, encoding='utf-8') as f:
+                for line_number, line in enumerate(f, start=1):
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    sep = '\t' if '\t' in line else '='
+                    if sep not in line:
+                        raise ValueError(f"{path}:{line_number}: expected 'written=spoken', got {line!r}")
+                    old, new = line.split(sep, 1)
+                    entries.append((old, new))
+        return cls(entries)
+
+
+@lru_cache(maxsize=4)
+def _load_lexicon_cached(files):
+    return Lexicon.load(*(path for path, _ in files))
+
+
+def load_lexicon(paths):
+    """Lexicon.load() memoized on path + mtime, so long-lived processes compile each dictionary once."""
+    if not paths:
+        return None
+    if isinstance(paths, (str, Path)):
+        paths = [paths]
+    return _load_lexicon_cached(tuple((str(Path(p).resolve()), os.path.getmtime(p)) for p in paths))
 
 # Define only "speakable" punctuation - ones that affect how text is read aloud
 SPEAKABLE_PUNCT = '.,-\'"'
@@ -250,41 +351,80 @@ def clean_line(line: str) -> str:
     line = space_re.sub(' ', line)                            # Collapse spaces
     return line.strip()
 def main(file_path, pick_manually, speed, book_year='', output_folder='.',
-         max_chapters=None, max_sentences=None, selected_chapters=None, post_event=None, audio_prompt_wav=None, batch_files=None, ignore_list=None, should_stop=None):
+         max_chapters=None, max_sentences=None, selected_chapters=None, post_event=None, audio_prompt_wav=None, batch_files=None, ignore_list=None, should_stop=None,
+         cb_model=None, stream_output=None, output_format='aac', pauses=None, silence_trim=True,
+         intermediate_format='flac', target_lufs=DEFAULT_TARGET_LUFS, lexicon=None, document=None,
+         packager=None, keep_intermediates=True, chapter_claim=None, accel='fp32', backend='torch',
+         onnx_dir=None, max_part_hours=None, max_part_mb=None, qa=True):
     """
     Main entry point for audiobook synthesis.
     - ignore_list: list of chapter names to ignore (case-insensitive substring match)
     - batch_files: if provided, a list of file paths to process sequentially
     - should_stop: optional callback, returns True if synthesis should be interrupted
+    - cb_model: optional already loaded model from load_tts_model(), reused instead of loading a new one
+    - accel: acceleration modes for the model main() loads when cb_model is None, see ACCEL_MODES
+    - backend, onnx_dir: synthesis backend of that model, 'torch' or 'onnx' (see load_tts_model)
+    - stream_output: optional profile name from OUTPUT_PROFILES; each finished chapter is encoded to a
+      standalone file and added to an M3U playlist while the rest of the book is synthesized
+    - output_format: profile name from OUTPUT_PROFILES used for the final audiobook (default 'aac', an m4b)
+    - pauses: seconds of silence per boundary type, see DEFAULT_PAUSES
+    - silence_trim: trim leading/trailing silence from every generated sentence
+    - intermediate_format: 'flac' or 'wav' (see INTERMEDIATE_FORMATS) for the per-chapter files
+    - target_lufs: integrated loudness every chapter is normalized to while it is written; None disables
+    - lexicon: optional Lexicon, or dictionary file path(s) for load_lexicon(), applied to the text before synthesis
+    - document: optional Document of file_path from load_document(); selected_chapters must come from it
+    - packager: optional object with submit(fn); the ffmpeg packaging step is handed to it as a callable
+      instead of being run before main returns (see run_batch_pipeline)
+    - keep_intermediates: keep the book's work directory (chapter audio, see job_work_dir) after the
+      audiobook was created; when False it is removed on success
+    - max_part_hours, max_part_mb: split the audiobook at chapter boundaries into parts no longer/larger than
+      this, packaged in parallel and listed in a playlist (see split_into_parts); None for a single file
+    - qa: check every rendered sentence and re-generate the ones that fail (see render_sentence); the
+      re-generated sentences of each chapter are listed in <chapter>.qa.json in the work folder
+    - chapter_claim: optional callable(chapter_wav_path, render_inputs) returning a lease with release(), or
+      None when another process renders that chapter; such chapters are skipped and the book is only
+      packaged once every chapter file exists (see farm.py). It may raise to refuse the render inputs
     """
     if should_stop is None:
         should_stop = lambda: False
 
+    apply_topology(getattr(cb_model, 'device', None))
+
     if batch_files is not None:
-        # Sequentially process each file in batch_files
-        for batch_file in batch_files:
-            # Call main for each file, passing ignore_list and other params
-            main(
-                file_path=batch_file,
-                pick_manually=pick_manually,
-                speed=speed,
-                book_year=book_year,
-                output_folder=output_folder,
-                max_chapters=max_chapters,
-                max_sentences=max_sentences,
-                selected_chapters=None,
-                post_event=post_event,
-                audio_prompt_wav=audio_prompt_wav,
-                batch_files=None,  # Prevent infinite recursion
-                ignore_list=ignore_list,
-                should_stop=should_stop
-            )
-            if post_event:
-                post_event('CORE_FILE_FINISHED', file_path=batch_file)
-            if should_stop():
-                break
+        # Parse the next book and package the previous one while this one is synthesized
+        run_batch_pipeline(
+            batch_files,
+            pick_manually=pick_manually,
+            speed=speed,
+            book_year=book_year,
+            output_folder=output_folder,
+            max_chapters=max_chapters,
+            max_sentences=max_sentences,
+            post_event=post_event,
+            audio_prompt_wav=audio_prompt_wav,
+            ignore_list=ignore_list,
+            should_stop=should_stop,
+            cb_model=cb_model,
+            stream_output=stream_output,
+            output_format=output_format,
+            pauses=pauses,
+            silence_trim=silence_trim,
+            intermediate_format=intermediate_format,
+            target_lufs=target_lufs,
+            lexicon=lexicon,
+            accel=accel,
+            backend=backend,
+            onnx_dir=onnx_dir,
+            max_part_hours=max_part_hours,
+            max_part_mb=max_part_mb,
+            qa=qa
+        )
         return
 
+    profile = get_output_profile(output_format)
+    chapter_format = get_intermediate_format(intermediate_format)
+    if lexicon is not None and not isinstance(lexicon, Lexicon):
+        lexicon = load_lexicon(lexicon)
     if post_event: post_event('CORE_STARTED')
     IS_WINDOWS = sys.platform.startswith("win")
 
@@ -296,68 +436,34 @@ def main(file_path, pick_manually, speed, book_year='', output_folder='.',
 
     filename = Path(file_path).name
     extension = os.path.splitext(file_path)[1].lower()
-    print(f"extension {extension}")
-    if extension == '.pdf':
-        title = os.path.splitext(os.path.basename(file_path))[0]
-        creator = "Unknown"
-        cover_image = b""
-        document_chapters = selected_chapters
-    else:
+    log.debug('extension %s', extension)
+    work_dir = job_work_dir(output_folder, file_path)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    preprocess_cache = PreprocessCache(output_folder, file_path, lexicon)
+    if document is None and preprocess_cache.document is not None:
+        document = preprocess_cache.document
+        log.debug('Using preprocessed chapters from %s', preprocess_cache.path)
+    if document is None:
+        document = load_document(file_path)
+    if preprocess_cache.document is None:
+        preprocess_cache.set_document(document)
+    if extension != '.pdf':
         extension = '.epub'
-        book = epub.read_epub(file_path)
-        meta_title = book.get_metadata('DC', 'title')
-        title = meta_title[0][0] if meta_title else ''
-        meta_creator = book.get_metadata('DC', 'creator')
-        creator = meta_creator[0][0] if meta_creator else ''
-        cover_maybe = find_cover(book)
-        cover_image = cover_maybe.get_content() if cover_maybe else b""
-        if cover_maybe:
-            print(f'Found cover image {cover_maybe.file_name} in {cover_maybe.media_type} format')
-            if False:
-                # Save cover image as "<book name>.<image extension>"
-                media_type = cover_maybe.media_type  # e.g., "image/jpeg"
-                ext_map = {
-                    "image/jpeg": ".jpg",
-                    "image/jpg": ".jpg",
-                    "image/png": ".png",
-                    "image/gif": ".gif",
-                    "image/bmp": ".bmp",
-                    "image/webp": ".webp"
-                }
-                ext = ext_map.get(media_type, ".img")
-                # Clean title for filename
-                safe_title = re.sub(r'[\\/:*?"<>|]', '_', title).strip() or "cover"
-                cover_filename = f"{safe_title}{ext}"
-                cover_path = Path(output_folder) / cover_filename
-                with open(cover_path, "wb") as f:
-                    f.write(cover_image)
-                print(f"Cover image saved as {cover_path}")
-        document_chapters = find_document_chapters_and_extract_texts(book)
-
-        if not selected_chapters:
-            if pick_manually is True:
-                selected_chapters = pick_chapters(document_chapters)
-            else:
-                selected_chapters = find_good_chapters(document_chapters)
-    if selected_chapters is None:
-        selected_chapters = document_chapters
+    title, creator = document.title, document.creator
+    document_chapters = document.chapters
 
-    # Filter chapters based on ignore_list
-    if ignore_list:
-        def should_include(chapter):
-            name = chapter.get_name().lower()
-            for ignore in ignore_list:
-                if ignore.lower() in name:
-                    return False
-            return True
-        selected_chapters = [c for c in selected_chapters if should_include(c)]
+    selected_chapters = select_chapters(document, selected_chapters, pick_manually, ignore_list)
 
     print_selected_chapters(document_chapters, selected_chapters)
-    texts = [c.extracted_text for c in selected_chapters]
+    # Normalized text and sentence boundaries, reused from the cache when the source is unchanged
+    nlp = get_nlp()
+    prepared_chapters = [preprocess_cache.prepare(c, lexicon, nlp) for c in selected_chapters]
+    preprocess_cache.save()
+    texts = [text for text, _ in prepared_chapters]
 
     has_ffmpeg = shutil.which('ffmpeg') is not None
     if not has_ffmpeg:
-        print('\033[91m' + 'ffmpeg not found. Please install ffmpeg to create mp3 and m4b audiobook files.' + '\033[0m')
+        log.error('ffmpeg not found. Please install ffmpeg to create mp3 and m4b audiobook files.')
         if post_event:
             post_event('CORE_ERROR', message="FFmpeg not found. Please install it to create audiobooks.")
         allow_sleep()
@@ -371,130 +477,786 @@ def main(file_path, pick_manually, speed, book_year='', output_folder='.',
         eta='–',
         progress=0
     )
-    print('Started at:', time.strftime('%H:%M:%S'))
-    print(f'Total characters: {stats.total_chars:,}')
-    print('Total words:', len(' '.join(texts).split()))
     eta = strfdelta((stats.total_chars - stats.processed_chars) / stats.chars_per_sec)
-    print(f'Estimated time remaining (assuming {stats.chars_per_sec} chars/sec): {eta}')
+    log.info('Started %s: %d chapters, %s characters, %d words, estimated %s (assuming %d chars/sec)',
+             filename, len(selected_chapters), f'{stats.total_chars:,}', len(' '.join(texts).split()), eta,
+             stats.chars_per_sec, extra={'book': filename, 'chapters': len(selected_chapters),
+                                         'characters': stats.total_chars})
     chapter_wav_files = []
 
-    import torchaudio as ta
-    from chatterbox.tts import ChatterboxTTS
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f'running on device: {device}')
-
-    cb_model = ChatterboxTTS.from_pretrained(device=device)
-
-    # If a custom audio prompt is provided, use it
-    if audio_prompt_wav:
-        AUDIO_PROMPT_PATH = audio_prompt_wav
-        cb_model.prepare_conditionals(wav_fpath=AUDIO_PROMPT_PATH)
-    # You must set AUDIO_PROMPT_PATH to the correct path for your audio prompt
-    # AUDIO_PROMPT_PATH = "audio_prompt.wav"  # <-- Set this to your actual prompt file
-    # cb_model.prepare_conditionals(wav_fpath=AUDIO_PROMPT_PATH)
+    if cb_model is None:
+        cb_model = load_tts_model(accel=accel, backend=backend, onnx_dir=onnx_dir)
+    set_voice(cb_model, audio_prompt_wav)
+    chapter_manifest = ChapterManifest(work_dir, render_inputs(cb_model, audio_prompt_wav, pauses, silence_trim,
+                                                               target_lufs, max_sentences, qa))
 
     chapter_wav_files = []
-    nlp = get_nlp()
-    for i, chapter in enumerate(selected_chapters, start=1):
-        if should_stop():
-            print("Synthesis interrupted by user (chapter loop).")
-            break
-        if max_chapters and i > max_chapters: break
-        lines = chapter.extracted_text.splitlines()
-        text = "\n".join(
-            cleaned_line
-            for line in lines
-            if (
-                cleaned_line :=  clean_line(line)
-            ).strip() and re.search(r'\w', cleaned_line)
-        )
-        print(f'Chapter {i}: {text}')
-        
-        xhtml_file_name = re.sub(r'[\\/:*?"<>|]', '_', chapter.get_name()).replace(' ', '_').replace('.xhtml',
-                                                                                                     '').replace(
-            '.html', '')
-        chapter_wav_path = Path(output_folder) / filename.replace(extension, f'_chapter_{xhtml_file_name}.wav')
-        chapter_wav_files.append(chapter_wav_path)
-        if Path(chapter_wav_path).exists():
-            print(f'File for chapter {i} already exists. Skipping')
-            stats.processed_chars += len(text)
-            if post_event and hasattr(chapter, "chapter_index"):
-                post_event('CORE_CHAPTER_FINISHED', chapter_index=chapter.chapter_index)
-            continue
-        if len(text.strip()) < 10:
-            print(f'Skipping empty chapter {i}')
-            chapter_wav_files.remove(chapter_wav_path)
-            continue
-        if i == 1:
-            text = f'{title} – {creator}.\n\n' + text
-        start_time = time.time()
-        if post_event and hasattr(chapter, "chapter_index"):
-            post_event('CORE_CHAPTER_STARTED', chapter_index=chapter.chapter_index)
-        audio_segments = gen_audio_segments(
-            cb_model,
-            nlp,
-            text,
-            speed,
-            stats,
-            post_event=post_event,
-            max_sentences=max_sentences,
-            should_stop=should_stop
-        )
-        if should_stop():
-            print("Synthesis interrupted by user (after audio_segments).")
-            break
-        if audio_segments:
-            final_audio = np.concatenate(audio_segments)
-            soundfile.write(chapter_wav_path, final_audio, sample_rate)
-            end_time = time.time()
-            delta_seconds = end_time - start_time
-            chars_per_sec = len(text) / delta_seconds
-            print('Chapter written to', chapter_wav_path)
+    streamer = ChapterStreamer(output_folder, filename, stream_output, should_stop) if stream_output else None
+    writer = ChapterWriter(chapter_format)
+    write_error = None
+    try:
+        for i, (chapter, (text, sentences)) in enumerate(zip(selected_chapters, prepared_chapters), start=1):
+            if should_stop():
+                log.info("Synthesis interrupted by user (chapter loop).")
+                break
+            if max_chapters and i > max_chapters: break
+            log.debug('Chapter %d: %s', i, text)
+            if len(text.strip()) < 10:
+                log.debug('Skipping empty chapter %d', i)
+                continue
+            if i == 1:
+                intro = f'{title} – {creator}.\n\n'
+                sentences = split_sentences(nlp, intro) + [(start + len(intro), end + len(intro))
+                                                            for start, end in sentences]
+                text = intro + text
+
+            chapter_key = chapter_manifest.key(text)
+            xhtml_file_name = re.sub(r'[\\/:*?"<>|]', '_', chapter.get_name()).replace(' ', '_').replace('.xhtml',
+                                                                                                         '').replace(
+                '.html', '')
+            chapter_base = work_dir / filename.replace(extension, f'_chapter_{xhtml_file_name}_{chapter_key}')
+            existing_chapter_path = chapter_manifest.find(chapter_key) or find_chapter_audio(chapter_base)
+            if existing_chapter_path:
+                # It may have been rendered with another --intermediate; ffmpeg's concat demuxer needs one format
+                existing_chapter_path = convert_chapter_audio(existing_chapter_path, chapter_format)
+            chapter_wav_path = existing_chapter_path or Path(f'{chapter_base}{chapter_format.extension}')
+            chapter_wav_files.append(chapter_wav_path)
+            if existing_chapter_path:
+                log.info('Chapter %d is unchanged since it was rendered to %s. Skipping', i, existing_chapter_path.name)
+                chapter_manifest.record(chapter_key, chapter.get_name(), text, existing_chapter_path)
+                stats.processed_chars += len(text)
+                if streamer:
+                    streamer.add(chapter_wav_path, f'Chapter {i}')
+                if post_event and hasattr(chapter, "chapter_index"):
+                    post_event('CORE_CHAPTER_FINISHED', chapter_index=chapter.chapter_index)
+                continue
+            lease = None
+            if chapter_claim is not None:
+                lease = chapter_claim(chapter_wav_path, chapter_manifest.inputs)
+                if lease is None:
+                    log.info('Chapter %d is rendered by another worker. Skipping', i)
+                    continue
+            start_time = time.time()
             if post_event and hasattr(chapter, "chapter_index"):
-                post_event('CORE_CHAPTER_FINISHED', chapter_index=chapter.chapter_index)
-            print(f'Chapter {i} read in {delta_seconds:.2f} seconds ({chars_per_sec:.0f} characters per second)')
-        else:
-            print(f'Warning: No audio generated for chapter {i}')
-            chapter_wav_files.remove(chapter_wav_path)
-
-    if not chapter_wav_files:
-        print("No audio chapters were generated. Cannot create audiobook.", file=sys.stderr)
+                post_event('CORE_CHAPTER_STARTED', chapter_index=chapter.chapter_index)
+            meter = LoudnessMeter() if target_lufs is not None else None
+            qa_retries = []
+            audio_segments = gen_audio_segments(
+                cb_model,
+                nlp,
+                text,
+                speed,
+                stats,
+                post_event=post_event,
+                max_sentences=max_sentences,
+                should_stop=should_stop,
+                pauses=pauses,
+                trim=silence_trim,
+                meter=meter,
+                sentences=sentences,
+                qa=qa,
+                qa_retries=qa_retries
+            )
+            if should_stop():
+                log.info("Synthesis interrupted by user (after audio_segments).")
+                break
+            if qa and audio_segments:
+                report_path = write_qa_report(chapter_base, chapter.get_name(), len(sentences), qa_retries)
+                if qa_retries:
+                    log.info('Chapter %d: %d sentences re-generated, see %s', i, len(qa_retries), report_path.name,
+                             extra={'chapter': i, 'regenerated_sentences': len(qa_retries)})
+            if audio_segments:
+                end_time = time.time()
+                delta_seconds = end_time - start_time
+                chars_per_sec = len(text) / delta_seconds
+                log.info('Chapter %d read in %.2f seconds (%.0f characters per second)', i, delta_seconds,
+                         chars_per_sec, extra={'chapter': i, 'seconds': round(delta_seconds, 2),
+                                               'characters': len(text)})
+
+                def on_written(chapter_wav_path=chapter_wav_path, chapter=chapter, i=i, lease=lease,
+                               chapter_key=chapter_key, text=text):
+                    log.debug('Chapter written to %s', chapter_wav_path)
+                    chapter_manifest.record(chapter_key, chapter.get_name(), text, chapter_wav_path)
+                    if lease is not None:
+                        lease.release()
+                    if streamer:
+                        streamer.add(chapter_wav_path, f'Chapter {i}')
+                    if post_event and hasattr(chapter, "chapter_index"):
+                        post_event('CORE_CHAPTER_FINISHED', chapter_index=chapter.chapter_index)
+
+                gain = 1.0
+                if meter is not None:
+                    gain = meter.gain_for(target_lufs)
+                    log.debug('Chapter %d loudness %.1f LUFS, gain %+.1f dB', i, meter.integrated_loudness(),
+                              20 * np.log10(gain))
+                writer.submit(chapter_wav_path, audio_segments, on_written, gain=gain)
+            else:
+                log.warning('No audio generated for chapter %d', i)
+                chapter_wav_files.remove(chapter_wav_path)
+                if lease is not None:
+                    lease.release()
+    finally:
+        # Also when the loop breaks or raises: chapters already submitted finish writing
+        try:
+            writer.close()
+        except (OSError, RuntimeError) as e:
+            write_error = e
+            log.error("Writing chapter audio failed: %s", e)
+    if streamer:
+        streamer.close()
+
+    if write_error is not None:
         if post_event:
-            post_event('CORE_ERROR', message="No audio chapters were generated.")
+            post_event('CORE_ERROR', message=f"Writing chapter audio failed: {write_error}")
+        allow_sleep()
+        return
+
+    if should_stop():
+        log.info("Synthesis interrupted, not packaging.")
+        allow_sleep()
+        return
+
+    missing = [p for p in chapter_wav_files if not Path(p).exists()]
+    if missing:
+        log.info('%d chapters are still being rendered by other workers, not packaging yet.', len(missing))
         allow_sleep()
         return
 
     if not chapter_wav_files:
-        print("No audio chapters were generated. Cannot create audiobook.", file=sys.stderr)
+        log.error("No audio chapters were generated. Cannot create audiobook.")
         if post_event:
             post_event('CORE_ERROR', message="No audio chapters were generated.")
         allow_sleep()
         return
 
-    if has_ffmpeg:
-        create_index_file(title, creator, chapter_wav_files, output_folder)
+    def package():
         try:
-            concat_file_path = concat_wavs_with_ffmpeg(chapter_wav_files, output_folder, filename,
-                                                       post_event=post_event, should_stop=should_stop)
+            parts = split_into_parts([audio_duration(f) for f in chapter_wav_files], profile, max_part_hours,
+                                     max_part_mb) if max_part_hours or max_part_mb else None
+            if parts and len(parts) > 1:
+                package_parts(parts, chapter_wav_files, title, creator, filename, document.cover_image,
+                              output_folder, work_dir, profile, post_event=post_event, should_stop=should_stop)
+                if should_stop():
+                    log.info("Synthesis interrupted while packaging the parts.")
+                    return
+                if not keep_intermediates:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+                if post_event: post_event('CORE_FINISHED')
+                return
+            create_index_file(title, creator, chapter_wav_files, work_dir, filename)
+            concat_file_path = concat_wavs_with_ffmpeg(chapter_wav_files, work_dir, filename,
+                                                       post_event=post_event, should_stop=should_stop,
+                                                       profile=profile)
             if should_stop() or concat_file_path is None:
-                print("Synthesis interrupted before or during FFmpeg concat.")
-                allow_sleep()
+                log.info("Synthesis interrupted before or during FFmpeg concat.")
                 return
-            create_m4b(concat_file_path, filename, cover_image, output_folder, post_event=post_event, should_stop=should_stop)
+            create_m4b(concat_file_path, filename, document.cover_image, output_folder, post_event=post_event,
+                       should_stop=should_stop, profile=profile, work_dir=work_dir)
             if should_stop():
-                print("Synthesis interrupted before or during FFmpeg m4b creation.")
-                allow_sleep()
+                log.info("Synthesis interrupted before or during FFmpeg m4b creation.")
                 return
+            if not keep_intermediates:
+                shutil.rmtree(work_dir, ignore_errors=True)
             if post_event: post_event('CORE_FINISHED')
         except RuntimeError as e:
-            print(f"Audiobook creation failed: {e}", file=sys.stderr)
+            log.error("Audiobook creation failed: %s", e)
             if post_event:
                 post_event('CORE_ERROR', message=str(e))
-    print('Ended at:', time.strftime('%H:%M:%S'))
+        log.info('Finished %s', filename)
 
+    if packager is not None:
+        packager.submit(package)
+    else:
+        package()
     allow_sleep()
 
 
+def select_chapters(document, selected_chapters=None, pick_manually=False, ignore_list=None):
+    """
+    The chapters of document to synthesize: selected_chapters if given,
+    otherwise picked interactively or by find_good_chapters() (all pages of a
+    PDF), minus chapters whose name contains an ignore_list entry.
+    """
+    if not selected_chapters and not document.path.lower().endswith('.pdf'):
+        if pick_manually is True:
+            selected_chapters = pick_chapters(document.chapters)
+        else:
+            selected_chapters = find_good_chapters(document.chapters)
+    if selected_chapters is None:
+        selected_chapters = document.chapters
+
+    # Filter chapters based on ignore_list
+    if ignore_list:
+        def should_include(chapter):
+            name = chapter.get_name().lower()
+            for ignore in ignore_list:
+                if ignore.lower() in name:
+                    return False
+            return True
+        selected_chapters = [c for c in selected_chapters if should_include(c)]
+    return selected_chapters
+
+
+def preprocess_book(file_path, output_folder='.', lexicon=None, ignore_list=None, chapter_filter=None):
+    """
+    Parse a book and fill its preprocessing cache for the chapters main() will
+    synthesize, so main() can go straight to synthesis. chapter_filter(document)
+    overrides the default select_chapters(). Returns (document, selected_chapters).
+    """
+    document = load_document(file_path)
+    if chapter_filter is not None:
+        selected_chapters = chapter_filter(document)
+    else:
+        selected_chapters = select_chapters(document, ignore_list=ignore_list)
+    cache = PreprocessCache(output_folder, file_path, lexicon)
+    if cache.document is None:
+        cache.set_document(document)
+    nlp = get_nlp()
+    for chapter in selected_chapters:
+        cache.prepare(chapter, lexicon, nlp)
+    cache.save()
+    return document, selected_chapters
+
+
+BATCH_PREFETCH = 1  # books parsed ahead of the one being synthesized
+BATCH_PACKAGE_BACKLOG = 1  # synthesized books waiting for ffmpeg before synthesis blocks
+
+
+def _put_unless_stopped(q, item, stopped):
+    """Blocking put on a bounded queue that gives up once stopped is set."""
+    while not stopped.is_set():
+        try:
+            q.put(item, timeout=FFMPEG_STOP_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def run_batch_pipeline(batch_files, post_event=None, should_stop=None, chapter_filter=None,
+                       prefetch=BATCH_PREFETCH, package_backlog=BATCH_PACKAGE_BACKLOG, **main_kwargs):
+    """
+    Convert batch_files in three overlapping stages joined by bounded queues:
+    a parser thread parses and preprocesses up to `prefetch` books ahead, the
+    calling thread synthesizes one book at a time with main(), and a packaging
+    thread runs ffmpeg for finished books while the next one is synthesized.
+    CORE_FILE_FINISHED is posted once a book has been packaged. chapter_filter
+    is passed to preprocess_book(); with pick_manually the chapters are picked
+    in the synthesis stage instead.
+    """
+    if should_stop is None:
+        should_stop = lambda: False
+    lexicon = main_kwargs.pop('lexicon', None)
+    if lexicon is not None and not isinstance(lexicon, Lexicon):
+        lexicon = load_lexicon(lexicon)
+    output_folder = main_kwargs.get('output_folder', '.')
+    ignore_list = main_kwargs.get('ignore_list')
+    pick_manually = main_kwargs.pop('pick_manually', False)
+    load_spacy()
+    apply_topology(getattr(main_kwargs.get('cb_model'), 'device', None))
+    if main_kwargs.get('cb_model') is None:
+        # Books are synthesized one at a time in this thread, so they can share one model
+        main_kwargs['cb_model'] = load_tts_model(accel=main_kwargs.get('accel', 'fp32'),
+                                                 backend=main_kwargs.get('backend', 'torch'),
+                                                 onnx_dir=main_kwargs.get('onnx_dir'))
+
+    stopped = threading.Event()  # set when synthesis ends early, so the other stages don't block forever
+    parsed = queue.Queue(maxsize=max(1, prefetch))
+    packaging = queue.Queue(maxsize=max(1, package_backlog))
+
+    def parse_stage():
+        for path in batch_files:
+            if should_stop() or stopped.is_set():
+                break
+            try:
+                if pick_manually:
+                    item = (path, load_document(path), None, None)
+                else:
+                    item = (path, *preprocess_book(path, output_folder, lexicon, ignore_list, chapter_filter), None)
+            except Exception as e:
+                log.exception('Could not prepare %s', path)
+                item = (path, None, None, e)
+            if not _put_unless_stopped(parsed, item, stopped):
+                return
+        _put_unless_stopped(parsed, None, stopped)
+
+    def package_stage():
+        while (item := packaging.get()) is not None:
+            path, package = item
+            if package is not None:
+                try:
+                    package()
+                except Exception as e:
+                    log.exception('Packaging %s failed', path)
+                    if post_event:
+                        post_event('CORE_ERROR', message=str(e))
+            if post_event:
+                post_event('CORE_FILE_FINISHED', file_path=path)
+
+    parser = threading.Thread(target=parse_stage, name='batch-parse', daemon=True)
+    packager = threading.Thread(target=package_stage, name='batch-package', daemon=True)
+    parser.start()
+    packager.start()
+    try:
+        while (item := parsed.get()) is not None:
+            path, document, selected_chapters, error = item
+            if error is not None:
+                log.error("Could not read %s: %s", path, error)
+                if post_event:
+                    post_event('CORE_ERROR', message=f"Could not read {path}: {error}")
+                packaging.put((path, None))  # keeps CORE_FILE_FINISHED in batch order
+                continue
+            submitted = []
+            main(file_path=path, pick_manually=pick_manually, selected_chapters=selected_chapters,
+                 post_event=post_event, should_stop=should_stop, lexicon=lexicon, document=document,
+                 packager=SimpleNamespace(submit=submitted.append), **main_kwargs)
+            packaging.put((path, submitted[0] if submitted else None))
+            if should_stop():
+                break
+    finally:
+        stopped.set()
+        packaging.put(None)
+        packager.join()
+
+
+# Lossless formats for the per-chapter intermediate files. FLAC is about half
+# the size of 16-bit WAV; both are read directly by soundfile and ffmpeg.
+INTERMEDIATE_FORMATS = {
+    'flac': SimpleNamespace(name='flac', extension='.flac', format='FLAC', subtype='PCM_16'),
+    'wav': SimpleNamespace(name='wav', extension='.wav', format='WAV', subtype='PCM_16'),
+}
+
+
+def get_intermediate_format(name_or_format):
+    if isinstance(name_or_format, SimpleNamespace):
+        return name_or_format
+    try:
+        return INTERMEDIATE_FORMATS[name_or_format]
+    except KeyError:
+        raise ValueError(f"Unknown intermediate format {name_or_format!r}, "
+                         f"expected one of {', '.join(INTERMEDIATE_FORMATS)}")
+
+
+def find_chapter_audio(chapter_base):
+    """Return the finished chapter file for chapter_base in any intermediate format, or None."""
+    for fmt in INTERMEDIATE_FORMATS.values():
+        path = Path(f'{chapter_base}{fmt.extension}')
+        if path.exists():
+            return path
+    return None
+
+
+def write_chapter_audio(chapter_wav_path, audio_segments, chapter_format=None, gain=1.0):
+    """
+    Write segments one after another instead of concatenating them into a
+    chapter-sized array first, scaled by gain. The file is written under a
+    temporary name and renamed when complete, so an interrupted write never
+    looks like a finished chapter on resume.
+    """
+    chapter_format = get_intermediate_format(chapter_format or 'wav')
+    part_path = Path(chapter_wav_path).with_name(Path(chapter_wav_path).name + '.part')
+    with soundfile.SoundFile(part_path, 'w', samplerate=sample_rate, channels=1,
+                             format=chapter_format.format, subtype=chapter_format.subtype) as f:
+        for segment in audio_segments:
+            f.write(segment * np.float32(gain) if gain != 1.0 else segment)
+    os.replace(part_path, chapter_wav_path)
+
+
+def convert_chapter_audio(chapter_path, chapter_format):
+    """
+    Re-encode a finished chapter file in chapter_format and remove the
+    original; returns the new path. Both formats are 16-bit PCM, so the
+    samples are copied exactly. Used on resume, so that a work folder from an
+    earlier run with another --intermediate never mixes formats in one concat.
+    """
+    chapter_path = Path(chapter_path)
+    chapter_format = get_intermediate_format(chapter_format)
+    if chapter_path.suffix == chapter_format.extension:
+        return chapter_path
+    converted_path = chapter_path.with_suffix(chapter_format.extension)
+    blocks = soundfile.blocks(str(chapter_path), blocksize=sample_rate * 60, dtype='int16')
+    write_chapter_audio(converted_path, blocks, chapter_format)
+    chapter_path.unlink()
+    return converted_path
+
+
+class ChapterWriter:
+    """
+    Encodes and writes finished chapters on a background thread so the model
+    can start on the next chapter straight away. close() waits for pending
+    writes and re-raises the first write error.
+    """
+
+    def __init__(self, chapter_format='flac'):
+        self.chapter_format = get_intermediate_format(chapter_format)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chapter-writer')
+        self._futures = []
+
+    def submit(self, chapter_wav_path, audio_segments, on_written=None, gain=1.0):
+        self._futures.append(self._executor.submit(self._write, chapter_wav_path, audio_segments, on_written, gain))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for future in self._futures:
+            future.result()
+
+    def _write(self, chapter_wav_path, audio_segments, on_written, gain):
+        write_chapter_audio(chapter_wav_path, audio_segments, self.chapter_format, gain)
+        if on_written:
+            on_written()
+
+
+def audio_duration(file_name):
+    """Duration in seconds from the file header via soundfile, falling back to ffprobe for other formats."""
+    try:
+        return soundfile.info(str(file_name)).duration
+    except Exception:
+        return probe_duration(file_name)
+
+
+TTS_BACKENDS = ('torch', 'onnx')
+
+
+def load_tts_model(device=None, accel='fp32', backend='torch', onnx_dir=None):
+    """
+    Load the Chatterbox model, remembering its built-in voice so set_voice()
+    can restore it, with the acceleration modes in accel applied (see
+    apply_acceleration). With backend 'onnx' the transformer and vocoder run
+    in ONNX Runtime from the export in onnx_dir (see onnx_backend.py).
+    Weights come from the pinned model store when there is one (offline and
+    memory-mapped, see model_store.py), otherwise through the Hugging Face hub.
+    The load time is kept as cb_model.load_seconds.
+    """
+    from chatterbox.tts import ChatterboxTTS
+    import model_store
+    if backend not in TTS_BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, expected one of {', '.join(TTS_BACKENDS)}")
+    if device is None:
+        device = default_device()
+    model_log.debug('running on device: %s', device)
+    start = time.perf_counter()
+    if model_store.read_manifest() is not None:
+        cb_model = model_store.load_model(device=device)
+        cb_model.model_source = str(model_store.MODEL_STORE_DIR)
+        cb_model.model_id = f'store:{model_store.model_id()}'
+    else:
+        cb_model = ChatterboxTTS.from_pretrained(device=device)
+        cb_model.model_source = 'hub'
+        cb_model.model_id = f'hub:{model_store.MODEL_REPO_ID}'
+    cb_model.load_seconds = time.perf_counter() - start
+    model_log.info('Model loaded from %s on %s in %.1f seconds', cb_model.model_source, device, cb_model.load_seconds)
+    cb_model.default_conds = cb_model.conds
+    cb_model.voice_conds = {}
+    cb_model.backend = 'torch'
+    if backend == 'onnx':
+        import onnx_backend
+        onnx_backend.use_onnx_runtime(cb_model, onnx_dir, device)
+    install_cancel_checkpoints(cb_model)
+    apply_acceleration(cb_model, accel, device)
+    return cb_model
+
+
+# ---------------------------------------------------------------------------
+# Cancellation
+# ---------------------------------------------------------------------------
+# should_stop is polled inside generate(), not only between sentences: each
+# method listed below (the forward of one decoding step of the transformer
+# and of one flow-matching step, the vocoder's inference, which S3Gen calls
+# instead of its forward) first checks the should_stop of the
+# cancellable() block the calling thread is in, and raises
+# SynthesisCancelled when it returns True. A stop request therefore ends a
+# sentence within one step instead of after it. The same checkpoint lets
+# decoding_limit() cut off a runaway sentence (see Sentence QA).
+CANCEL_CHECKPOINTS = (('t3.tfmr', 'forward'), ('s3gen.flow.decoder.estimator', 'forward'), ('s3gen.mel2wav', 'inference'))
+DECODING_STEP_CHECKPOINT = 't3.tfmr'  # one call per speech token, counted by decoding_limit()
+STOP_POLL_SECONDS = 0.1  # longest wait between should_stop checks while idle
+
+_cancel_scope = threading.local()
+
+
+class SynthesisCancelled(Exception):
+    """Raised inside generate() when the should_stop of the enclosing cancellable() block returns True."""
+
+
+@contextmanager
+def cancellable(should_stop):
+    """Let generate() calls made by this thread inside the block be interrupted by should_stop."""
+    previous = getattr(_cancel_scope, 'should_stop', None)
+    _cancel_scope.should_stop = should_stop
+    try:
+        yield
+    finally:
+        _cancel_scope.should_stop = previous
+
+
+class DecodingLimitExceeded(Exception):
+    """Raised inside generate() when the transformer exceeds the steps allowed by decoding_limit()."""
+
+
+@contextmanager
+def decoding_limit(max_steps):
+    """Let generate() calls made by this thread inside the block run at most max_steps transformer steps (None: no limit)."""
+    previous = getattr(_cancel_scope, 'steps_left', None)
+    _cancel_scope.steps_left = max_steps
+    try:
+        yield
+    finally:
+        _cancel_scope.steps_left = previous
+
+
+def check_cancelled(decoding_step=False):
+    should_stop = getattr(_cancel_scope, 'should_stop', None)
+    if should_stop is not None and should_stop():
+        raise SynthesisCancelled()
+    steps_left = getattr(_cancel_scope, 'steps_left', None) if decoding_step else None
+    if steps_left is not None:
+        if steps_left <= 0:
+            raise DecodingLimitExceeded()
+        _cancel_scope.steps_left = steps_left - 1
+
+
+def install_cancel_checkpoints(cb_model):
+    """Make each CANCEL_CHECKPOINTS method of cb_model's modules call check_cancelled() first."""
+    for path, method in CANCEL_CHECKPOINTS:
+        module = cb_model
+        for name in path.split('.'):
+            module = getattr(module, name, None)
+        if (not isinstance(module, torch.nn.Module) or not hasattr(module, method)
+                or getattr(module, 'cancel_checkpoint', False)):
+            continue
+
+        def checked(*args, _method=getattr(module, method), _decoding_step=path == DECODING_STEP_CHECKPOINT,
+                    **kwargs):
+            check_cancelled(_decoding_step)
+            return _method(*args, **kwargs)
+
+        # An instance attribute, so callers that invoke .forward() directly are covered too
+        setattr(module, method, checked)
+        module.cancel_checkpoint = True
+    return cb_model
+
+
+# ---------------------------------------------------------------------------
+# Inference acceleration
+# ---------------------------------------------------------------------------
+# 'fp32' is plain eager float32. 'inference' runs generate() under
+# torch.inference_mode; 'bf16', 'int8' and 'compile' imply it and can be
+# combined as a comma-separated list, e.g. "int8,compile". bf16 and int8 are
+# alternative precisions and cannot be combined.
+ACCEL_MODES = ('fp32', 'inference', 'bf16', 'int8', 'compile')
+
+
+def parse_accel(accel):
+    """Normalize an acceleration setting (string or iterable of modes) to a frozenset of modes."""
+    if not accel:
+        return frozenset()
+    modes = accel.split(',') if isinstance(accel, str) else accel
+    modes = frozenset(m.strip().lower() for m in modes if m.strip())
+    unknown = modes - set(ACCEL_MODES)
+    if unknown:
+        raise ValueError(f"Unknown acceleration mode {', '.join(sorted(unknown))}, "
+                         f"expected one of {', '.join(ACCEL_MODES)}")
+    if 'bf16' in modes and 'int8' in modes:
+        raise ValueError("Acceleration modes bf16 and int8 cannot be combined")
+    modes -= {'fp32'}
+    return modes | {'inference'} if modes else modes
+
+
+def _model_modules(cb_model):
+    return [module for module in vars(cb_model).values() if isinstance(module, torch.nn.Module)]
+
+
+def apply_acceleration(cb_model, accel, device='cpu'):
+    """
+    Apply acceleration modes to a loaded model in place. int8 dynamically
+    quantizes every nn.Linear (CPU only); compile wraps the children of each
+    model component with torch.compile, so the first sentences are slow while
+    graphs are built. generate() is wrapped to run under inference_mode and,
+    for bf16, autocast, and always returns float32 audio.
+    """
+    modes = parse_accel(accel)
+    cb_model.accel = ','.join(m for m in ACCEL_MODES if m in modes) or 'fp32'
+    if not modes:
+        return cb_model
+    device_type = 'cuda' if str(device).startswith('cuda') else 'cpu'
+    if 'int8' in modes:
+        if device_type != 'cpu':
+            raise ValueError("int8 dynamic quantization is only available on the CPU")
+        for module in _model_modules(cb_model):
+            torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    if 'compile' in modes:
+        for module in _model_modules(cb_model):
+            for child in module.children():
+                child.compile()
+    generate = cb_model.generate
+
+    def accelerated_generate(*args, **kwargs):
+        with torch.inference_mode():
+            if 'bf16' in modes:
+                with torch.autocast(device_type, dtype=torch.bfloat16):
+                    wav = generate(*args, **kwargs)
+            else:
+                wav = generate(*args, **kwargs)
+        return wav.float()
+
+    cb_model.generate = accelerated_generate
+    model_log.info('Inference acceleration: %s', cb_model.accel)
+    return cb_model
+
+
+# Fixed sentences for comparing an accelerated model against fp32
+ACCEL_GUARD_SENTENCES = (
+    "The quick brown fox jumps over the lazy dog.",
+    "She sells seashells by the seashore, and the shells she sells are surely seashells.",
+    "In the beginning, the library was silent except for the ticking of an old clock.",
+    "How much wood would a woodchuck chuck if a woodchuck could chuck wood?",
+    "Numbers like 1984 and 3.14 should be read clearly and at an even pace.",
+)
+ACCEL_MAX_SPECTRAL_DISTANCE_DB = 3.0  # RMS difference of the long-term average spectra
+ACCEL_MAX_DURATION_RATIO = 1.25  # accelerated/fp32 duration, either way
+
+
+def average_spectrum_db(wav, frame=1024):
+    """Long-term average power spectrum of wav in dB, over Hann-windowed frames."""
+    wav = np.asarray(wav, dtype=np.float64).ravel()
+    if len(wav) < frame:
+        wav = np.pad(wav, (0, frame - len(wav)))
+    frames = np.lib.stride_tricks.sliding_window_view(wav, frame)[::frame // 2] * np.hanning(frame)
+    power = np.mean(np.abs(np.fft.rfft(frames, axis=1)) ** 2, axis=0)
+    return 10 * np.log10(power + 1e-10)
+
+
+def spectral_distance(reference, candidate):
+    """
+    RMS difference in dB between the long-term average spectra of two
+    renderings. Sampling makes two renderings of a sentence differ in timing,
+    so this compares timbre and noise level, not the waveforms.
+    """
+    difference = average_spectrum_db(reference) - average_spectrum_db(candidate)
+    return float(np.sqrt(np.mean(difference ** 2)))
+
+
+def render_guard_sentences(cb_model, sentences=ACCEL_GUARD_SENTENCES, seed=0):
+    """Render each guard sentence with a fixed seed; returns (list of float32 arrays, seconds taken)."""
+    wavs = []
+    start = time.perf_counter()
+    for sentence in sentences:
+        torch.manual_seed(seed)
+        wavs.append(cb_model.generate(sentence, temperature=0.1).detach().cpu().numpy().ravel())
+    return wavs, time.perf_counter() - start
+
+
+def accel_accuracy(reference_wavs, candidate_wavs):
+    """
+    Compare renderings of the guard sentences; returns SimpleNamespace with
+    the worst spectral distance, the worst duration ratio and ok, which is
+    False when either exceeds its limit.
+    """
+    distances = [spectral_distance(r, c) for r, c in zip(reference_wavs, candidate_wavs)]
+    ratios = [max(len(r), len(c)) / max(min(len(r), len(c)), 1) for r, c in zip(reference_wavs, candidate_wavs)]
+    return SimpleNamespace(
+        spectral_distance=max(distances),
+        duration_ratio=max(ratios),
+        ok=max(distances) <= ACCEL_MAX_SPECTRAL_DISTANCE_DB and max(ratios) <= ACCEL_MAX_DURATION_RATIO,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Thread topology
+# ---------------------------------------------------------------------------
+# How many intra-op threads torch uses per book and how many books a batch
+# synthesizes at once. "cli.py bench topology" measures the combinations on
+# this host and saves the fastest to TOPOLOGY_FILE, keyed by host and device;
+# main() and the batch runners apply it before synthesis starts.
+TOPOLOGY_FILE = Path.home() / '.cache' / 'chatterblez' / 'topology.json'
+TOPOLOGY_RESERVED_CORES = 1  # left to the GUI, spaCy and ffmpeg, which run alongside synthesis
+_applied_topology = {}
+
+
+def default_device():
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def topology_key(device=None):
+    return f"{platform.node()}/{os.cpu_count()} cores/{str(device or default_device())}"
+
+
+def topology_candidates(cores=None, max_workers=4):
+    """(threads, workers) pairs to try: thread counts in powers of two, with threads * workers within the usable cores."""
+    usable = max(1, (cores or os.cpu_count() or 1) - TOPOLOGY_RESERVED_CORES)
+    threads = sorted({1 << i for i in range(usable.bit_length()) if 1 << i <= usable} | {usable})
+    return [(t, w) for w in range(1, max_workers + 1) for t in threads if t * w <= usable]
+
+
+def load_topology(device=None):
+    """The saved topology for this host and device as SimpleNamespace(threads, workers, ...), or None."""
+    try:
+        with open(TOPOLOGY_FILE) as f:
+            saved = json.load(f).get(topology_key(device))
+    except (OSError, ValueError):
+        return None
+    return SimpleNamespace(**saved) if saved else None
+
+
+def save_topology(topology, device=None):
+    TOPOLOGY_FILE.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        with open(TOPOLOGY_FILE) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        saved = {}
+    saved[topology_key(device)] = vars(topology)
+    part = TOPOLOGY_FILE.with_suffix('.part')
+    with open(part, 'w') as f:
+        json.dump(saved, f, indent=2)
+    os.replace(part, TOPOLOGY_FILE)
+
+
+def set_torch_threads(threads):
+    """
+    Use `threads` intra-op threads and a single inter-op thread: synthesis is
+    eager and sequential per book, so a larger inter-op pool only competes
+    for cores. The inter-op size can only be set before torch first uses it.
+    """
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+
+def apply_topology(device=None):
+    """Apply the saved topology for device once per process; returns it, or None when none was saved."""
+    key = topology_key(device)
+    if key not in _applied_topology:
+        topology = load_topology(device)
+        if topology is not None:
+            set_torch_threads(topology.threads)
+            model_log.info('Thread topology: %d threads per book, %d books at once', topology.threads, topology.workers)
+        _applied_topology[key] = topology
+    return _applied_topology[key]
+
+
+def set_voice(cb_model, audio_prompt_wav=None):
+    """
+    Condition the model on audio_prompt_wav, or on the built-in voice when None.
+    Conditionals are cached per file (path + mtime) so a long-lived model does
+    not re-analyse the same prompt for every book.
+    """
+    if not audio_prompt_wav:
+        if getattr(cb_model, 'default_conds', None) is not None:
+            cb_model.conds = cb_model.default_conds
+        return
+    voice_conds = getattr(cb_model, 'voice_conds', None)
+    key = (os.path.abspath(audio_prompt_wav), os.path.getmtime(audio_prompt_wav))
+    if voice_conds is not None and key in voice_conds:
+        cb_model.conds = voice_conds[key]
+        return
+    cb_model.prepare_conditionals(wav_fpath=audio_prompt_wav)
+    if voice_conds is not None:
+        voice_conds[key] = cb_model.conds
+
+
 def find_cover(book):
     def is_image(item):
         return item is not None and item.media_type.startswith('image/')
@@ -518,43 +1280,336 @@ def find_cover(book):
 
 
 def print_selected_chapters(document_chapters, chapters):
+    if not log.isEnabledFor(logging.DEBUG):
+        return
     ok = 'X' if platform.system() == 'Windows' else '✅'
-    print(tabulate([
+    log.debug('Chapters:\n%s', tabulate([
         [i, c.get_name(), len(c.extracted_text), ok if c in chapters else '', chapter_beginning_one_liner(c)]
         for i, c in enumerate(document_chapters, start=1)
     ], headers=['#', 'Chapter', 'Text Length', 'Selected', 'First words']))
 
 
-def gen_audio_segments(cb_model, nlp, text, speed, stats=None, max_sentences=None,
-                       post_event=None, should_stop=None):  # Use spacy to split into sentences
+# ---------------------------------------------------------------------------
+# Audio assembly: silence trimming and pauses
+# ---------------------------------------------------------------------------
+SILENCE_THRESHOLD_DB = -45  # frames quieter than this (RMS, dBFS) count as silence
+SILENCE_FRAME_SECONDS = 0.01
+SILENCE_KEEP_SECONDS = 0.05  # kept around speech so word onsets and decays aren't clipped
+
+# Seconds of silence inserted after a segment, by the boundary that follows it
+DEFAULT_PAUSES = {'sentence': 0.35, 'paragraph': 0.8, 'chapter': 1.5}
+
+_whitespace_run_re = re.compile(r'\s*')
+
+
+def trim_silence(wav, threshold_db=SILENCE_THRESHOLD_DB, frame_seconds=SILENCE_FRAME_SECONDS,
+                 keep_seconds=SILENCE_KEEP_SECONDS):
+    """
+    Return a view of wav without leading and trailing silence. Frame energies
+    are computed in one vectorized pass over a reshaped view, so no copy of
+    the samples is made.
+    """
+    frame = max(int(sample_rate * frame_seconds), 1)
+    n_frames = len(wav) // frame
+    if n_frames == 0:
+        return wav
+    frames = wav[:n_frames * frame].reshape(n_frames, frame)
+    mean_square = np.einsum('ij,ij->i', frames, frames) / frame
+    voiced = np.flatnonzero(mean_square > 10 ** (threshold_db / 10))
+    if voiced.size == 0:
+        return wav[:0]
+    keep = int(sample_rate * keep_seconds)
+    start = max(voiced[0] * frame - keep, 0)
+    end = len(wav) if voiced[-1] == n_frames - 1 else min((voiced[-1] + 1) * frame + keep, len(wav))
+    return wav[start:end]
+
+
+@lru_cache(maxsize=16)
+def silence(seconds):
+    """Shared, read-only block of silence; the same array is reused for every pause of that length."""
+    pause = np.zeros(int(sample_rate * seconds), dtype=np.float32)
+    pause.flags.writeable = False
+    return pause
+
+
+def split_sentences(nlp, text):
+    """Sentence boundaries of text as (start, end) character offsets, trailing whitespace excluded."""
+    return [(sent.start_char, sent.start_char + len(sent.text.rstrip())) for sent in nlp(text).sents]
+
+
+def sentence_boundary(text, end):
+    """'paragraph' if a line break follows the sentence ending at offset end, else 'sentence'."""
+    gap = _whitespace_run_re.match(text, end).group()
+    return 'paragraph' if '\n' in gap else 'sentence'
+
+
+# ---------------------------------------------------------------------------
+# Loudness (ITU-R BS.1770 integrated loudness, mono)
+# ---------------------------------------------------------------------------
+LOUDNESS_PEAK_CEILING = 0.98  # gain is capped so samples never exceed this (int16 output would wrap)
+
+
+def _biquad_power_response(b, a, freqs, rate):
+    z = np.exp(-2j * np.pi * freqs / rate)
+    h = (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    return np.abs(h) ** 2
+
+
+@lru_cache(maxsize=4)
+def k_weighting_power(n, rate):
+    """
+    |H(f)|^2 of the BS.1770 K-weighting filter (high shelf + high pass) at the
+    rfft bins of an n-sample frame, with the factor 2 for the mirrored
+    negative frequencies folded in.
+    """
+    freqs = np.fft.rfftfreq(n, 1 / rate)
+    # High shelf: +4 dB above ~1.5 kHz
+    gain_db, f0, q = 4.0, 1500.0, 1 / np.sqrt(2)
+    big_a = 10 ** (gain_db / 40)
+    w0 = 2 * np.pi * f0 / rate
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    shelf_b = (big_a * ((big_a + 1) + (big_a - 1) * cos_w0 + 2 * np.sqrt(big_a) * alpha),
+               -2 * big_a * ((big_a - 1) + (big_a + 1) * cos_w0),
+               big_a * ((big_a + 1) + (big_a - 1) * cos_w0 - 2 * np.sqrt(big_a) * alpha))
+    shelf_a = ((big_a + 1) - (big_a - 1) * cos_w0 + 2 * np.sqrt(big_a) * alpha,
+               2 * ((big_a - 1) - (big_a + 1) * cos_w0),
+               (big_a + 1) - (big_a - 1) * cos_w0 - 2 * np.sqrt(big_a) * alpha)
+    # High pass at ~38 Hz
+    f0, q = 38.0, 0.5
+    w0 = 2 * np.pi * f0 / rate
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    pass_b = ((1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2)
+    pass_a = (1 + alpha, -2 * cos_w0, 1 - alpha)
+    weights = _biquad_power_response(shelf_b, shelf_a, freqs, rate) * _biquad_power_response(pass_b, pass_a, freqs, rate)
+    weights[1:(n + 1) // 2] *= 2
+    weights.flags.writeable = False
+    return weights
+
+
+class LoudnessMeter:
+    """
+    Incremental integrated-loudness meter. Segments are fed as they are
+    synthesized; each complete 100 ms step is K-weighted in the frequency
+    domain (one batched rfft per segment) and only its mean square is kept,
+    so the audio itself is never re-read. The 400 ms gating blocks with 75%
+    overlap are formed from those steps when integrated_loudness() is called.
+    """
+
+    def __init__(self, rate=sample_rate):
+        self.rate = rate
+        self.step = int(0.1 * rate)
+        self.peak = 0.0
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._step_powers = []
+
+    def add(self, segment):
+        if len(segment) == 0:
+            return
+        self.peak = max(self.peak, float(np.max(np.abs(segment))))
+        if len(self._pending):
+            head = self.step - len(self._pending)
+            if len(segment) < head:
+                self._pending = np.concatenate([self._pending, segment])
+                return
+            self._measure(np.concatenate([self._pending, segment[:head]]))
+            segment = segment[head:]
+        whole = len(segment) // self.step * self.step
+        if whole:
+            self._measure(segment[:whole])
+        self._pending = np.array(segment[whole:], dtype=np.float32)
+
+    def _measure(self, samples):
+        steps = samples.reshape(-1, self.step)
+        spectrum = np.fft.rfft(steps, axis=1)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2) @ k_weighting_power(self.step, self.rate)
+        self._step_powers.append(power / (self.step * self.step))
+
+    def integrated_loudness(self):
+        """Gated integrated loudness in LUFS, or -inf for silence / less than 400 ms of audio."""
+        if not self._step_powers:
+            return float('-inf')
+        powers = np.concatenate(self._step_powers)
+        if len(powers) < 4:
+            return float('-inf')
+        blocks = (powers[:-3] + powers[1:-2] + powers[2:-1] + powers[3:]) / 4
+        with np.errstate(divide='ignore'):
+            block_loudness = -0.691 + 10 * np.log10(blocks)
+        gated = blocks[block_loudness > -70]
+        if gated.size == 0:
+            return float('-inf')
+        relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10
+        gated = blocks[(block_loudness > -70) & (block_loudness > relative_gate)]
+        return float(-0.691 + 10 * np.log10(gated.mean()))
+
+    def gain_for(self, target_lufs):
+        """Linear gain that brings the measured audio to target_lufs without exceeding the peak ceiling."""
+        loudness = self.integrated_loudness()
+        if not np.isfinite(loudness):
+            return 1.0
+        gain = 10 ** ((target_lufs - loudness) / 20)
+        if self.peak > 0:
+            gain = min(gain, LOUDNESS_PEAK_CEILING / self.peak)
+        return gain
+
+
+# ---------------------------------------------------------------------------
+# Sentence QA
+# ---------------------------------------------------------------------------
+# The model occasionally runs away, talking on long after the text ends, or
+# returns near-silence. Each rendered sentence is checked against bounds on
+# seconds of speech per character and on loudness. A failing sentence is
+# rendered again with a different seed, up to QA_MAX_ATTEMPTS times in all,
+# and the best attempt is kept. Decoding is cut off once a sentence has used
+# more speech tokens than its longest acceptable rendering needs, except on
+# the last attempt, so every sentence ends up with audio.
+QA_MIN_SECONDS_PER_CHAR = 0.02
+QA_MAX_SECONDS_PER_CHAR = 0.2
+QA_TYPICAL_SECONDS_PER_CHAR = 0.07  # the best of several failed attempts is the one closest to this
+QA_SLACK_SECONDS = 1.5  # allowance for short sentences, headings and numbers read out
+QA_MIN_RMS_DB = -40.0  # speech quieter than this (RMS, dBFS) is a failed render
+QA_MAX_ATTEMPTS = 3
+SPEECH_TOKENS_PER_SECOND = 25  # rate of the speech tokens the transformer decodes
+QA_REPORT_SUFFIX = '.qa.json'
+
+
+def sentence_problem(segment, n_chars):
+    """Why a rendered sentence (silence already trimmed) looks wrong for n_chars of text, or None."""
+    seconds = len(segment) / sample_rate
+    if seconds > n_chars * QA_MAX_SECONDS_PER_CHAR + QA_SLACK_SECONDS:
+        return 'too long'
+    if seconds < n_chars * QA_MIN_SECONDS_PER_CHAR:
+        return 'too short'
+    rms = np.sqrt(np.mean(np.square(segment, dtype=np.float64)))
+    if 20 * np.log10(rms + 1e-12) < QA_MIN_RMS_DB:
+        return 'too quiet'
+    return None
+
+
+def max_decoding_steps(n_chars):
+    """Speech tokens a sentence of n_chars may take before decoding is cut off."""
+    return int((n_chars * QA_MAX_SECONDS_PER_CHAR + 2 * QA_SLACK_SECONDS) * SPEECH_TOKENS_PER_SECOND)
+
+
+def render_sentence(cb_model, sentence, trim=True, qa=True):
+    """
+    Synthesize one sentence, with its silence trimmed when trim is set, and
+    checked and re-generated as described above when qa is set. Returns
+    (segment, attempts); attempts describes every try as a dict (seed,
+    seconds, problem) when a retry was needed and is empty otherwise.
+    """
+    n_chars = len(sentence.strip())
+    attempts = []
+    best, best_distance = None, None
+    for attempt in range(QA_MAX_ATTEMPTS if qa else 1):
+        seed = None
+        if attempt:
+            seed = zlib.crc32(sentence.encode('utf-8')) + attempt
+            torch.manual_seed(seed)
+        capped = qa and attempt < QA_MAX_ATTEMPTS - 1
+        try:
+            with decoding_limit(max_decoding_steps(n_chars) if capped else None):
+                wav = cb_model.generate(sentence, temperature=0.1)
+        except DecodingLimitExceeded:
+            attempts.append({'seed': seed, 'seconds': None, 'problem': 'cut off'})
+            continue
+        segment = wav.numpy().ravel()
+        trimmed = trim_silence(segment) if trim or qa else segment
+        # The trimmed view would keep the whole untrimmed render alive until the chapter is written
+        if not qa:
+            return (trimmed.copy() if trim else segment), attempts
+        problem = sentence_problem(trimmed, n_chars)
+        attempts.append({'seed': seed, 'seconds': round(len(trimmed) / sample_rate, 2), 'problem': problem})
+        distance = 0.0 if problem is None else abs(len(trimmed) / sample_rate - n_chars * QA_TYPICAL_SECONDS_PER_CHAR)
+        if best is None or distance < best_distance:
+            best, best_distance = (trimmed.copy() if trim else segment), distance
+        if problem is None:
+            break
+    return best, attempts if len(attempts) > 1 else []
+
+
+def write_qa_report(chapter_base, chapter_name, sentence_count, retries):
+    """Record the re-generated sentences of a chapter in <chapter_base>.qa.json; returns its path."""
+    path = Path(f'{chapter_base}{QA_REPORT_SUFFIX}')
+    report = {
+        'chapter': chapter_name,
+        'sentences': sentence_count,
+        'retried': len(retries),
+        'still_failing': sum(1 for r in retries if r['attempts'][-1]['problem'] is not None),
+        'retries': retries,
+    }
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.part')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
 
+
+def gen_audio_segments(cb_model, nlp, text, speed, stats=None, max_sentences=None,
+                       post_event=None, should_stop=None, pauses=None, trim=True,
+                       meter=None, sentences=None, qa=True, qa_retries=None):  # Use spacy to split into sentences
+    """
+    Synthesize text sentence by sentence. Each sentence has its leading and
+    trailing silence trimmed (unless trim is False) and is followed by the
+    pause for its boundary from pauses (DEFAULT_PAUSES by default); the
+    chapter pause closes the list. Pass pauses={} to insert none. Every
+    segment is also fed to meter (a LoudnessMeter) when one is given.
+    sentences are precomputed (start, end) offsets from split_sentences();
+    text is segmented with nlp when they are not given. Sentences that fail
+    the QA checks are re-generated (see render_sentence, qa=False turns
+    this off) and recorded in the list qa_retries when one is given.
+    """
     if should_stop is None:
         should_stop = lambda: False
+    if pauses is None:
+        pauses = DEFAULT_PAUSES
 
     audio_segments = []
-    doc = nlp(text)
-    sentences = list(doc.sents)
-    for i, sent in enumerate(sentences):
+    if sentences is None:
+        sentences = split_sentences(nlp, text)
+    if max_sentences:
+        # Cut before the loop, so the chapter pause follows the last sentence actually rendered
+        sentences = sentences[:max_sentences + 1]
+    for i, (start, end) in enumerate(sentences):
         if should_stop():
-            print("Synthesis interrupted by user (sentence loop).")
+            log.info("Synthesis interrupted by user (sentence loop).")
             return audio_segments
-        if max_sentences and i > max_sentences: break
+        sentence = text[start:end]
         # ChatterboxTTS does not use speed param, but keep for compatibility
-        wav = cb_model.generate(sent.text,temperature=0.1)
-        audio_segments.append(wav.numpy().flatten())
+        try:
+            with cancellable(should_stop):
+                segment, attempts = render_sentence(cb_model, sentence, trim, qa)
+        except SynthesisCancelled:
+            log.info("Synthesis interrupted by user (mid-sentence).")
+            return audio_segments
+        if attempts:
+            log.debug("Sentence %d re-generated: %s", i + 1, ', '.join(str(a['problem'] or 'ok') for a in attempts))
+            if qa_retries is not None:
+                qa_retries.append({'sentence': i + 1, 'text': sentence, 'attempts': attempts})
+        audio_segments.append(segment)
+        if meter is not None:
+            meter.add(segment)
+        boundary = sentence_boundary(text, end) if i < len(sentences) - 1 else 'chapter'
+        if pauses.get(boundary):
+            audio_segments.append(silence(pauses[boundary]))
+            if meter is not None:
+                meter.add(audio_segments[-1])
         if stats:
-            update_stats(stats, len(sent.text))
+            update_stats(stats, len(sentence))
             if post_event:
                 post_event('CORE_PROGRESS', stats=stats)
     return audio_segments
 
 
-def find_document_chapters_and_extract_texts(book):
-    """Returns every chapter that is an ITEM_DOCUMENT and enriches each chapter with extracted_text."""
+def find_document_chapters_and_extract_texts(book, progress=None):
+    """
+    Returns every chapter that is an ITEM_DOCUMENT and enriches each chapter with extracted_text.
+    progress(chapter, done, total) is called as each chapter is extracted.
+    """
     document_chapters = []
-    for chapter in book.get_items():
-        if chapter.get_type() != ebooklib.ITEM_DOCUMENT:
-            continue
+    items = [item for item in book.get_items() if item.get_type() == ebooklib.ITEM_DOCUMENT]
+    for chapter in items:
         xml = chapter.get_body_content()
         soup = BeautifulSoup(xml, features='lxml')
         chapter.extracted_text = ''
@@ -563,9 +1618,10 @@ def find_document_chapters_and_extract_texts(book):
             if not text.endswith('.'):
                 text += '.'
             chapter.extracted_text += text + '\n'
+        chapter.chapter_index = len(document_chapters)
         document_chapters.append(chapter)
-    for i, c in enumerate(document_chapters):
-        c.chapter_index = i
+        if progress:
+            progress(chapter, len(document_chapters), len(items))
     return document_chapters
 
 
@@ -590,7 +1646,7 @@ def chapter_beginning_one_liner(c, chars=20):
 def find_good_chapters(document_chapters):
     chapters = [c for c in document_chapters if c.get_type() == ebooklib.ITEM_DOCUMENT and is_chapter(c)]
     if len(chapters) == 0:
-        print('Not easy to recognize the chapters, defaulting to all non-empty documents.')
+        log.info('Not easy to recognize the chapters, defaulting to all non-empty documents.')
         chapters = [c for c in document_chapters if
                     c.get_type() == ebooklib.ITEM_DOCUMENT and len(c.extracted_text) > 10]
     return chapters
@@ -607,6 +1663,225 @@ def pick_chapters(chapters):
     return selected_chapters
 
 
+# ---------------------------------------------------------------------------
+# Documents: a book parsed once per process
+# ---------------------------------------------------------------------------
+PDF_CHAPTER_CHARS = 5000  # PDFs have no chapter structure, pages are grouped into chunks of about this size
+
+
+class TextChapter:
+    """A chapter of plain text (PDF pages, or a chapter restored from the preprocessing cache)."""
+
+    def __init__(self, name, extracted_text, chapter_index):
+        self._name = name
+        self.extracted_text = extracted_text
+        self.chapter_index = chapter_index
+        self.is_selected = True
+
+    def get_name(self):
+        return self._name
+
+    def get_type(self):
+        return ebooklib.ITEM_DOCUMENT
+
+
+class Document:
+    """
+    A parsed e-book: title, creator, cover and chapters, each chapter with
+    extracted_text and chapter_index. Get one from load_document(), which
+    parses each file once per process; main() accepts it so callers that
+    already parsed the book to show or filter its chapters don't parse it again.
+    The cover is read on first access of cover_image.
+    """
+
+    def __init__(self, path, title, creator, chapters, cover=b''):
+        self.path = str(path)
+        self.title = title
+        self.creator = creator
+        self.chapters = chapters
+        self._cover = cover  # bytes, or a callable returning them
+
+    @property
+    def cover_image(self):
+        if callable(self._cover):
+            self._cover = self._cover() or b''
+        return self._cover
+
+    @classmethod
+    def from_epub(cls, path, progress=None):
+        book = epub.read_epub(str(path))
+        meta_title = book.get_metadata('DC', 'title')
+        meta_creator = book.get_metadata('DC', 'creator')
+        cover_item = find_cover(book)
+        if cover_item:
+            log.debug('Found cover image %s in %s format', cover_item.file_name, cover_item.media_type)
+        return cls(path,
+                   meta_title[0][0] if meta_title else '',
+                   meta_creator[0][0] if meta_creator else '',
+                   find_document_chapters_and_extract_texts(book, progress),
+                   cover_item.get_content if cover_item else b'')
+
+    @classmethod
+    def from_pdf(cls, path, progress=None):
+        import PyPDF2
+        pdf_reader = PyPDF2.PdfReader(str(path))
+        chapters = []
+        buffer = ""
+        first_page = 0
+        for i, page in enumerate(pdf_reader.pages):
+            buffer += (page.extract_text() or "") + "\n"
+            if len(buffer) >= PDF_CHAPTER_CHARS or i == len(pdf_reader.pages) - 1:
+                chapters.append(TextChapter(f"Pages {first_page + 1}-{i + 1}", buffer.strip(), len(chapters)))
+                buffer = ""
+                first_page = i + 1
+                if progress:
+                    progress(chapters[-1], i + 1, len(pdf_reader.pages))
+        return cls(path, Path(path).stem, "Unknown", chapters)
+
+
+DOCUMENT_CACHE_SIZE = 8
+_documents = {}  # (path, mtime) -> Document, oldest first
+_documents_lock = threading.Lock()
+
+
+def load_document(file_path, progress=None):
+    """
+    Parse an EPUB or PDF into a Document, memoized on path + mtime.
+    progress(chapter, done, total) is called for every chapter as it is
+    extracted; for an already parsed book it is replayed for each chapter.
+    """
+    path = str(Path(file_path).resolve())
+    key = (path, os.path.getmtime(path))
+    with _documents_lock:
+        document = _documents.get(key)
+    if document is not None:
+        if progress:
+            for i, chapter in enumerate(document.chapters, start=1):
+                progress(chapter, i, len(document.chapters))
+        return document
+    if path.lower().endswith('.pdf'):
+        document = Document.from_pdf(path, progress)
+    else:
+        document = Document.from_epub(path, progress)
+    with _documents_lock:
+        _documents[key] = document
+        while len(_documents) > DOCUMENT_CACHE_SIZE:
+            del _documents[next(iter(_documents))]
+    return document
+
+
+# ---------------------------------------------------------------------------
+# Preprocessing cache: extracted chapters, cleaned text and sentence boundaries
+# ---------------------------------------------------------------------------
+PREPROCESS_CACHE_DIR = '.chatterblez_cache'
+PREPROCESS_CACHE_VERSION = 1  # bump when extraction, clean_line or sentence splitting change
+
+
+def normalize_chapter_text(text, lexicon=None):
+    """Apply the lexicon and clean_line() to raw chapter text, dropping lines with nothing to speak."""
+    if lexicon:
+        text = lexicon.apply(text)
+    return "\n".join(
+        cleaned_line
+        for line in text.splitlines()
+        if (
+            cleaned_line := clean_line(line)
+        ).strip() and re.search(r'\w', cleaned_line)
+    )
+
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PreprocessCache:
+    """
+    Parsed document, normalized chapter text and sentence boundaries of one
+    source file, stored as a compressed .npz under
+    <output_folder>/.chatterblez_cache/. The file name is derived from the
+    source contents, the lexicon, spaCy's version and PREPROCESS_CACHE_VERSION,
+    so any change to those starts from scratch. Prepared chapters are looked up
+    by name and a digest of their raw text, which also covers PDF pages and
+    chapters picked in the GUI. Unreadable cache files are ignored.
+    """
+
+    def __init__(self, output_folder, source_path, lexicon=None):
+        key = hashlib.sha256(f'{PREPROCESS_CACHE_VERSION}:{spacy.__version__}:'.encode('utf-8'))
+        key.update(file_digest(source_path).encode('ascii'))
+        if lexicon:
+            key.update(lexicon.fingerprint().encode('ascii'))
+        self.source_path = str(source_path)
+        self.path = Path(output_folder) / PREPROCESS_CACHE_DIR / f'{key.hexdigest()[:32]}.npz'
+        self.document = None  # Document restored from the cache
+        self.chapters = {}  # (name, raw text digest) -> (text, [(start, end)])
+        self._dirty = False
+        if self.path.is_file():
+            try:
+                self._load()
+            except (OSError, ValueError, KeyError) as e:
+                log.warning('Ignoring unreadable preprocessing cache %s: %s', self.path, e)
+                self.document, self.chapters = None, {}
+
+    def _load(self):
+        with np.load(self.path, allow_pickle=False) as data:
+            meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+            spans = data['sentences']
+            cover_image = data['cover'].tobytes()
+        if meta['document'] is not None:
+            document = meta['document']
+            chapters = [TextChapter(c['name'], c['text'], i) for i, c in enumerate(document['chapters'])]
+            self.document = Document(self.source_path, document['title'], document['creator'], chapters, cover_image)
+        offset = 0
+        for c in meta['prepared']:
+            sentences = [tuple(span) for span in spans[offset:offset + c['sentences']].tolist()]
+            self.chapters[(c['name'], c['digest'])] = (c['text'], sentences)
+            offset += c['sentences']
+
+    def set_document(self, document):
+        self.document = document
+        self._dirty = True
+
+    def prepare(self, chapter, lexicon, nlp):
+        """(normalized text, sentence spans) of chapter, computed only on a cache miss."""
+        raw_digest = hashlib.blake2b(chapter.extracted_text.encode('utf-8'), digest_size=16).hexdigest()
+        key = (chapter.get_name(), raw_digest)
+        if key not in self.chapters:
+            text = normalize_chapter_text(chapter.extracted_text, lexicon)
+            self.chapters[key] = (text, split_sentences(nlp, text))
+            self._dirty = True
+        return self.chapters[key]
+
+    def save(self):
+        if not self._dirty:
+            return
+        document = None
+        cover_image = b''
+        if self.document is not None:
+            cover_image = self.document.cover_image
+            document = {'title': self.document.title, 'creator': self.document.creator,
+                        'chapters': [{'name': c.get_name(), 'text': c.extracted_text} for c in self.document.chapters]}
+        prepared = [{'name': name, 'digest': digest, 'text': text, 'sentences': len(sentences)}
+                    for (name, digest), (text, sentences) in self.chapters.items()]
+        spans = [span for _, sentences in self.chapters.values() for span in sentences]
+        meta = json.dumps({'document': document, 'prepared': prepared}).encode('utf-8')
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Private to this writer: a batch parser may save the same book's cache while main() does
+        tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}-{threading.get_ident()}.part')
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                meta=np.frombuffer(meta, dtype=np.uint8),
+                cover=np.frombuffer(cover_image, dtype=np.uint8),
+                sentences=np.array(spans, dtype=np.int64).reshape(-1, 2)
+            )
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
 def strfdelta(tdelta, fmt='{D:02}d {H:02}h {M:02}m {S:02}s'):
     remainder = int(tdelta)
     f = Formatter()
@@ -620,178 +1895,245 @@ def strfdelta(tdelta, fmt='{D:02}d {H:02}h {M:02}m {S:02}s'):
     return f.format(fmt, **values)
 
 
-def enqueue_output(stream, queue_obj):
-    """Helper function to read from a stream and put lines into a queue."""
-    for line in iter(stream.readline, ''):
-        queue_obj.put(line)
-    stream.close()
+# ---------------------------------------------------------------------------
+# FFmpeg / ffprobe subprocess runner
+# ---------------------------------------------------------------------------
+FFMPEG_STDERR_TAIL_LINES = 50  # bounded ring buffer used for error reports
+FFMPEG_STOP_POLL_SECONDS = 0.1  # how often should_stop is checked while waiting
+
+
+def parse_ffmpeg_time(value):
+    """Convert an ffmpeg `HH:MM:SS.micro` timestamp to seconds."""
+    h, m, s = value.split(':')
+    return int(h) * 3600 + int(m) * 60 + float(s)
+
+
+async def _read_stream_lines(stream, on_line):
+    async for raw in stream:
+        line = raw.decode('utf-8', errors='replace').strip()
+        if line:
+            on_line(line)
+
+
+async def _run_media_command_async(args, on_stdout_line, on_stderr_line, should_stop):
+    creation_flags = subprocess.CREATE_NO_WINDOW if platform.system() == "Windows" else 0
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        creationflags=creation_flags
+    )
+    readers = asyncio.gather(
+        _read_stream_lines(process.stdout, on_stdout_line),
+        _read_stream_lines(process.stderr, on_stderr_line),
+    )
+    waiter = asyncio.ensure_future(process.wait())
+    interrupted = False
+    try:
+        while not waiter.done():
+            if should_stop():
+                # Whatever it was writing is discarded, so there is nothing to let it finish
+                interrupted = True
+                process.kill()
+                break
+            await asyncio.wait({waiter}, timeout=FFMPEG_STOP_POLL_SECONDS)
+        await waiter
+        await readers
+    finally:
+        if process.returncode is None:  # cancelled: the caller gave up waiting
+            process.kill()
+    return process.returncode, interrupted
+
+
+_media_loop = None
+_media_loop_pid = None
+_media_loop_lock = threading.Lock()
+
+
+def _media_command_loop():
+    """
+    The asyncio loop every media command runs on, started in a daemon thread
+    on first use. A forked child starts its own; the parent's loop thread
+    does not exist there.
+    """
+    global _media_loop, _media_loop_pid
+    with _media_loop_lock:
+        if _media_loop is None or _media_loop_pid != os.getpid():
+            _media_loop = asyncio.new_event_loop()
+            _media_loop_pid = os.getpid()
+            threading.Thread(target=_media_loop.run_forever, name='media-commands', daemon=True).start()
+        return _media_loop
+
+
+def run_media_command(args, total_duration_seconds=0.0, stage=None, label='FFmpeg', post_event=None,
+                      should_stop=None):
+    """
+    Run an ffmpeg/ffprobe command to completion on the shared media command
+    loop, so a short ffprobe call does not pay for setting up and tearing
+    down an event loop of its own.
+
+    stdout and stderr are consumed by coroutines as lines arrive, so there are
+    no reader threads and no polling of queues. The callbacks (post_event and
+    should_stop) run on the loop's thread, not the caller's. When `stage` is given, stdout
+    is parsed as the `-progress pipe:1` key=value stream and reported through
+    post_event('CORE_PROGRESS', ...); otherwise stdout is collected and
+    returned. stderr is echoed and kept in a bounded ring buffer for error
+    messages. should_stop is checked every FFMPEG_STOP_POLL_SECONDS and
+    kills the process when it returns True.
+
+    Returns a SimpleNamespace(returncode, stdout, stderr_tail, interrupted).
+    """
+    if should_stop is None:
+        should_stop = lambda: False
+
+    stdout_lines = []
+    stderr_tail = deque(maxlen=FFMPEG_STDERR_TAIL_LINES)
+
+    def on_stdout_line(line):
+        if stage is None:
+            stdout_lines.append(line)
+            return
+        key, _, value = line.partition('=')
+        if key != 'out_time' or total_duration_seconds <= 0 or not post_event:
+            return
+        try:
+            current_time_seconds = parse_ffmpeg_time(value)
+        except ValueError:  # out_time=N/A before the first frame is written
+            return
+        progress = min(int((current_time_seconds / total_duration_seconds) * 100), 100)
+        stats_obj = SimpleNamespace(progress=progress, stage=stage, eta=strfdelta(
+            max(total_duration_seconds - current_time_seconds, 0)))
+        post_event('CORE_PROGRESS', stats=stats_obj)
 
+    def on_stderr_line(line):
+        ffmpeg_log.debug('%s: %s', label, line)
+        stderr_tail.append(line)
 
-def concat_wavs_with_ffmpeg(chapter_files, output_folder, filename, post_event=None, should_stop=None):
+    future = asyncio.run_coroutine_threadsafe(
+        _run_media_command_async(args, on_stdout_line, on_stderr_line, should_stop), _media_command_loop())
+    try:
+        returncode, interrupted = future.result()
+    except BaseException:
+        future.cancel()  # e.g. KeyboardInterrupt in the caller: the command is killed
+        raise
+    return SimpleNamespace(
+        returncode=returncode,
+        stdout='\n'.join(stdout_lines),
+        stderr_tail=list(stderr_tail),
+        interrupted=interrupted
+    )
+
+
+# ---------------------------------------------------------------------------
+# Output profiles
+# ---------------------------------------------------------------------------
+# container is the ffmpeg muxer, extension the final audiobook suffix and
+# chapter_extension the suffix of standalone per-chapter files (streaming mode).
+OUTPUT_PROFILES = {
+    'aac': SimpleNamespace(name='aac', codec='aac', bitrate='64k', channels=1, sample_rate=sample_rate,
+                           container='mp4', extension='.m4b', chapter_extension='.m4a', supports_cover=True),
+    'opus': SimpleNamespace(name='opus', codec='libopus', bitrate='32k', channels=1, sample_rate=sample_rate,
+                            container='ogg', extension='.opus', chapter_extension='.opus', supports_cover=False),
+    'mp3': SimpleNamespace(name='mp3', codec='libmp3lame', bitrate='64k', channels=1, sample_rate=sample_rate,
+                           container='mp3', extension='.mp3', chapter_extension='.mp3', supports_cover=True),
+}
+
+
+def get_output_profile(name_or_profile):
+    if isinstance(name_or_profile, SimpleNamespace):
+        return name_or_profile
+    try:
+        return OUTPUT_PROFILES[name_or_profile]
+    except KeyError:
+        raise ValueError(f"Unknown output format {name_or_profile!r}, expected one of {', '.join(OUTPUT_PROFILES)}")
+
+
+def encoder_args(profile):
+    """ffmpeg arguments that encode the audio stream as described by profile."""
+    return ['-c:a', profile.codec, '-b:a', profile.bitrate, '-ac', str(profile.channels),
+            '-ar', str(profile.sample_rate)]
+
+
+def concat_wavs_with_ffmpeg(chapter_files, work_dir, filename, post_event=None, should_stop=None, profile=None):
+    """
+    Concatenate the chapter files and encode them once, using profile (default:
+    the 'aac' profile). The file list and the encoded result go to work_dir.
+    """
+    profile = get_output_profile(profile or 'aac')
     base_filename_stem = Path(filename).stem
-    wav_list_txt = Path(output_folder) / f"{base_filename_stem}_wav_list.txt"
+    wav_list_txt = Path(work_dir) / f"{base_filename_stem}_wav_list.txt"
     with open(wav_list_txt, 'w') as f:
         for wav_file in chapter_files:
             f.write(f"file '{str(wav_file)}'\n")
 
-    concat_file_path = Path(output_folder) / f"{base_filename_stem}.tmp.mp4"
+    concat_file_path = Path(work_dir) / f"{base_filename_stem}.tmp.{profile.container}"
 
     ffmpeg_concat_cmd = [
         'ffmpeg',
         '-y',
-        '-nostdin',  # <--- ADD THIS LINE
+        '-nostdin',
         '-f', 'concat',
         '-safe', '0',
         '-i', str(wav_list_txt),
-        '-c:a', 'aac',
-        '-b:a', '64k',
+        *encoder_args(profile),
+        '-f', profile.container,
         '-progress', 'pipe:1',
         '-nostats',
         str(concat_file_path)
     ]
 
-    print(f"Running FFmpeg concat command: {' '.join(ffmpeg_concat_cmd)}")
+    ffmpeg_log.debug('Running FFmpeg concat command: %s', ' '.join(ffmpeg_concat_cmd))
 
-    total_duration_seconds = sum(probe_duration(wav_file) for wav_file in chapter_files if wav_file.exists())
-    print(f"Concatenation Total Duration: {total_duration_seconds:.2f} seconds")
+    total_duration_seconds = sum(audio_duration(wav_file) for wav_file in chapter_files if wav_file.exists())
+    ffmpeg_log.debug('Concatenation Total Duration: %.2f seconds', total_duration_seconds)
 
-    process = subprocess.Popen(
-        ffmpeg_concat_cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1
-    )
-    if should_stop is None:
-        should_stop = lambda: False
-
-    q_stdout = queue.Queue()
-    q_stderr = queue.Queue()
-
-    t_stdout = threading.Thread(target=enqueue_output, args=(process.stdout, q_stdout))
-    t_stderr = threading.Thread(target=enqueue_output, args=(process.stderr, q_stderr))
-    t_stdout.daemon = True
-    t_stderr.daemon = True
-    t_stdout.start()
-    t_stderr.start()
-
-    initial_stderr_lines = []
-    # Drain initial STDERR output for a limited time or until queue is empty
-    # This prevents blocking on large initial stderr bursts
-    timeout_start = time.time()
-    while (t_stderr.is_alive() or not q_stderr.empty()) and (
-            time.time() - timeout_start < 5):  # DRAIN for max 5 seconds
-        try:
-            line = q_stderr.get_nowait().strip()
-            if line:
-                initial_stderr_lines.append(line)
-                print(f"FFmpeg CONCAT Initial STDERR: {line}", file=sys.stderr)
-        except queue.Empty:
-            time.sleep(0.01)  # Small pause to yield CPU
-
-    current_time_seconds = 0.0
-    concat_error_output = initial_stderr_lines  # Start collecting from here
-
-    try:
-        while process.poll() is None or not q_stdout.empty() or not q_stderr.empty():
-            if should_stop():
-                print("Synthesis interrupted by user (ffmpeg concat). Terminating FFmpeg process.")
-                process.terminate()
-                process.wait()
-                return None
-            # Process stdout for progress
-            try:
-                line_stdout = q_stdout.get(timeout=0.05)
-                line_stdout = line_stdout.strip()
-                # print(f"FFmpeg CONCAT STDOUT: {line_stdout}") # Debugging stdout output
-                if "=" in line_stdout:
-                    key, value = line_stdout.split("=", 1)
-                    if key == "out_time":
-                        try:
-                            h, m, s = map(float, value.split(':'))
-                            current_time_seconds = h * 3600 + m * 60 + s
-                            if total_duration_seconds > 0:
-                                progress = int((current_time_seconds / total_duration_seconds) * 100)
-                                if post_event:
-                                    stats_obj = SimpleNamespace(progress=progress, stage="concat", eta=strfdelta(
-                                        total_duration_seconds - current_time_seconds))
-                                    post_event('CORE_PROGRESS', stats=stats_obj)
-                                # print(f"CONCAT Progress: {progress}% (Time: {current_time_seconds:.2f})") # More debugging
-                        except ValueError:
-                            pass
-                    elif key == "progress" and value == "end":
-                        break
-            except queue.Empty:
-                pass
-
-            # Process stderr for errors/warnings
-            try:
-                line_stderr = q_stderr.get(timeout=0.05)
-                stripped_line = line_stderr.strip()
-                if stripped_line:
-                    print(f"FFmpeg CONCAT STDERR: {stripped_line}", file=sys.stderr)
-                    concat_error_output.append(stripped_line)
-            except queue.Empty:
-                pass
+    result = run_media_command(ffmpeg_concat_cmd, total_duration_seconds, stage='concat', label='FFmpeg CONCAT',
+                               post_event=post_event, should_stop=should_stop)
+    Path(wav_list_txt).unlink(missing_ok=True)
 
-            time.sleep(0.001)  # Small sleep to avoid busy-waiting
+    if result.interrupted:
+        ffmpeg_log.info("Synthesis interrupted by user (ffmpeg concat). FFmpeg process terminated.")
+        return None
 
-    finally:
-        # Final drain of queues
-        while not q_stdout.empty():
-            line_stdout = q_stdout.get_nowait().strip()
-            if "=" in line_stdout:  # Still try to process any last progress updates
-                key, value = line_stdout.split("=", 1)
-                if key == "out_time":
-                    try:
-                        h, m, s = map(float, value.split(':'))
-                        current_time_seconds = h * 3600 + m * 60 + s
-                        if total_duration_seconds > 0:
-                            progress = int((current_time_seconds / total_duration_seconds) * 100)
-                            if post_event:
-                                stats_obj = SimpleNamespace(progress=progress, stage="concat", eta=strfdelta(
-                                    total_duration_seconds - current_time_seconds))
-                                post_event('CORE_PROGRESS', stats=stats_obj)
-                    except ValueError:
-                        pass
-        while not q_stderr.empty():
-            stripped_line = q_stderr.get_nowait().strip()
-            if stripped_line:
-                print(f"FFmpeg CONCAT STDERR (Post-loop): {stripped_line}", file=sys.stderr)
-                concat_error_output.append(stripped_line)
-
-        process.wait()
-
-    Path(wav_list_txt).unlink()
-
-    if process.returncode != 0:
-        error_message = f"FFmpeg concatenation failed with error code {process.returncode}.\nDetails:\n" + "\n".join(
-            concat_error_output[-50:])
-        print(error_message, file=sys.stderr)
+    if result.returncode != 0:
+        error_message = f"FFmpeg concatenation failed with error code {result.returncode}.\nDetails:\n" + "\n".join(
+            result.stderr_tail)
         raise RuntimeError(error_message)
 
     return concat_file_path
 
 
-def create_m4b(concat_file_path, filename, cover_image, output_folder, post_event=None, should_stop=None):
-    print('Creating M4B file...')
+def create_m4b(concat_file_path, filename, cover_image, output_folder, post_event=None, should_stop=None,
+               profile=None, work_dir=None):
+    """
+    Package the encoded concat file with chapter metadata and cover into the
+    profile's container (an m4b for the default 'aac' profile). The audio was
+    already encoded by concat_wavs_with_ffmpeg, so it is stream-copied here.
+    The chapter index is read from and the cover written to work_dir (default
+    output_folder); the audiobook is built there and moved into output_folder
+    only once it is complete.
+    """
+    work_dir = Path(work_dir or output_folder)
+    profile = get_output_profile(profile or 'aac')
+    ffmpeg_log.info('Creating %s file...', profile.extension)
 
     original_name = Path(filename).with_suffix('').name  # removes old suffix
-    new_name = f"{original_name}.m4b"
+    new_name = f"{original_name}{profile.extension}"
     final_filename = Path(output_folder) / new_name
-    chapters_txt_path = Path(output_folder) / "chapters.txt"
-    print('Creating M4B file...')
+    part_filename = work_dir / f"{original_name}.part{profile.extension}"
+    chapters_txt_path = chapters_index_path(work_dir, filename)
 
     ffmpeg_command = [
         'ffmpeg',
         '-y',
-        '-nostdin',  # <--- ADD THIS LINE
+        '-nostdin',
         '-i', str(concat_file_path),
         '-i', str(chapters_txt_path),
     ]
 
-    if cover_image:
-        cover_file_path = Path(output_folder) / 'cover'
+    if cover_image and profile.supports_cover:
+        cover_file_path = work_dir / f"{original_name}_cover"
         with open(cover_file_path, 'wb') as f:
             f.write(cover_image)
         ffmpeg_command.extend([
@@ -807,8 +2149,7 @@ def create_m4b(concat_file_path, filename, cover_image, output_folder, post_even
 
     ffmpeg_command.extend([
         '-map', '0:a',
-        '-c:a', 'aac',
-        '-b:a', '64k',
+        '-c:a', 'copy',
     ])
 
     if map_video_index:
@@ -823,162 +2164,314 @@ def create_m4b(concat_file_path, filename, cover_image, output_folder, post_even
     ffmpeg_command.extend([
         '-map_metadata', map_metadata_index,
         '-map_chapters', map_chapters_index,
-        '-f', 'mp4',
+        *(['-id3v2_version', '3'] if profile.container == 'mp3' else []),
+        '-f', profile.container,
         '-progress', 'pipe:1',
         '-nostats',
-        str(final_filename)
+        str(part_filename)
     ])
 
-    print(f"Running FFmpeg command:\n{' '.join(ffmpeg_command)}\n")
+    ffmpeg_log.debug('Running FFmpeg command: %s', ' '.join(ffmpeg_command))
 
-    total_duration_seconds = probe_duration(concat_file_path)  # Changed to use Path object directly
-    print(f"M4B Conversion Total Duration: {total_duration_seconds:.2f} seconds")
+    total_duration_seconds = probe_duration(concat_file_path)
+    ffmpeg_log.debug('M4B Conversion Total Duration: %.2f seconds', total_duration_seconds)
 
-    process = subprocess.Popen(
-        ffmpeg_command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1
-    )
-    if should_stop is None:
-        should_stop = lambda: False
+    result = run_media_command(ffmpeg_command, total_duration_seconds, stage='ffmpeg', label='FFmpeg M4B',
+                               post_event=post_event, should_stop=should_stop)
 
-    q_stdout = queue.Queue()
-    q_stderr = queue.Queue()
-
-    t_stdout = threading.Thread(target=enqueue_output, args=(process.stdout, q_stdout))
-    t_stderr = threading.Thread(target=enqueue_output, args=(process.stderr, q_stderr))
-    t_stdout.daemon = True
-    t_stderr.daemon = True
-    t_stdout.start()
-    t_stderr.start()
-
-    initial_stderr_lines = []
-    # Drain initial STDERR output for a limited time or until queue is empty
-    timeout_start = time.time()
-    while (t_stderr.is_alive() or not q_stderr.empty()) and (
-            time.time() - timeout_start < 5):  # DRAIN for max 5 seconds
-        try:
-            line = q_stderr.get_nowait().strip()
-            if line:
-                initial_stderr_lines.append(line)
-                print(f"FFmpeg M4B Initial STDERR: {line}", file=sys.stderr)
-        except queue.Empty:
-            time.sleep(0.01)
+    if result.interrupted:
+        ffmpeg_log.info("Synthesis interrupted by user (ffmpeg m4b). FFmpeg process terminated.")
+        part_filename.unlink(missing_ok=True)
+        return
 
-    current_time_seconds = 0.0
-    ffmpeg_error_output = initial_stderr_lines
+    Path(concat_file_path).unlink()
+    if result.returncode == 0:
+        os.replace(part_filename, final_filename)
+        log.info('%s created. Enjoy your audiobook.', final_filename, extra={'output': str(final_filename)})
+    else:
+        part_filename.unlink(missing_ok=True)
+        error_message = f"FFmpeg process exited with error code {result.returncode}.\nDetails:\n" + "\n".join(
+            result.stderr_tail)
+        raise RuntimeError(error_message)
 
-    try:
-        while process.poll() is None or not q_stdout.empty() or not q_stderr.empty():
-            if should_stop():
-                print("Synthesis interrupted by user (ffmpeg m4b). Terminating FFmpeg process.")
-                process.terminate()
-                process.wait()
-                return
-            # Process stdout for progress
-            try:
-                line_stdout = q_stdout.get(timeout=0.05)
-                line_stdout = line_stdout.strip()
-                # print(f"FFmpeg M4B STDOUT: {line_stdout}") # Debugging stdout output
-                if "=" in line_stdout:
-                    key, value = line_stdout.split("=", 1)
-                    if key == "out_time":
-                        try:
-                            h, m, s = map(float, value.split(':'))
-                            current_time_seconds = h * 3600 + m * 60 + s
-                            if total_duration_seconds > 0:
-                                progress = int((current_time_seconds / total_duration_seconds) * 100)
-                                if post_event:
-                                    stats_obj = SimpleNamespace(progress=progress, stage="ffmpeg", eta=strfdelta(
-                                        total_duration_seconds - current_time_seconds))
-                                    post_event('CORE_PROGRESS', stats=stats_obj)
-                                # print(f"M4B Progress: {progress}% (Time: {current_time_seconds:.2f})") # More debugging
-                        except ValueError:
-                            pass
-                    elif key == "progress" and value == "end":
-                        break
-            except queue.Empty:
-                pass
-
-            # Process stderr for errors/warnings
-            try:
-                line_stderr = q_stderr.get(timeout=0.05)
-                stripped_line = line_stderr.strip()
-                if stripped_line:
-                    print(f"FFmpeg M4B STDERR: {stripped_line}", file=sys.stderr)
-                    ffmpeg_error_output.append(stripped_line)
-            except queue.Empty:
-                pass
 
-            time.sleep(0.001)
+PART_PACKAGING_WORKERS = 4  # parts concatenated and encoded at once, one ffmpeg process each
 
-    finally:
-        # Final drain of queues
-        while not q_stdout.empty():
-            line_stdout = q_stdout.get_nowait().strip()
-            if "=" in line_stdout:
-                key, value = line_stdout.split("=", 1)
-                if key == "out_time":
-                    try:
-                        h, m, s = map(float, value.split(':'))
-                        current_time_seconds = h * 3600 + m * 60 + s
-                        if total_duration_seconds > 0:
-                            progress = int((current_time_seconds / total_duration_seconds) * 100)
-                            if post_event:
-                                stats_obj = SimpleNamespace(progress=progress, stage="ffmpeg", eta=strfdelta(
-                                    total_duration_seconds - current_time_seconds))
-                                post_event('CORE_PROGRESS', stats=stats_obj)
-                    except ValueError:
-                        pass
-        while not q_stderr.empty():
-            stripped_line = q_stderr.get_nowait().strip()
-            if stripped_line:
-                print(f"FFmpeg M4B STDERR (Post-loop): {stripped_line}", file=sys.stderr)
-                ffmpeg_error_output.append(stripped_line)
-
-        process.wait()
 
-    Path(concat_file_path).unlink()
-    if process.returncode == 0:
-        print(f'{final_filename} created. Enjoy your audiobook.')
-    else:
-        error_message = f"FFmpeg process exited with error code {process.returncode}.\nDetails:\n" + "\n".join(
-            ffmpeg_error_output[-50:])
-        print(error_message, file=sys.stderr)
-        raise RuntimeError(error_message)
+def split_into_parts(durations, profile=None, max_part_hours=None, max_part_mb=None):
+    """
+    Group consecutive chapters (given by their durations in seconds) into
+    parts of at most max_part_hours, and at most max_part_mb as estimated
+    from the profile's bitrate. A chapter longer than the limit becomes a
+    part of its own. Returns a list of lists of chapter indices.
+    """
+    profile = get_output_profile(profile or 'aac')
+    limits = []
+    if max_part_hours:
+        limits.append(max_part_hours * 3600)
+    if max_part_mb:
+        bytes_per_second = int(profile.bitrate.rstrip('k')) * 1000 / 8
+        limits.append(max_part_mb * 1e6 / bytes_per_second)
+    limit = min(limits) if limits else float('inf')
+    parts, part_seconds = [[]], 0.0
+    for i, seconds in enumerate(durations):
+        if parts[-1] and part_seconds + seconds > limit:
+            parts.append([])
+            part_seconds = 0.0
+        parts[-1].append(i)
+        part_seconds += seconds
+    return [part for part in parts if part]
+
+
+def package_parts(parts, chapter_files, title, creator, filename, cover_image, output_folder, work_dir, profile,
+                  post_event=None, should_stop=None):
+    """
+    Package each part (a list of indices into chapter_files) as its own
+    audiobook, <stem>_partNN, with its own chapter metadata and cover, up to
+    PART_PACKAGING_WORKERS at once, then write <stem>_parts.m3u listing the
+    parts in order. Returns the part files; raises RuntimeError when a part
+    could not be created.
+    """
+    stem, suffix = Path(filename).stem, Path(filename).suffix
+    should_stop = should_stop or (lambda: False)
+
+    def package_part(n, indices):
+        part_filename = f'{stem}_part{n:02}{suffix}'
+        files = [chapter_files[i] for i in indices]
+        create_index_file(f'{title} (Part {n} of {len(parts)})', creator, files, work_dir, part_filename,
+                          first_chapter=indices[0])
+        concat_file_path = concat_wavs_with_ffmpeg(files, work_dir, part_filename, post_event=post_event,
+                                                   should_stop=should_stop, profile=profile)
+        if concat_file_path is None:
+            return None
+        create_m4b(concat_file_path, part_filename, cover_image, output_folder, post_event=post_event,
+                   should_stop=should_stop, profile=profile, work_dir=work_dir)
+        part_path = Path(output_folder) / f'{stem}_part{n:02}{profile.extension}'
+        if not part_path.exists() and not should_stop():
+            raise RuntimeError(f"Part {n} of {len(parts)} could not be created")
+        return part_path
+
+    log.info('Packaging %d parts...', len(parts))
+    with ThreadPoolExecutor(max_workers=min(PART_PACKAGING_WORKERS, len(parts)),
+                            thread_name_prefix='package-part') as pool:
+        part_paths = list(pool.map(package_part, range(1, len(parts) + 1), parts))
+    if should_stop():
+        return part_paths
+
+    lines = ['#EXTM3U', f'#PLAYLIST:{title}']
+    for n, (indices, part_path) in enumerate(zip(parts, part_paths), start=1):
+        lines.append(f'#EXTINF:{int(round(probe_duration(part_path)))},{title} - Part {n} of {len(parts)} '
+                     f'(chapters {indices[0] + 1}-{indices[-1] + 1})')
+        lines.append(part_path.name)
+    index_path = Path(output_folder) / f'{stem}_parts.m3u'
+    tmp_path = index_path.with_suffix('.m3u.tmp')
+    tmp_path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    os.replace(tmp_path, index_path)
+    log.info('%d parts listed in %s', len(parts), index_path)
+    return part_paths
 
 
 def probe_duration(file_name):
     # Check if the file exists before probing, to prevent errors if file was not created
     if not Path(file_name).exists():
-        print(f"Warning: File not found for ffprobe duration: {file_name}", file=sys.stderr)
+        ffmpeg_log.warning('File not found for ffprobe duration: %s', file_name)
         return 0.0
 
     args = ['ffprobe', '-i', str(file_name), '-show_entries', 'format=duration', '-v', 'quiet', '-of',
             'default=noprint_wrappers=1:nokey=1']
-    try:
-        # Using CREATE_NO_WINDOW on Windows to prevent console flashing for ffprobe
-        creation_flags = subprocess.CREATE_NO_WINDOW if platform.system() == "Windows" else 0
-        proc = subprocess.run(args, capture_output=True, text=True, check=True, creationflags=creation_flags)
-        duration = float(proc.stdout.strip())
-        return duration
-    except subprocess.CalledProcessError as e:
-        print(f"Error probing duration for {file_name}: {e.stderr}", file=sys.stderr)
+    result = run_media_command(args, label='FFprobe')
+    if result.returncode != 0:
+        ffmpeg_log.warning('Error probing duration for %s: %s', file_name, ' '.join(result.stderr_tail))
         return 0.0
+    try:
+        return float(result.stdout.strip())
     except ValueError:  # Occurs if stdout is not a float (e.g., empty or error message)
-        print(f"Could not parse duration from ffprobe output for {file_name}: '{proc.stdout.strip()}'", file=sys.stderr)
+        ffmpeg_log.warning("Could not parse duration from ffprobe output for %s: '%s'", file_name,
+                           result.stdout.strip())
         return 0.0
 
 
-def create_index_file(title, creator, chapter_mp3_files, output_folder):
-    with open(Path(output_folder) / "chapters.txt", "w", encoding="ascii", newline="\n") as f:
+class ChapterStreamer:
+    """
+    Listen-while-rendering output. Finished chapter WAVs are encoded one at a
+    time on a background thread into <book>_chapters/, and <book>.m3u is
+    rewritten after each one so players can start on chapter 1 while the
+    rest of the book is still being synthesized.
+    """
+
+    def __init__(self, output_folder, filename, profile='opus', should_stop=None):
+        profile = get_output_profile(profile)
+        stem = Path(filename).stem
+        self.extension = profile.chapter_extension
+        self.codec_args = encoder_args(profile)
+        self.chapters_folder = Path(output_folder) / f"{stem}_chapters"
+        self.chapters_folder.mkdir(parents=True, exist_ok=True)
+        self.playlist_path = Path(output_folder) / f"{stem}.m3u"
+        self.should_stop = should_stop
+        self.entries = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chapter-stream')
+
+    def add(self, chapter_wav_path, chapter_title):
+        self._executor.submit(self._encode, Path(chapter_wav_path), chapter_title)
+
+    def close(self):
+        """Wait for the queued chapters to be encoded."""
+        self._executor.shutdown(wait=True)
+
+    def _encode(self, chapter_wav_path, chapter_title):
+        try:
+            out_path = self.chapters_folder / (chapter_wav_path.stem + self.extension)
+            if not out_path.exists():
+                part_path = out_path.with_name(out_path.stem + '.part' + self.extension)
+                result = run_media_command(
+                    ['ffmpeg', '-y', '-nostdin', '-i', str(chapter_wav_path), *self.codec_args,
+                     '-metadata', f'title={chapter_title}', str(part_path)],
+                    label='FFmpeg STREAM', should_stop=self.should_stop
+                )
+                if result.interrupted or result.returncode != 0:
+                    part_path.unlink(missing_ok=True)
+                    if not result.interrupted:
+                        ffmpeg_log.warning('Could not encode %s for streaming:\n%s', chapter_wav_path,
+                                           '\n'.join(result.stderr_tail))
+                    return
+                os.replace(part_path, out_path)
+            self.entries.append((chapter_title, audio_duration(out_path), out_path))
+            self._write_playlist()
+            log.info('%s ready to play: %s', chapter_title, out_path)
+        except Exception:
+            log.exception('Could not add %s to the stream', chapter_title)
+
+    def _write_playlist(self):
+        lines = ['#EXTM3U']
+        for chapter_title, duration, path in self.entries:
+            lines.append(f'#EXTINF:{int(round(duration))},{chapter_title}')
+            lines.append(f'{self.chapters_folder.name}/{path.name}')
+        # Replace atomically so a player reloading the playlist never sees a partial file
+        tmp_path = self.playlist_path.with_suffix('.m3u.tmp')
+        tmp_path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+        os.replace(tmp_path, self.playlist_path)
+
+
+CHAPTER_MANIFEST_NAME = 'chapters.json'
+CHAPTER_MANIFEST_VERSION = 1
+
+
+def render_inputs(cb_model, audio_prompt_wav=None, pauses=None, silence_trim=True, target_lufs=DEFAULT_TARGET_LUFS,
+                  max_sentences=None, qa=True):
+    """
+    Everything besides the text that shapes a chapter's audio: voice, model
+    and the settings main() passes to gen_audio_segments. speed is left out,
+    Chatterbox ignores it.
+    """
+    return {
+        'voice': file_digest(audio_prompt_wav) if audio_prompt_wav else 'builtin',
+        'model': getattr(cb_model, 'model_id', 'unknown'),
+        'accel': getattr(cb_model, 'accel', 'fp32'),
+        'backend': getattr(cb_model, 'backend', 'torch'),
+        'settings': {
+            'pauses': DEFAULT_PAUSES if pauses is None else pauses,
+            'silence_trim': silence_trim,
+            'target_lufs': target_lufs,
+            'max_sentences': max_sentences,
+            'qa': qa,
+            'sample_rate': sample_rate,
+        },
+    }
+
+
+class ChapterManifest:
+    """
+    <work_dir>/chapters.json: for every rendered chapter the SHA-256 of its
+    cleaned text, the render_inputs() it was rendered with, and the audio
+    file and its sample count, keyed by a digest of text and inputs together.
+    A chapter is reused only when an entry with its key points to a file that
+    still has the recorded number of samples, so an edited chapter, another
+    voice, model or setting is re-rendered and a renamed chapter is not.
+    Each record is merged into the file as it is on disk, so farm workers
+    sharing a work directory keep each other's entries.
+    """
+
+    def __init__(self, work_dir, inputs):
+        self.path = Path(work_dir) / CHAPTER_MANIFEST_NAME
+        self.inputs = inputs
+        self._inputs_json = json.dumps(inputs, sort_keys=True)
+        self._lock = threading.Lock()
+        self.entries = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return manifest.get('chapters', {}) if manifest.get('version') == CHAPTER_MANIFEST_VERSION else {}
+
+    def key(self, text):
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return hashlib.sha256(f'{digest}:{self._inputs_json}'.encode('utf-8')).hexdigest()[:16]
+
+    def find(self, key):
+        """The recorded audio file for key if it is still complete, else None."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        path = self.path.parent / entry['file']
+        try:
+            if soundfile.info(str(path)).frames == entry['samples']:
+                return path
+        except Exception:  # missing or unreadable
+            pass
+        return None
+
+    def record(self, key, chapter_name, text, chapter_path):
+        entry = {
+            'chapter': chapter_name,
+            'text_sha256': hashlib.sha256(text.encode('utf-8')).hexdigest(),
+            **self.inputs,
+            'file': Path(chapter_path).name,
+            'samples': soundfile.info(str(chapter_path)).frames,
+        }
+        with self._lock:
+            entries = self._read()
+            if entries.get(key) == entry:
+                self.entries = entries
+                return
+            entries[key] = entry
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            part = self.path.with_name(f'{self.path.name}.{os.getpid()}.part')
+            with open(part, 'w', encoding='utf-8') as f:
+                json.dump({'version': CHAPTER_MANIFEST_VERSION, 'chapters': entries}, f, indent=1)
+            os.replace(part, self.path)
+            self.entries = entries
+
+
+WORK_DIR_NAME = '.chatterblez_work'
+
+
+def job_work_dir(output_folder, file_path):
+    """
+    Scratch directory for one book's intermediates (chapter audio, chapter
+    index, cover, concat output) inside output_folder. It is named after the
+    book and a hash of its full path, so books converted at the same time into
+    one output folder never share files, while a rerun of the same book finds
+    its finished chapters again.
+    """
+    source = str(Path(file_path).resolve())
+    digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:10]
+    return Path(output_folder) / WORK_DIR_NAME / f"{Path(file_path).stem}-{digest}"
+
+
+def chapters_index_path(work_dir, filename):
+    return Path(work_dir) / f"{Path(filename).stem}_chapters.txt"
+
+
+def create_index_file(title, creator, chapter_mp3_files, work_dir, filename, first_chapter=0):
+    with open(chapters_index_path(work_dir, filename), "w", encoding="ascii", newline="\n") as f:
         f.write(f";FFMETADATA1\ntitle={title}\nartist={creator}\n\n")
         start = 0
-        i = 0
+        i = first_chapter
         for c in chapter_mp3_files:
-            duration = probe_duration(c)
+            duration = audio_duration(c)
             end = start + (int)(duration * 1000)
             f.write(f"[CHAPTER]\nTIMEBASE=1/1000\nSTART={start}\nEND={end}\ntitle=Chapter {i}\n\n")
             i += 1
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# chatterblez - one shared model for synthesis and previews
+#
+#   engine = Engine()
+#   core.main(..., cb_model=engine.client(BATCH))        # long render, any thread
+#   preview = engine.client(INTERACTIVE)
+#   with engine.session(INTERACTIVE):                     # batch pauses after its current sentence
+#       wav = preview.generate(sentence)
+#
+# The engine owns the only copy of the model and runs one generate() call at a
+# time. Callers take a lane; a sentence waits while a higher lane has an open
+# session or a sentence queued, so a preview preempts a running book at the
+# next sentence boundary and the book resumes as soon as the preview ends.
+# Each client keeps its own voice conditioning, swapped in per sentence.
+import threading
+from contextlib import contextmanager
+
+INTERACTIVE = 0
+BATCH = 1
+LANES = (INTERACTIVE, BATCH)
+
+
+class Engine:
+    def __init__(self, cb_model=None, loader=None):
+        """
+        cb_model is used as is; otherwise loader() (default:
+        core.load_tts_model) loads the model on first use, in whichever
+        thread needs it first.
+        """
+        self._model = cb_model
+        self._loader = loader
+        self._load_lock = threading.Lock()
+        self._turn = threading.Condition()
+        self._busy = False
+        self._demand = [0] * len(LANES)  # open sessions plus queued sentences, per lane
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    if self._loader is None:
+                        import core
+                        self._model = core.load_tts_model()
+                    else:
+                        self._model = self._loader()
+        return self._model
+
+    def client(self, lane=BATCH):
+        return EngineClient(self, lane)
+
+    @contextmanager
+    def session(self, lane):
+        """Keep lower lanes paused between the sentences generated inside the block."""
+        with self._turn:
+            self._demand[lane] += 1
+        try:
+            yield self
+        finally:
+            with self._turn:
+                self._demand[lane] -= 1
+                self._turn.notify_all()
+
+    @contextmanager
+    def turn(self, lane):
+        """
+        Exclusive use of the model for one call, granted to the highest lane
+        waiting. A caller inside core.cancellable() stops waiting with
+        SynthesisCancelled as soon as its should_stop returns True.
+        """
+        import core
+        with self._turn:
+            self._demand[lane] += 1
+            try:
+                while self._busy or any(self._demand[higher] for higher in LANES[:lane]):
+                    self._turn.wait(core.STOP_POLL_SECONDS)
+                    core.check_cancelled()
+            finally:
+                self._demand[lane] -= 1
+            self._busy = True
+        try:
+            yield self.model
+        finally:
+            with self._turn:
+                self._busy = False
+                self._turn.notify_all()
+
+
+class EngineClient:
+    """
+    Stands in for a ChatterboxTTS model in core.main, set_voice and the
+    preview: generate() and prepare_conditionals() take a turn on the engine
+    in this client's lane, everything else is read from the shared model.
+    """
+
+    def __init__(self, engine, lane):
+        object.__setattr__(self, '_engine', engine)
+        object.__setattr__(self, '_lane', lane)
+        object.__setattr__(self, 'conds', None)
+
+    def __getattr__(self, name):
+        return getattr(self._engine.model, name)
+
+    def __setattr__(self, name, value):
+        if name == 'conds':
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._engine.model, name, value)
+
+    def generate(self, text, **kwargs):
+        with self._engine.turn(self._lane) as model:
+            shared = model.conds
+            if self.conds is not None:
+                model.conds = self.conds
+            try:
+                return model.generate(text, **kwargs)
+            finally:
+                model.conds = shared
+
+    def prepare_conditionals(self, wav_fpath, **kwargs):
+        with self._engine.turn(self._lane) as model:
+            shared = model.conds
+            try:
+                model.prepare_conditionals(wav_fpath, **kwargs)
+                object.__setattr__(self, 'conds', model.conds)
+            finally:
+                model.conds = shared
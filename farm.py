@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# chatterblez - cooperative chapter rendering by several processes sharing an output folder
+#
+# Every worker runs core.main over the same books and output folder (a shared
+# NFS mount for workers on different hosts). Before rendering a chapter a
+# worker claims it by creating <work dir>/leases/<chapter>.lease with O_EXCL.
+# Held leases are touched every heartbeat; a lease whose file was not touched
+# for lease_seconds belongs to a dead worker and may be taken over. Whichever
+# worker finds all chapter files present assembles the audiobook, guarded by
+# its own lease, and leaves an 'assembled' marker so the others stop.
+#
+# Chapter files are written under a temporary name and renamed when complete,
+# so a lease lost to a stalled worker only ever costs duplicate work.
+#
+# Chapter file names include a digest of the render inputs (voice, model,
+# acceleration, backend and chapter settings, see core.render_inputs), so
+# workers can only share chapters when these agree. The first worker to claim
+# a chapter of a book records its inputs in <work dir>/farm_inputs.json; a
+# worker whose inputs differ (another voice, or the model loaded from the hub
+# instead of the pinned store) refuses to render instead of duplicating the
+# whole book. The record is removed when the book is assembled.
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+from logs import get_logger
+
+log = get_logger('farm')
+
+LEASE_SECONDS = 120.0  # a lease not renewed for this long is considered abandoned
+FARM_POLL_SECONDS = 10.0  # wait between passes while other workers still hold chapters
+LEASES_DIR = 'leases'
+ASSEMBLE_LEASE = 'assemble.lease'
+ASSEMBLED_MARKER = 'assembled'
+FARM_INPUTS = 'farm_inputs.json'
+
+
+class FarmInputsMismatch(RuntimeError):
+    """Raised when a worker's render inputs differ from those the book's first worker recorded."""
+
+
+def check_render_inputs(work_dir, inputs):
+    """
+    Record inputs in work_dir/FARM_INPUTS if no worker has yet, otherwise
+    raise FarmInputsMismatch when the recorded inputs differ from these.
+    """
+    path = Path(work_dir) / FARM_INPUTS
+    payload = json.dumps(inputs, sort_keys=True, indent=2)
+    part_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+    part_path.write_text(payload)
+    try:
+        os.link(part_path, path)  # creates path only if no other worker did, never half-written
+        return
+    except FileExistsError:
+        recorded = json.loads(path.read_text())
+    finally:
+        part_path.unlink(missing_ok=True)
+    expected = json.loads(payload)
+    if recorded != expected:
+        differing = sorted(key for key in recorded.keys() | expected.keys() if recorded.get(key) != expected.get(key))
+        raise FarmInputsMismatch(
+            f"This worker's {', '.join(differing)} differ from those of the workers already rendering this book "
+            f"(see {path}); start every worker with the same voice, model and settings, or delete the file to "
+            f"start the book over with new ones")
+
+
+class Lease:
+    def __init__(self, manager, path):
+        self.manager = manager
+        self.path = path
+
+    def release(self):
+        self.manager.release(self)
+
+
+class LeaseManager:
+    """
+    Creates, renews and releases lease files for one worker. Expiry is judged
+    by the lease file's mtime, which on NFS is set by the server, so hosts only
+    need roughly synchronized clocks (well within lease_seconds).
+    """
+
+    def __init__(self, owner=None, lease_seconds=LEASE_SECONDS):
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.held = {}  # path -> Lease
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._heartbeat = threading.Thread(target=self._renew_loop, name='lease-heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    def acquire(self, lease_path):
+        """Return a Lease on lease_path, or None while another live worker holds it."""
+        lease_path = Path(lease_path)
+        lease_path.parent.mkdir(parents=True, exist_ok=True)
+        payload = json.dumps({'owner': self.owner, 'host': socket.gethostname(), 'pid': os.getpid(),
+                              'acquired_at': time.time()})
+        for _ in range(3):
+            try:
+                fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                try:
+                    age = time.time() - lease_path.stat().st_mtime
+                except FileNotFoundError:
+                    continue  # released meanwhile, try again
+                if age < self.lease_seconds:
+                    return None
+                # Abandoned: move it aside under a name only we use, so exactly one worker takes it over
+                stale_path = lease_path.with_name(f"{lease_path.name}.stale-{self.owner}")
+                try:
+                    os.rename(lease_path, stale_path)
+                except FileNotFoundError:
+                    continue
+                log.info("Taking over abandoned lease %s (%.0fs old)", lease_path, age)
+                stale_path.unlink(missing_ok=True)
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(payload)
+            lease = Lease(self, lease_path)
+            with self._lock:
+                self.held[lease_path] = lease
+            return lease
+        return None
+
+    def release(self, lease):
+        with self._lock:
+            if self.held.pop(lease.path, None) is None:
+                return
+        if self._owns(lease.path):
+            lease.path.unlink(missing_ok=True)
+
+    def release_all(self):
+        for lease in list(self.held.values()):
+            self.release(lease)
+
+    def close(self):
+        self._closed.set()
+        self.release_all()
+
+    def _owns(self, lease_path):
+        try:
+            return json.loads(Path(lease_path).read_text()).get('owner') == self.owner
+        except (OSError, ValueError):
+            return False
+
+    def _renew_loop(self):
+        while not self._closed.wait(self.lease_seconds / 4):
+            with self._lock:
+                held = list(self.held)
+            for lease_path in held:
+                if not self._owns(lease_path):
+                    log.warning("Lost lease %s to another worker", lease_path)
+                    with self._lock:
+                        self.held.pop(lease_path, None)
+                    continue
+                try:
+                    os.utime(lease_path)
+                except OSError as e:
+                    log.warning("Could not renew lease %s: %s", lease_path, e)
+
+
+def chapter_lease_path(chapter_wav_path):
+    chapter_wav_path = Path(chapter_wav_path)
+    return chapter_wav_path.parent / LEASES_DIR / f"{chapter_wav_path.stem}.lease"
+
+
+def is_assembled(output_folder, file_path):
+    import core
+    return (core.job_work_dir(output_folder, file_path) / ASSEMBLED_MARKER).exists()
+
+
+def run_farm_worker(book_paths, output_folder='.', lease_seconds=LEASE_SECONDS, poll_seconds=FARM_POLL_SECONDS,
+                    post_event=None, should_stop=None, cb_model=None, **main_kwargs):
+    """
+    Render chapters of book_paths together with any other workers pointed at
+    the same output_folder, and assemble each book once all of its chapters
+    exist. Returns when every book is assembled or should_stop() becomes True.
+    main_kwargs are passed to core.main; all workers must use the same
+    voice, model and chapter settings, a worker whose render inputs differ
+    from the book's first worker stops with an error (see check_render_inputs).
+    """
+    import core
+
+    should_stop = should_stop or (lambda: False)
+    leases = LeaseManager(lease_seconds=lease_seconds)
+    log.info("Farm worker %s", leases.owner)
+
+    checked_work_dirs = set()
+
+    def claim(chapter_wav_path, inputs):
+        work_dir = Path(chapter_wav_path).parent
+        if work_dir not in checked_work_dirs:
+            check_render_inputs(work_dir, inputs)
+            checked_work_dirs.add(work_dir)
+        lease = leases.acquire(chapter_lease_path(chapter_wav_path))
+        if lease is not None and core.find_chapter_audio(Path(chapter_wav_path).with_suffix('')):
+            lease.release()  # finished by another worker since main() looked
+            return None
+        return lease
+
+    def make_assembler(path, outcome):
+        work_dir = core.job_work_dir(output_folder, path)
+
+        def submit(package):
+            lease = leases.acquire(work_dir / LEASES_DIR / ASSEMBLE_LEASE)
+            if lease is None:
+                log.info("%s is being assembled by another worker", path)
+                return
+            try:
+                if (work_dir / ASSEMBLED_MARKER).exists():
+                    return
+                package()
+                if outcome.get('finished'):
+                    (work_dir / ASSEMBLED_MARKER).write_text(
+                        json.dumps({'owner': leases.owner, 'assembled_at': time.time()}))
+                    (work_dir / FARM_INPUTS).unlink(missing_ok=True)
+            finally:
+                lease.release()
+
+        return SimpleNamespace(submit=submit)
+
+    try:
+        while not should_stop():
+            pending = [p for p in book_paths if not is_assembled(output_folder, p)]
+            if not pending:
+                log.info("All books assembled.")
+                break
+            if cb_model is None:
+                cb_model = core.load_tts_model(accel=main_kwargs.get('accel', 'fp32'),
+                                               backend=main_kwargs.get('backend', 'torch'),
+                                               onnx_dir=main_kwargs.get('onnx_dir'))
+            for path in pending:
+                if should_stop():
+                    break
+                outcome = {}
+
+                def book_event(evt_name, **kwargs):
+                    if evt_name == 'CORE_FINISHED':
+                        outcome['finished'] = True
+                    if post_event:
+                        post_event(evt_name, file_path=path, **kwargs)
+
+                try:
+                    core.main(file_path=path, pick_manually=False, output_folder=output_folder,
+                              post_event=book_event, should_stop=should_stop, cb_model=cb_model,
+                              packager=make_assembler(path, outcome), keep_intermediates=True,
+                              chapter_claim=claim, **main_kwargs)
+                except FarmInputsMismatch as e:
+                    log.error("Not rendering %s: %s", path, e)
+                    if post_event:
+                        post_event('CORE_ERROR', file_path=path, message=str(e))
+                    return
+                except Exception:
+                    log.exception("Rendering %s failed", path)
+                finally:
+                    leases.release_all()
+            if all(is_assembled(output_folder, p) for p in book_paths):
+                log.info("All books assembled.")
+                break
+            log.info("Waiting for chapters held by other workers, next pass in %.0f seconds", poll_seconds)
+            deadline = time.time() + poll_seconds
+            while time.time() < deadline and not should_stop():
+                time.sleep(min(core.STOP_POLL_SECONDS, poll_seconds))
+    finally:
+        leases.close()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# chatterblez - logging setup
+#
+#   python cli.py -f book.epub --log-level debug
+#   python cli.py -f book.epub --log-format json 2> book.log.jsonl
+#
+# Each module logs to a child of the 'chatterblez' logger named after its
+# subsystem: chatterblez.cli, .core, .ffmpeg, .model, .batch, .farm,
+# .server, .model_store, .onnx and .gui. INFO carries the summaries: a line when a
+# book starts, one per chapter and one when the audiobook is written. DEBUG
+# adds the chapter text, ffmpeg command lines and ffmpeg's stderr. Messages
+# take %-style arguments, so records below the level are never formatted.
+import json
+import logging
+import sys
+
+ROOT_LOGGER = 'chatterblez'
+LOG_LEVELS = ('debug', 'info', 'warning', 'error')
+LOG_FORMATS = ('text', 'json')
+TEXT_FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def get_logger(subsystem):
+    return logging.getLogger(f'{ROOT_LOGGER}.{subsystem}')
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line with time, level, logger and message, plus the
+    fields given with extra= (chapter, seconds, ...) and the traceback.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level='info', log_format='text', stream=None):
+    """
+    Send the chatterblez loggers to stream (default: stderr) at level, as
+    readable lines or, with log_format 'json', as JSON lines for log
+    collectors. Replaces the handler of an earlier call.
+    """
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format {log_format!r}, expected one of {', '.join(LOG_FORMATS)}")
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT, '%H:%M:%S'))
+    root = logging.getLogger(ROOT_LOGGER)
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+    return root
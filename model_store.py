@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# chatterblez - offline model store
+#
+#   python cli.py model-store pin [FOLDER] [--from CHECKPOINT_DIR]
+#   python cli.py model-store verify [FOLDER]
+#
+# A pinned, verified copy of the Chatterbox weights, all in safetensors form
+# (the built-in voice included, which the hub ships as a torch pickle).
+# load_model() memory-maps the tensors straight into the modules without a
+# single network call: nothing is deserialized into fresh memory, and worker
+# processes on one host share the weight pages through the OS page cache.
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+from logs import configure_logging, get_logger
+
+log = get_logger('model_store')
+
+MODEL_STORE_DIR = Path(os.environ.get('CHATTERBLEZ_MODEL_STORE') or Path.home() / '.cache' / 'chatterblez' / 'model')
+MODEL_REPO_ID = 'ResembleAI/chatterbox'
+HUB_FILES = ('ve.safetensors', 't3_cfg.safetensors', 's3gen.safetensors', 'tokenizer.json', 'conds.pt')
+STORE_FILES = ('ve.safetensors', 't3_cfg.safetensors', 's3gen.safetensors', 'tokenizer.json', 'conds.safetensors')
+STORE_MANIFEST = 'manifest.json'
+
+SAFETENSORS_DTYPES = {
+    'F64': torch.float64, 'F32': torch.float32, 'F16': torch.float16, 'BF16': torch.bfloat16,
+    'I64': torch.int64, 'I32': torch.int32, 'I16': torch.int16, 'I8': torch.int8, 'U8': torch.uint8,
+    'BOOL': torch.bool,
+}
+
+
+def _sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _contiguous_strides(shape):
+    strides = [1] * len(shape)
+    for i in range(len(shape) - 2, -1, -1):
+        strides[i] = strides[i + 1] * shape[i + 1]
+    return strides
+
+
+def mmap_safetensors(path):
+    """
+    The tensors of a safetensors file as views of one private (copy-on-write)
+    memory map of the file, plus the file's metadata dict. Tensors whose
+    offset is not aligned to their element size are copied out instead.
+    """
+    with open(path, 'rb') as f:
+        header_size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_size))
+    metadata = header.pop('__metadata__', None) or {}
+    data_start = 8 + header_size
+    storage = torch.UntypedStorage.from_file(str(path), shared=False, nbytes=os.path.getsize(path))
+    raw = torch.empty(0, dtype=torch.uint8).set_(storage)
+    tensors = {}
+    for name, info in header.items():
+        dtype = SAFETENSORS_DTYPES[info['dtype']]
+        begin, end = (data_start + offset for offset in info['data_offsets'])
+        itemsize = torch.empty(0, dtype=dtype).element_size()
+        if begin % itemsize:
+            tensors[name] = raw[begin:end].clone().view(dtype).reshape(info['shape'])
+        else:
+            tensors[name] = torch.empty(0, dtype=dtype).set_(storage, begin // itemsize, info['shape'],
+                                                             _contiguous_strides(info['shape']))
+    return tensors, metadata
+
+
+def conds_to_safetensors(conds_pt, path):
+    """Rewrite the built-in voice (a pickled Conditionals) as safetensors: tensors as 't3.x'/'gen.x', the rest as metadata."""
+    from safetensors.torch import save_file
+    saved = torch.load(conds_pt, map_location='cpu', weights_only=True)
+    tensors, scalars = {}, {}
+    for group in ('t3', 'gen'):
+        for key, value in saved[group].items():
+            if torch.is_tensor(value):
+                tensors[f'{group}.{key}'] = value.contiguous()
+            else:
+                scalars[f'{group}.{key}'] = value
+    save_file(tensors, str(path), metadata={'scalars': json.dumps(scalars)})
+
+
+def load_conds(path, device):
+    from chatterbox.tts import Conditionals
+    from chatterbox.models.t3.modules.cond_enc import T3Cond
+    tensors, metadata = mmap_safetensors(path)
+    groups = {'t3': {}, 'gen': {}}
+    for key, value in [*tensors.items(), *json.loads(metadata.get('scalars', '{}')).items()]:
+        group, name = key.split('.', 1)
+        groups[group][name] = value
+    return Conditionals(T3Cond(**groups['t3']), groups['gen']).to(device)
+
+
+def read_manifest(store_dir=MODEL_STORE_DIR):
+    """The store's manifest dict, or None when nothing is pinned in store_dir."""
+    try:
+        with open(Path(store_dir) / STORE_MANIFEST) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def model_id(store_dir=MODEL_STORE_DIR):
+    """Short digest of the pinned files' checksums, identifying the exact weights in the store."""
+    files = read_manifest(store_dir)['files']
+    return hashlib.sha256(json.dumps(files, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def pin_model(store_dir=MODEL_STORE_DIR, checkpoint_dir=None):
+    """
+    Copy the Chatterbox checkpoint from checkpoint_dir (default: download it
+    through the Hugging Face hub cache) into store_dir, converting the
+    built-in voice to safetensors, and record each file's size and SHA-256.
+    The store is assembled in a sibling folder and swapped in when complete.
+    """
+    store_dir = Path(store_dir)
+    if checkpoint_dir is None:
+        from huggingface_hub import hf_hub_download
+        sources = {name: Path(hf_hub_download(repo_id=MODEL_REPO_ID, filename=name)) for name in HUB_FILES}
+    else:
+        sources = {name: Path(checkpoint_dir) / name for name in HUB_FILES}
+        missing = [str(p) for p in sources.values() if not p.is_file()]
+        if missing:
+            raise FileNotFoundError(f"Checkpoint file missing: {missing[0]}")
+
+    part_dir = store_dir.with_name(store_dir.name + '.part')
+    shutil.rmtree(part_dir, ignore_errors=True)
+    part_dir.mkdir(parents=True)
+    for name, source in sources.items():
+        if name == 'conds.pt':
+            conds_to_safetensors(source, part_dir / 'conds.safetensors')
+        else:
+            shutil.copyfile(source, part_dir / name)
+    files = {name: {'size': os.path.getsize(part_dir / name), 'sha256': _sha256(part_dir / name)}
+             for name in STORE_FILES}
+    with open(part_dir / STORE_MANIFEST, 'w') as f:
+        json.dump({'repo_id': MODEL_REPO_ID, 'source': str(checkpoint_dir or 'hub'), 'pinned_at': time.time(),
+                   'files': files}, f, indent=2)
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(part_dir, store_dir)
+    log.info("Pinned %d files, %.2f GB, to %s", len(files), sum(f['size'] for f in files.values()) / 1e9, store_dir)
+    return store_dir
+
+
+def verify_store(store_dir=MODEL_STORE_DIR, full=True):
+    """
+    Problems with the pinned files as a list of strings, empty when the store
+    is intact. Sizes are always checked; full also re-hashes every file.
+    """
+    store_dir = Path(store_dir)
+    manifest = read_manifest(store_dir)
+    if manifest is None:
+        return [f"No model pinned in {store_dir}"]
+    problems = []
+    for name, expected in manifest['files'].items():
+        path = store_dir / name
+        if not path.is_file():
+            problems.append(f"{name}: missing")
+        elif os.path.getsize(path) != expected['size']:
+            problems.append(f"{name}: size changed")
+        elif full and _sha256(path) != expected['sha256']:
+            problems.append(f"{name}: checksum mismatch")
+    return problems
+
+
+def load_model(store_dir=MODEL_STORE_DIR, device='cpu'):
+    """
+    ChatterboxTTS from the pinned store, equivalent to
+    ChatterboxTTS.from_local() but with memory-mapped weights and without
+    network access. On the CPU the parameters stay backed by the files; on
+    a GPU they are copied to the device straight from the page cache.
+    """
+    os.environ.setdefault('HF_HUB_OFFLINE', '1')
+    from chatterbox.tts import ChatterboxTTS
+    from chatterbox.models.t3 import T3
+    from chatterbox.models.s3gen import S3Gen
+    from chatterbox.models.tokenizers import EnTokenizer
+    from chatterbox.models.voice_encoder import VoiceEncoder
+
+    store_dir = Path(store_dir)
+    problems = verify_store(store_dir, full=False)
+    if problems:
+        raise RuntimeError(f"Model store {store_dir} is not usable ({problems[0]}), "
+                           f"run 'cli.py model-store pin {store_dir}'")
+
+    ve = VoiceEncoder()
+    ve.load_state_dict(mmap_safetensors(store_dir / 've.safetensors')[0], assign=True)
+    ve.to(device).eval()
+
+    t3 = T3()
+    t3_state = mmap_safetensors(store_dir / 't3_cfg.safetensors')[0]
+    if 'model' in t3_state:
+        # Some checkpoints wrap the state dict, which ChatterboxTTS.from_local unwraps the same way
+        t3_state = t3_state['model'][0]
+    t3.load_state_dict(t3_state, assign=True)
+    t3.to(device).eval()
+
+    s3gen = S3Gen()
+    s3gen.load_state_dict(mmap_safetensors(store_dir / 's3gen.safetensors')[0], strict=False, assign=True)
+    s3gen.to(device).eval()
+
+    tokenizer = EnTokenizer(str(store_dir / 'tokenizer.json'))
+    conds = load_conds(store_dir / 'conds.safetensors', device)
+    return ChatterboxTTS(t3, s3gen, ve, tokenizer, device, conds=conds)
+
+
+def store_main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='cli.py model-store',
+                                     description="Pin the Chatterbox weights locally for offline, memory-mapped loading")
+    sub = parser.add_subparsers(dest='command', required=True)
+    pin = sub.add_parser('pin', help='Download (or copy) and verify the weights into the store')
+    pin.add_argument('folder', nargs='?', default=str(MODEL_STORE_DIR), help=f'Store folder (default: {MODEL_STORE_DIR})')
+    pin.add_argument('--from', dest='checkpoint_dir', metavar='DIR',
+                     help='Copy from a local checkpoint folder instead of the Hugging Face hub')
+    verify = sub.add_parser('verify', help='Re-hash the pinned files against the manifest')
+    verify.add_argument('folder', nargs='?', default=str(MODEL_STORE_DIR), help=f'Store folder (default: {MODEL_STORE_DIR})')
+    args = parser.parse_args(argv)
+
+    if args.command == 'pin':
+        pin_model(args.folder, args.checkpoint_dir)
+    problems = verify_store(args.folder)
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    if problems:
+        sys.exit(1)
+    print(f"Model store {args.folder} verified")
+
+
+if __name__ == '__main__':
+    configure_logging()
+    store_main()
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# chatterblez - ONNX Runtime synthesis backend
+#
+#   python cli.py export-onnx [FOLDER] [--cuda] [--opset 17]
+#   python cli.py --file book.epub --backend onnx [--onnx-dir FOLDER]
+#
+# The two Chatterbox stages that take most of the synthesis time are exported:
+#   t3_transformer.onnx  the Llama transformer of T3 (text to speech tokens), one decoding step with the KV cache
+#                        passed in and out as plain tensors
+#   hift_vocoder.onnx    the HiFT vocoder filter network (mel + excitation to waveform), with its STFT and
+#                        inverse STFT written as convolutions because ONNX has no inverse STFT operator
+# Tokenization, conditioning, token sampling, S3Gen flow matching and the noise-driven excitation source stay
+# in PyTorch, so sampling behaves exactly as with the PyTorch backend.
+import json
+import math
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from logs import configure_logging, get_logger
+
+log = get_logger('onnx')
+
+ONNX_MODEL_DIR = Path.home() / '.cache' / 'chatterblez' / 'onnx'
+ONNX_OPSET = 17
+T3_ONNX = 't3_transformer.onnx'
+VOCODER_ONNX = 'hift_vocoder.onnx'
+ONNX_MANIFEST = 'manifest.json'
+ONNX_MAX_ABS_ERROR = 1e-3  # parity limit for either stage against PyTorch on the same inputs
+
+
+def _require_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise RuntimeError("The ONNX backend needs ONNX Runtime: pip install onnxruntime "
+                           "(or onnxruntime-gpu for CUDA)") from None
+    return onnxruntime
+
+
+def _past_names(prefix, n_layers):
+    return [f'{prefix}.{i}.{kind}' for i in range(n_layers) for kind in ('key', 'value')]
+
+
+# ---------------------------------------------------------------------------
+# Export wrappers
+# ---------------------------------------------------------------------------
+class T3Step(torch.nn.Module):
+    """
+    The T3 Llama transformer with its KV cache as a flat list of tensors:
+    (inputs_embeds, past.0.key, past.0.value, ...) -> (hidden_states,
+    present.0.key, present.0.value, ...). The first step passes a past of
+    length 0.
+    """
+
+    def __init__(self, tfmr):
+        super().__init__()
+        self.tfmr = tfmr
+
+    def forward(self, inputs_embeds, *past):
+        from transformers import DynamicCache
+        cache = DynamicCache.from_legacy_cache(tuple(zip(past[0::2], past[1::2])))
+        out = self.tfmr(inputs_embeds=inputs_embeds, past_key_values=cache, use_cache=True, return_dict=True)
+        present = out.past_key_values.to_legacy_cache()
+        return (out.last_hidden_state, *[tensor for layer in present for tensor in layer])
+
+
+def _dft_basis(n_fft, window):
+    """Windowed cosine and sine rows of the one-sided DFT, shape (n_fft // 2 + 1, n_fft) each."""
+    k = torch.arange(n_fft // 2 + 1, dtype=torch.float64)[:, None]
+    n = torch.arange(n_fft, dtype=torch.float64)[None, :]
+    angle = 2 * math.pi * k * n / n_fft
+    return torch.cos(angle).float() * window, torch.sin(angle).float() * window
+
+
+def conv_stft(x, n_fft, hop, window):
+    """torch.stft(x, n_fft, hop, window=window, center=True) as (real, imag), computed with a strided conv1d."""
+    cos, sin = _dft_basis(n_fft, window)
+    x = F.pad(x[:, None], (n_fft // 2, n_fft // 2), mode='reflect')
+    spec = F.conv1d(x, torch.cat([cos, -sin])[:, None], stride=hop)
+    return spec[:, :n_fft // 2 + 1], spec[:, n_fft // 2 + 1:]
+
+
+def conv_istft(real, imag, n_fft, hop, window):
+    """torch.istft of a one-sided, center=True spectrogram, computed with matmuls and a transposed conv1d."""
+    bins = n_fft // 2 + 1
+    scale = torch.full((bins, 1), 2.0)
+    scale[0] = scale[-1] = 1.0  # DC and Nyquist appear once in the full spectrum
+    cos, sin = _dft_basis(n_fft, window)
+    frames = (real.transpose(1, 2) @ (scale * cos) - imag.transpose(1, 2) @ (scale * sin)) / n_fft
+    overlap = torch.eye(n_fft)[:, None]
+    wav = F.conv_transpose1d(frames.transpose(1, 2), overlap, stride=hop)
+    envelope = F.conv_transpose1d((window ** 2)[None, :, None].expand(1, n_fft, real.shape[-1]), overlap, stride=hop)
+    wav = wav / torch.clamp(envelope, min=1e-11)
+    return wav[:, 0, n_fft // 2:wav.shape[-1] - n_fft // 2]
+
+
+class HiftDecode(torch.nn.Module):
+    """HiFTGenerator.decode: (speech_feat, source) -> waveform, with ONNX-exportable STFT and inverse STFT."""
+
+    def __init__(self, hift):
+        super().__init__()
+        self.hift = hift
+
+    def forward(self, speech_feat, source):
+        hift = self.hift
+        n_fft, hop = hift.istft_params['n_fft'], hift.istft_params['hop_len']
+        window = hift.stft_window.to(speech_feat.device)
+        hift._stft = lambda x: conv_stft(x, n_fft, hop, window)
+        hift._istft = lambda magnitude, phase: conv_istft(
+            torch.clip(magnitude, max=1e2) * torch.cos(phase), torch.clip(magnitude, max=1e2) * torch.sin(phase),
+            n_fft, hop, window)
+        try:
+            return hift.decode(x=speech_feat, s=source)
+        finally:
+            del hift._stft, hift._istft
+
+
+def hift_source(hift, speech_feat, cache_source=None):
+    """The excitation HiFTGenerator.inference feeds to decode(): predicted f0 turned into sine waves and noise."""
+    f0 = hift.f0_predictor(speech_feat)
+    s = hift.f0_upsamp(f0[:, None]).transpose(1, 2)
+    s, _, _ = hift.m_source(s)
+    s = s.transpose(1, 2)
+    if cache_source is not None and cache_source.shape[2] != 0:
+        s[:, :, :cache_source.shape[2]] = cache_source
+    return s
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+def export_onnx(output_dir=ONNX_MODEL_DIR, device='cpu', opset=ONNX_OPSET, cb_model=None):
+    """
+    Export the T3 transformer and the HiFT vocoder of a loaded (default: a
+    freshly loaded) Chatterbox model to output_dir, then check both graphs
+    against PyTorch with check_parity(). Returns the parity result.
+    """
+    import core
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cb_model = cb_model or core.load_tts_model(device)
+    cfg = cb_model.t3.cfg
+    manifest = {
+        'opset': opset,
+        'torch': torch.__version__,
+        'n_layers': cfg.num_hidden_layers,
+        'n_kv_heads': cfg.num_key_value_heads,
+        'head_dim': cfg.hidden_size // cfg.num_attention_heads,
+        'hidden_size': cfg.hidden_size,
+    }
+
+    log.info('Exporting the T3 transformer (%d layers) to %s...', manifest['n_layers'], output_dir / T3_ONNX)
+    start = time.perf_counter()
+    export_transformer(cb_model.t3.tfmr, output_dir / T3_ONNX, manifest, device)
+    log.info('Exporting the HiFT vocoder to %s...', output_dir / VOCODER_ONNX)
+    hift = cb_model.s3gen.mel2wav
+    mel = torch.randn(1, 80, 50, device=device)
+    with torch.no_grad():
+        source = hift_source(hift, mel)
+    export_vocoder(hift, output_dir / VOCODER_ONNX, mel, source, opset)
+    log.info('Exported in %.1f seconds', time.perf_counter() - start)
+
+    with open(output_dir / ONNX_MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return check_parity(cb_model, output_dir)
+
+
+def export_transformer(tfmr, path, manifest, device='cpu'):
+    """Export T3Step(tfmr) to path, shaped by manifest (n_layers, n_kv_heads, head_dim, hidden_size, opset)."""
+    past_names = _past_names('past', manifest['n_layers'])
+    present_names = _past_names('present', manifest['n_layers'])
+    embeds = torch.randn(2, 3, manifest['hidden_size'], device=device)  # batch of 2 for classifier-free guidance
+    past = [torch.randn(2, manifest['n_kv_heads'], 5, manifest['head_dim'], device=device) for _ in past_names]
+    torch.onnx.export(
+        T3Step(tfmr).eval(), (embeds, *past), str(path),
+        input_names=['inputs_embeds', *past_names], output_names=['hidden_states', *present_names],
+        dynamic_axes={
+            'inputs_embeds': {0: 'batch', 1: 'sequence'},
+            'hidden_states': {0: 'batch', 1: 'sequence'},
+            **{name: {0: 'batch', 2: 'past_sequence'} for name in past_names},
+            **{name: {0: 'batch', 2: 'total_sequence'} for name in present_names},
+        },
+        opset_version=manifest['opset'], dynamo=False,
+    )
+
+
+def export_vocoder(hift, path, mel, source, opset=ONNX_OPSET):
+    """Export HiftDecode(hift) to path, traced with an example mel and its excitation source."""
+    torch.onnx.export(
+        HiftDecode(hift).eval(), (mel, source), str(path),
+        input_names=['speech_feat', 'source'], output_names=['wav'],
+        dynamic_axes={'speech_feat': {2: 'frames'}, 'source': {2: 'samples'}, 'wav': {1: 'samples'}},
+        opset_version=opset, dynamo=False,
+    )
+
+
+def check_parity(cb_model, onnx_dir=ONNX_MODEL_DIR, seed=0):
+    """
+    Run both exported graphs and the PyTorch stages of cb_model on the same
+    random inputs and report the largest absolute difference of each: the
+    transformer on a prefill and a cached step, the vocoder on a mel and
+    excitation. Returns SimpleNamespace(transformer, vocoder, ok).
+    """
+    ort = _require_onnxruntime()
+    onnx_dir = Path(onnx_dir)
+    manifest = read_manifest(onnx_dir)
+    device = cb_model.t3.device
+    generator = torch.Generator().manual_seed(seed)
+
+    t3_session = ort.InferenceSession(str(onnx_dir / T3_ONNX), providers=['CPUExecutionProvider'])
+    transformer_error = transformer_parity(cb_model.t3.tfmr, t3_session, manifest, device, generator)
+
+    vocoder_session = ort.InferenceSession(str(onnx_dir / VOCODER_ONNX), providers=['CPUExecutionProvider'])
+    hift = cb_model.s3gen.mel2wav
+    mel = torch.randn(1, 80, 120, generator=generator).to(device)
+    with torch.inference_mode():
+        source = hift_source(hift, mel)
+    vocoder_error = vocoder_parity(hift, vocoder_session, mel, source)
+
+    ok = transformer_error <= ONNX_MAX_ABS_ERROR and vocoder_error <= ONNX_MAX_ABS_ERROR
+    log.info('ONNX parity: transformer max abs error %.2e, vocoder max abs error %.2e (%s)',
+             transformer_error, vocoder_error, 'ok' if ok else 'FAILED')
+    return SimpleNamespace(transformer=transformer_error, vocoder=vocoder_error, ok=ok)
+
+
+def transformer_parity(tfmr, session, manifest, device='cpu', generator=None):
+    """Largest absolute difference between tfmr and its exported session on a prefill and one cached step."""
+    step = OnnxTransformer(session, manifest, device)
+    torch_step = T3Step(tfmr).eval()
+    empty = [torch.zeros(2, manifest['n_kv_heads'], 0, manifest['head_dim'], device=device)
+             for _ in range(2 * manifest['n_layers'])]
+    prefill = torch.randn(2, 7, manifest['hidden_size'], generator=generator).to(device)
+    next_embed = torch.randn(2, 1, manifest['hidden_size'], generator=generator).to(device)
+    with torch.inference_mode():
+        reference, *reference_past = torch_step(prefill, *empty)
+        reference_next, *_ = torch_step(next_embed, *reference_past)
+        out = step(inputs_embeds=prefill)
+        out_next = step(inputs_embeds=next_embed, past_key_values=out.past_key_values)
+    return max(float((reference - out.last_hidden_state).abs().max()),
+               float((reference_next - out_next.last_hidden_state).abs().max()))
+
+
+def vocoder_parity(hift, session, mel, source):
+    """Largest absolute difference between hift.decode and its exported session on one mel and excitation."""
+    with torch.inference_mode():
+        reference_wav = hift.decode(x=mel, s=source)
+    (wav,) = session.run(None, {'speech_feat': mel.cpu().numpy(), 'source': source.cpu().numpy()})
+    return float(np.abs(reference_wav.cpu().numpy() - wav).max())
+
+
+# ---------------------------------------------------------------------------
+# Runtime
+# ---------------------------------------------------------------------------
+def read_manifest(onnx_dir):
+    manifest_path = Path(onnx_dir) / ONNX_MANIFEST
+    if not manifest_path.is_file():
+        raise RuntimeError(f"No ONNX export in {onnx_dir}, run 'cli.py export-onnx {onnx_dir}' first")
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+class OnnxTransformer(torch.nn.Module):
+    """
+    Stands in for the T3 LlamaModel inside chatterbox's sampling loop. The KV
+    cache is kept as the numpy arrays ONNX Runtime returns and handed back
+    unchanged on the next step.
+    """
+
+    def __init__(self, session, manifest, device):
+        super().__init__()
+        self.session = session
+        self.manifest = manifest
+        self.device = device
+        self.past_names = _past_names('past', manifest['n_layers'])
+
+    def forward(self, inputs_embeds, past_key_values=None, **kwargs):
+        feeds = {'inputs_embeds': inputs_embeds.detach().float().cpu().numpy()}
+        if not past_key_values:
+            empty = np.zeros((inputs_embeds.shape[0], self.manifest['n_kv_heads'], 0, self.manifest['head_dim']),
+                             dtype=np.float32)
+            past_key_values = [empty] * len(self.past_names)
+        feeds.update(zip(self.past_names, past_key_values))
+        hidden, *present = self.session.run(None, feeds)
+        hidden = torch.from_numpy(hidden).to(self.device)
+        return SimpleNamespace(last_hidden_state=hidden, hidden_states=(hidden,), past_key_values=present,
+                               attentions=None)
+
+
+class OnnxVocoder(torch.nn.Module):
+    """Stands in for HiFTGenerator: the excitation is generated by the PyTorch modules, decode() runs in ONNX Runtime."""
+
+    def __init__(self, session, hift):
+        super().__init__()
+        self.session = session
+        self.f0_predictor = hift.f0_predictor
+        self.f0_upsamp = hift.f0_upsamp
+        self.m_source = hift.m_source
+
+    def inference(self, speech_feat, cache_source=None):
+        with torch.inference_mode():
+            source = hift_source(self, speech_feat, cache_source)
+        (wav,) = self.session.run(None, {'speech_feat': speech_feat.detach().float().cpu().numpy(),
+                                         'source': source.float().cpu().numpy()})
+        return torch.from_numpy(wav).to(speech_feat.device), source
+
+
+def session_providers(device):
+    return ['CUDAExecutionProvider', 'CPUExecutionProvider'] if str(device).startswith('cuda') else [
+        'CPUExecutionProvider']
+
+
+def use_onnx_runtime(cb_model, onnx_dir=None, device='cpu'):
+    """
+    Replace the T3 transformer and the HiFT vocoder of a loaded Chatterbox
+    model with ONNX Runtime sessions over the graphs in onnx_dir (default
+    ONNX_MODEL_DIR). The PyTorch weights of both stages are released.
+    """
+    ort = _require_onnxruntime()
+    onnx_dir = Path(onnx_dir or ONNX_MODEL_DIR)
+    manifest = read_manifest(onnx_dir)
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    providers = session_providers(device)
+    cb_model.t3.tfmr = OnnxTransformer(
+        ort.InferenceSession(str(onnx_dir / T3_ONNX), options, providers=providers), manifest, device)
+    cb_model.s3gen.mel2wav = OnnxVocoder(
+        ort.InferenceSession(str(onnx_dir / VOCODER_ONNX), options, providers=providers), cb_model.s3gen.mel2wav)
+    cb_model.backend = 'onnx'
+    log.info('ONNX Runtime backend: %s (%s)', onnx_dir, ', '.join(providers))
+    return cb_model
+
+
+def export_main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='cli.py export-onnx',
+        description="Export the Chatterbox transformer and vocoder to ONNX for the --backend onnx synthesis backend"
+    )
+    parser.add_argument('folder', nargs='?', default=str(ONNX_MODEL_DIR), help=f'Output folder (default: {ONNX_MODEL_DIR})')
+    parser.add_argument('--cuda', default=False, help='Load the model on the GPU for the export', action='store_true')
+    parser.add_argument('--opset', type=int, default=ONNX_OPSET, help=f'ONNX opset version (default: {ONNX_OPSET})')
+    args = parser.parse_args(argv)
+
+    parity = export_onnx(args.folder, 'cuda' if args.cuda else 'cpu', args.opset)
+    if not parity.ok:
+        print(f"The exported graphs differ from PyTorch by more than {ONNX_MAX_ABS_ERROR}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    configure_logging()
+    export_main()
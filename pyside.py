@@ -41,6 +41,10 @@ from PySide6.QtWidgets import (
 )
 
 import core
+from engine import BATCH, INTERACTIVE, Engine
+from logs import configure_logging, get_logger
+
+log = get_logger('gui')
 
 class CoreThread(QThread):
     core_started = Signal()
@@ -74,13 +78,36 @@ class CoreThread(QThread):
 
     def run(self):
         try:
-            print("CoreThread started with params:", self.params)
+            log.debug("CoreThread started with params: %s", self.params)
             core.main(**self.params, post_event=self.post_event, should_stop=lambda: self._should_stop)
         except Exception as exc:
-            print("CoreThread exception:", exc)
+            log.exception("CoreThread exception: %s", exc)
             self.error.emit(str(exc))
 
 
+class DocumentLoader(QThread):
+    """Parses an e-book off the UI thread, reporting chapters as they are extracted."""
+    chapter_loaded = Signal(object)  # chapter, in document order
+    load_progress = Signal(int, int)  # done, total
+    loaded = Signal(object)  # core.Document
+    failed = Signal(str)
+
+    def __init__(self, file_path, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+
+    def on_chapter(self, chapter, done, total):
+        self.chapter_loaded.emit(chapter)
+        self.load_progress.emit(done, total)
+
+    def run(self):
+        try:
+            self.loaded.emit(core.load_document(self.file_path, progress=self.on_chapter))
+        except Exception as exc:
+            log.exception("DocumentLoader exception: %s", exc)
+            self.failed.emit(str(exc))
+
+
 
 # Move open_file_dialog back to MainWindow
     # ----------------- Menu slots -----------------
@@ -91,10 +118,18 @@ class MainWindow(QMainWindow):
         self.resize(1200, 800)
 
         self.settings = QSettings("Chatterblez", "chatterblez-pyside")
+        self.document = None  # core.Document of the open e-book
+        self.document_loader: DocumentLoader | None = None
+        self.load_ignore_list: list = []
         self.document_chapters: list = []
+        # Rows of document_chapters ticked for synthesis; the chapters themselves are shared with
+        # core.load_document's cache and stay unmodified
+        self.selected_chapter_indexes: set = set()
         self.selected_file_path: str | None = None
         self.selected_wav_path: str | None = None
         self.core_thread: CoreThread | None = None
+        # One model for synthesis and previews; a preview pauses synthesis between sentences
+        self.engine = Engine()
 
         self._build_ui()
         self.synth_running = False
@@ -253,63 +288,88 @@ class MainWindow(QMainWindow):
         if hasattr(self, "restore_original_panels"):
             self.restore_original_panels()
         self.selected_file_path = str(file_path)
+        self.document = None
+        self.document_loader = None
         ext = file_path.suffix.lower()
-        self.document_chapters.clear()
+        self.document_chapters = []
+        self.selected_chapter_indexes = set()
         self.chapter_list.clear()
         
         # Reset elapsed time when loading a new file
         self.time_label.setText("Elapsed: 00:00 | ETA: --:--")
 
+        if ext not in (".epub", ".pdf"):
+            QMessageBox.warning(self, "Unsupported", "File type not supported")
+            return
+
         # Get ignore list from settings
         ignore_csv = self.settings.value("batch_ignore_chapter_names", "", type=str)
-        ignore_list = [name.strip().lower() for name in ignore_csv.split(",") if name.strip()]
+        self.load_ignore_list = [name.strip().lower() for name in ignore_csv.split(",") if name.strip()]
 
-        if ext == ".epub":
-            from ebooklib import epub
-            book = epub.read_epub(str(file_path))
-            self.document_chapters = core.find_document_chapters_and_extract_texts(book)
+        # Parse in the background; chapters appear in the list as they are extracted
+        self.progress_bar.setValue(0)
+        self.set_task_label(f"Loading {file_path.name}")
+        loader = DocumentLoader(file_path, parent=self)
+        loader.chapter_loaded.connect(self.on_chapter_loaded)
+        loader.load_progress.connect(self.on_load_progress)
+        loader.loaded.connect(self.on_document_loaded)
+        loader.failed.connect(self.on_document_failed)
+        loader.finished.connect(loader.deleteLater)
+        self.document_loader = loader
+        loader.start()
+
+    def is_chapter_preselected(self, chap):
+        if self.selected_file_path.lower().endswith(".pdf"):
+            return True
+        chap_name_lower = chap.get_name().lower()
+        is_ignored = any(ignore_name in chap_name_lower for ignore_name in self.load_ignore_list)
+        return core.is_chapter(chap) and not is_ignored
+
+    def on_chapter_loaded(self, chap):
+        if self.sender() is not self.document_loader:
+            return  # a previously opened file is still loading
+        is_selected = self.is_chapter_preselected(chap)
+        if is_selected:
+            self.selected_chapter_indexes.add(len(self.document_chapters))
+        self.document_chapters.append(chap)
+        item = QListWidgetItem(chap.get_name())
+        item.setCheckState(Qt.CheckState.Checked if is_selected else Qt.CheckState.Unchecked)
+        self.chapter_list.addItem(item)
+        if self.chapter_list.count() == 1:
+            self.chapter_list.setCurrentRow(0)
+
+    def on_load_progress(self, done: int, total: int):
+        if self.sender() is self.document_loader and total:
+            self.progress_bar.setValue(int(done * 100 / total))
+
+    def on_document_loaded(self, document):
+        if self.sender() is not self.document_loader:
+            return
+        self.document = document
+        self.document_loader = None
+        self.progress_bar.setValue(100)
+        self.set_task_label("")
+        if not self.selected_file_path.lower().endswith(".pdf") and not any(
+                core.is_chapter(c) for c in self.document_chapters):
+            # No chapter looked like one: fall back to find_good_chapters' choice
             good_chapters = core.find_good_chapters(self.document_chapters)
-            for chap in self.document_chapters:
+            self.selected_chapter_indexes = set()
+            for i, chap in enumerate(self.document_chapters):
                 chap_name_lower = chap.get_name().lower()
-                is_ignored = any(ignore_name in chap_name_lower for ignore_name in ignore_list)
-                chap.is_selected = chap in good_chapters and not is_ignored
-                item = QListWidgetItem(chap.get_name())
-                item.setCheckState(Qt.CheckState.Checked if chap.is_selected else Qt.CheckState.Unchecked)
-                self.chapter_list.addItem(item)
-        elif ext == ".pdf":
-            self.load_pdf(file_path)
-        else:
-            QMessageBox.warning(self, "Unsupported", "File type not supported")
+                is_ignored = any(ignore_name in chap_name_lower for ignore_name in self.load_ignore_list)
+                is_selected = chap in good_chapters and not is_ignored
+                if is_selected:
+                    self.selected_chapter_indexes.add(i)
+                self.chapter_list.item(i).setCheckState(
+                    Qt.CheckState.Checked if is_selected else Qt.CheckState.Unchecked)
+
+    def on_document_failed(self, message: str):
+        if self.sender() is not self.document_loader:
             return
-
-        if self.document_chapters:
-            self.chapter_list.setCurrentRow(0)
-
-    def load_pdf(self, file_path: Path):
-        import PyPDF2
-        pdf_reader = PyPDF2.PdfReader(str(file_path))
-        chapters = []
-        class PDFChapter:
-            def __init__(self, name, text, idx):
-                self._name = name
-                self.extracted_text = text
-                self.chapter_index = idx
-                self.is_selected = True
-            def get_name(self):
-                return self._name
-        buffer = ""
-        idx = 0
-        for i, page in enumerate(pdf_reader.pages):
-            buffer += (page.extract_text() or "") + "\n"
-            if len(buffer) >= 5000 or i == len(pdf_reader.pages) - 1:
-                chapters.append(PDFChapter(f"Pages {idx + 1}-{i + 1}", buffer.strip(), idx))
-                buffer = ""
-                idx += 1
-        self.document_chapters = chapters
-        for chap in chapters:
-            item = QListWidgetItem(chap.get_name())
-            item.setCheckState(Qt.CheckState.Checked)
-            self.chapter_list.addItem(item)
+        self.document_loader = None
+        self.progress_bar.setValue(0)
+        self.set_task_label("")
+        QMessageBox.critical(self, "Error", f"Could not open {Path(self.selected_file_path).name}: {message}")
 
     # ----------------- Batch Mode -----------------
     def open_batch_mode(self):
@@ -391,15 +451,13 @@ class MainWindow(QMainWindow):
         for i in range(self.chapter_list.count()):
             item = self.chapter_list.item(i)
             item.setCheckState(Qt.CheckState.Checked)
-            if 0 <= i < len(self.document_chapters):
-                self.document_chapters[i].is_selected = True
+        self.selected_chapter_indexes = set(range(len(self.document_chapters)))
 
     def unselect_all_chapters(self):
         for i in range(self.chapter_list.count()):
             item = self.chapter_list.item(i)
             item.setCheckState(Qt.CheckState.Unchecked)
-            if 0 <= i < len(self.document_chapters):
-                self.document_chapters[i].is_selected = False
+        self.selected_chapter_indexes = set()
 
     def on_chapter_selected(self):
         row = self.chapter_list.currentRow()
@@ -422,12 +480,10 @@ class MainWindow(QMainWindow):
         try:
             from tempfile import NamedTemporaryFile
             import torch
-            from chatterbox.tts import ChatterboxTTS
             import core
 
             row = self.chapter_list.currentRow()
             if not (0 <= row < len(self.document_chapters)):
-                print("Preview Unavailable: No chapter selected.")
                 QMessageBox.information(self, "Preview Unavailable", "No chapter selected.")
                 self.preview_btn.setText("Preview")
                 return
@@ -441,39 +497,40 @@ class MainWindow(QMainWindow):
                     cleaned_lines.append(cleaned_line)
             text = "\n".join(cleaned_lines)
             if not text.strip():
-                print("Preview Unavailable: No text to preview.")
                 QMessageBox.information(self, "Preview Unavailable", "No text to preview.")
                 self.preview_btn.setText("Preview")
                 return
 
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            cb_model = ChatterboxTTS.from_pretrained(device=device)
-            if self.selected_wav_path:
-                cb_model.prepare_conditionals(wav_fpath=self.selected_wav_path)
+            preview_model = self.engine.client(INTERACTIVE)
+            core.set_voice(preview_model, self.selected_wav_path)
             torch.manual_seed(12345)
             sentences = re.split(r'(?<=[.!?])\s+', text)
             chunks = [sent.strip() for sent in sentences if sent.strip()]
             if not chunks:
                 chunks = [text[i:i+50] for i in range(0, len(text), 50)]
-            for chunk in chunks:
-                if self.preview_stop_flag.is_set():
-                    break
-                wav = cb_model.generate(chunk)
-                with NamedTemporaryFile(suffix=".wav", delete=False) as tmpf:
-                    import torchaudio as ta
-                    ta.save(tmpf.name, wav, cb_model.sr)
-                    tmpf.flush()
-                    # Play using OS default player
+            # Synthesis running in the background pauses at its next sentence until the preview is done
+            with self.engine.session(INTERACTIVE), core.cancellable(self.preview_stop_flag.is_set):
+                for chunk in chunks:
                     if self.preview_stop_flag.is_set():
                         break
-                    if platform.system() == "Windows":
-                        os.startfile(tmpf.name)
-                    elif platform.system() == "Darwin":
-                        subprocess.Popen(["afplay", tmpf.name])
-                    else:
-                        subprocess.Popen(["aplay", tmpf.name])
+                    wav = preview_model.generate(chunk)
+                    with NamedTemporaryFile(suffix=".wav", delete=False) as tmpf:
+                        import torchaudio as ta
+                        ta.save(tmpf.name, wav, preview_model.sr)
+                        tmpf.flush()
+                        # Play using OS default player
+                        if self.preview_stop_flag.is_set():
+                            break
+                        if platform.system() == "Windows":
+                            os.startfile(tmpf.name)
+                        elif platform.system() == "Darwin":
+                            subprocess.Popen(["afplay", tmpf.name])
+                        else:
+                            subprocess.Popen(["aplay", tmpf.name])
+        except core.SynthesisCancelled:
+            log.info("Preview stopped")
         except Exception as e:
-            print(f"Preview Error: {e}")
+            log.exception("Preview failed: %s", e)
             QMessageBox.critical(self, "Preview Error", f"Preview failed: {e}")
         finally:
             self.preview_btn.setText("Preview")
@@ -499,18 +556,19 @@ class MainWindow(QMainWindow):
     def handle_start_stop_synthesis(self):
         if not self.synth_running:
             # Start synthesis
-            print("Start synthesis clicked")
+            log.debug("Start synthesis clicked")
             if not self.selected_file_path and not (hasattr(self, "batch_files") and self.batch_files):
-                print("No file selected")
                 QMessageBox.warning(self, "No file", "Please open an e-book first")
                 return
+            if self.document_loader is not None and not (hasattr(self, "batch_files") and self.batch_files):
+                QMessageBox.information(self, "Loading", "The e-book is still loading, please wait")
+                return
 
             # update chapter selection flags
-            for i, chap in enumerate(self.document_chapters):
-                item = self.chapter_list.item(i)
-                chap.is_selected = item.checkState() == Qt.CheckState.Checked
+            self.selected_chapter_indexes = {i for i in range(len(self.document_chapters))
+                                             if self.chapter_list.item(i).checkState() == Qt.CheckState.Checked}
 
-            selected_chapters = [c for c in self.document_chapters if c.is_selected]
+            selected_chapters = [c for i, c in enumerate(self.document_chapters) if i in self.selected_chapter_indexes]
 
             if hasattr(self, "batch_files") and self.batch_files:
                 selected_files = [f["path"] for f in self.batch_files if f["selected"]]
@@ -544,7 +602,8 @@ class MainWindow(QMainWindow):
                     selected_files=selected_files,
                     output_dir=self.output_dir_edit.text(),
                     ignore_list=ignore_list,
-                    wav_path=self.selected_wav_path
+                    wav_path=self.selected_wav_path,
+                    cb_model=self.engine.client(BATCH)
                 )
                 self.batch_worker.progress_update.connect(self.on_batch_progress_update)
                 self.batch_worker.chapter_progress.connect(self.on_core_progress)
@@ -555,11 +614,9 @@ class MainWindow(QMainWindow):
                 return
             else:
                 if not selected_chapters:
-                    print("No chapters selected after build. Aborting synthesis.")
                     QMessageBox.warning(self, "No chapters", "No chapters selected")
                     return
             if not selected_chapters:
-                print("No chapters selected")
                 QMessageBox.warning(self, "No chapters", "No chapters selected")
                 return
 
@@ -573,7 +630,6 @@ class MainWindow(QMainWindow):
                 is_batch=False
             )
 
-            print("About to create CoreThread with params:")
             params = dict(
                 file_path=self.selected_file_path,
                 pick_manually=False,
@@ -581,8 +637,10 @@ class MainWindow(QMainWindow):
                 output_folder=self.output_dir_edit.text(),
                 selected_chapters=selected_chapters,
                 audio_prompt_wav=self.selected_wav_path,
+                document=self.document,
+                keep_intermediates=False,
+                cb_model=self.engine.client(BATCH),
             )
-            print(params)
             try:
                 self.core_thread = CoreThread(**params)
                 self.core_thread.core_started.connect(self.on_core_started)
@@ -595,15 +653,15 @@ class MainWindow(QMainWindow):
                 self.synth_running = True
                 self.start_btn.setText("Stop Synthesizing")
             except Exception as e:
-                print(f"Exception during CoreThread creation/start: {e}")
+                log.exception("Exception during CoreThread creation/start: %s", e)
         else:
             # Stop synthesis
-            print("Stop synthesis clicked")
+            log.debug("Stop synthesis clicked")
             if self.core_thread is not None:
                 self.core_thread.stop()
             # Stop batch worker if in batch mode
             if hasattr(self, "batch_worker") and self.batch_worker is not None:
-                print("[DEBUG] MainWindow: calling batch_worker.stop()")
+                log.debug("MainWindow: calling batch_worker.stop()")
                 self.batch_worker.stop()
             self.synth_running = False
             self.start_btn.setText("Start Synthesis")
@@ -653,25 +711,8 @@ class MainWindow(QMainWindow):
         self.start_btn.setText("Start Synthesis")
         self.set_task_label("")
         # To set "Transcoding" or "Multiplexing", call  or self.set_task_label("Multiplexing") at the appropriate place in your workflow.
-        # Delete all .wav files in the output folder with extra debug output
-        import glob
+        # Intermediate chapter audio is removed by core once each audiobook is created (keep_intermediates=False)
         out_dir = os.path.abspath(self.output_dir_edit.text())
-        print(f"[DEBUG] Output directory: {out_dir}")
-        if not os.path.isdir(out_dir):
-            print(f"[DEBUG] Output directory does not exist: {out_dir}")
-        else:
-            all_files = os.listdir(out_dir)
-            print(f"[DEBUG] Files in output directory before deletion: {all_files}")
-            wav_files = [os.path.join(out_dir, f) for f in all_files if f.lower().endswith('.wav')]
-            print(f"[DEBUG] .wav files to delete: {wav_files}")
-            for wav_file in wav_files:
-                try:
-                    os.remove(wav_file)
-                    print(f"[DEBUG] Deleted: {wav_file}")
-                except Exception as e:
-                    print(f"[DEBUG] Failed to delete {wav_file}: {e}")
-            all_files_after = os.listdir(out_dir)
-            print(f"[DEBUG] Files in output directory after deletion: {all_files_after}")
         self.time_label.setText("Elapsed: 00:00 | ETA: --:--")
         # open output folder
         if os.path.isdir(out_dir):
@@ -687,7 +728,7 @@ class MainWindow(QMainWindow):
     def on_core_error(self, message: str):
         self.synth_running = False
         self.start_btn.setText("Start Synthesis")
-        print(f"Error: {message}")
+        log.error("%s", message)
         QMessageBox.critical(self, "Error", message)
 
     def set_task_label(self, task: str):
@@ -718,12 +759,12 @@ class MainWindow(QMainWindow):
         if speed and speed != 1.0:
             cmd += ["--speed", str(speed)]
         cli_command = " ".join(cmd)
-        print(f"cli_command: {cli_command}")
+        log.debug("cli_command: %s", cli_command)
         try:
             with open("last_cli_command.txt", "w", encoding="utf-8") as f:
                 f.write(cli_command + "\n")
         except Exception as e:
-            print(f"Failed to write CLI command: {e}")
+            log.warning("Failed to write CLI command: %s", e)
         return cli_command
 
 from PySide6.QtCore import Signal
@@ -733,16 +774,17 @@ class BatchWorker(QThread):
     chapter_progress = Signal(object)  # stats object from core
     finished = Signal()
 
-    def __init__(self, selected_files, output_dir, ignore_list, wav_path):
+    def __init__(self, selected_files, output_dir, ignore_list, wav_path, cb_model=None):
         super().__init__()
         self.selected_files = selected_files
         self.output_dir = output_dir
         self.ignore_list = ignore_list
         self.wav_path = wav_path
+        self.cb_model = cb_model
         self._should_stop = False
 
     def stop(self):
-        print("[DEBUG] BatchWorker.stop() called")
+        log.debug("BatchWorker.stop() called")
         self._should_stop = True
 
     def run(self):
@@ -752,56 +794,8 @@ class BatchWorker(QThread):
         total = len(self.selected_files)
         batch_start_time = time.time()
 
-        def post_event(evt_name, **kwargs):
-            if evt_name == "CORE_PROGRESS":
-                stats = kwargs.get("stats")
-                self.chapter_progress.emit(stats)
-
-        for file_path in self.selected_files:
-            if self._should_stop:
-                print("[DEBUG] BatchWorker.run() detected stop, breaking batch loop")
-                break
-            ext = os.path.splitext(file_path)[1].lower()
-            chapters = []
-            if ext == ".epub":
-                from ebooklib import epub
-                book = epub.read_epub(file_path)
-                chapters = core.find_document_chapters_and_extract_texts(book)
-            elif ext == ".pdf":
-                import PyPDF2
-                pdf_reader = PyPDF2.PdfReader(file_path)
-                class PDFChapter:
-                    def __init__(self, name, text, idx):
-                        self._name = name
-                        self.extracted_text = text
-                        self.chapter_index = idx
-                        self.is_selected = True
-                    def get_name(self):
-                        return self._name
-                buffer = ""
-                idx = 0
-                for i, page in enumerate(pdf_reader.pages):
-                    buffer += (page.extract_text() or "") + "\n"
-                    if len(buffer) >= 5000 or i == len(pdf_reader.pages) - 1:
-                        chapters.append(PDFChapter(f"Pages {idx + 1}-{i + 1}", buffer.strip(), idx))
-                        buffer = ""
-                        idx += 1
-            # Filter chapters
-            filtered_chapters = [
-                c for c in chapters
-                if not any(ignore.lower() in c.get_name().lower() for ignore in self.ignore_list)
-            ]
-            # Run core.main for this file
-            core.main(
-                file_path=file_path,
-                pick_manually=False,
-                speed=1.0,
-                output_folder=self.output_dir,
-                selected_chapters=filtered_chapters,
-                audio_prompt_wav=self.wav_path if self.wav_path else None,
-                post_event=post_event,
-                should_stop=lambda: self._should_stop
-            )
+        def book_finished():
+            nonlocal completed
             completed += 1
             now = time.time()
             elapsed = int(now - batch_start_time)
@@ -824,6 +818,33 @@ class BatchWorker(QThread):
             else:
                 eta_str = "--:--"
             self.progress_update.emit(completed, total, elapsed_str, eta_str)
+
+        def post_event(evt_name, **kwargs):
+            if evt_name == "CORE_PROGRESS":
+                stats = kwargs.get("stats")
+                self.chapter_progress.emit(stats)
+            elif evt_name == "CORE_FILE_FINISHED":
+                book_finished()
+
+        def filter_chapters(document):
+            return [
+                c for c in document.chapters
+                if not any(ignore.lower() in c.get_name().lower() for ignore in self.ignore_list)
+            ]
+
+        # The next book is parsed and the previous one packaged while the current one is synthesized
+        core.run_batch_pipeline(
+            self.selected_files,
+            post_event=post_event,
+            should_stop=lambda: self._should_stop,
+            chapter_filter=filter_chapters,
+            pick_manually=False,
+            speed=1.0,
+            output_folder=self.output_dir,
+            audio_prompt_wav=self.wav_path if self.wav_path else None,
+            keep_intermediates=False,
+            cb_model=self.cb_model,
+        )
         self.finished.emit()
 
 def on_batch_progress_update(self, completed, total, elapsed_str, eta_str):
@@ -967,6 +988,7 @@ class BatchFilesPanel(QWidget):
 
 
 def main():
+    configure_logging()
     app = QApplication(sys.argv)
     win = MainWindow()
     win.show()
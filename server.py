@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# chatterblez - headless daemon with a localhost job API
+#
+# Endpoints (JSON unless noted):
+#   POST /jobs                 submit {"file_path", "audio_prompt_wav", "ignore_list", "output_folder", "speed",
+#                                      "stream_output", "output_format", "pauses", "silence_trim",
+#                                      "intermediate_format", "target_lufs", "lexicon", "max_part_hours",
+#                                      "max_part_mb", "qa"}
+#   GET  /jobs                 list all jobs
+#   GET  /jobs/<id>            status of one job
+#   GET  /jobs/<id>/events     progress events as newline-delimited JSON, streamed until the job ends
+#   POST /jobs/<id>/cancel     cancel a queued or running job
+#   GET  /metrics              uptime, model load time and source, job counts and throughput
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from logs import LOG_FORMATS, LOG_LEVELS, configure_logging, get_logger
+
+log = get_logger('server')
+
+EVENT_HISTORY = 1000  # events kept per job for late subscribers
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class Job:
+    def __init__(self, job_id, params):
+        self.id = job_id
+        self.params = params
+        self.state = QUEUED
+        self.error = None
+        self.progress = 0
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.ended_at = None
+        self.cancel_requested = False
+        self.events = deque(maxlen=EVENT_HISTORY)
+        self._seq = itertools.count()
+        self.changed = threading.Condition()
+
+    def post_event(self, evt_name, **kwargs):
+        payload = {'seq': next(self._seq), 'time': time.time(), 'event': evt_name}
+        for key, value in kwargs.items():
+            # A copy: the stats object keeps changing in the synthesis thread after the event
+            payload[key] = dict(vars(value)) if hasattr(value, '__dict__') else value
+        if evt_name == 'CORE_PROGRESS':
+            self.progress = payload.get('stats', {}).get('progress', self.progress)
+        elif evt_name == 'CORE_ERROR':
+            self.error = kwargs.get('message')
+        with self.changed:
+            self.events.append(payload)
+            self.changed.notify_all()
+
+    def set_state(self, state):
+        with self.changed:
+            self.state = state
+            if state == RUNNING:
+                self.started_at = time.time()
+            elif state in (FINISHED, FAILED, CANCELLED):
+                self.ended_at = time.time()
+            self.changed.notify_all()
+
+    def is_done(self):
+        return self.state in (FINISHED, FAILED, CANCELLED)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'progress': self.progress,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'ended_at': self.ended_at,
+            'params': self.params,
+        }
+
+
+class Daemon:
+    """
+    Owns one warm Chatterbox model and runs submitted jobs through core.main
+    one at a time, so spaCy, torch and the model weights are loaded once per
+    process instead of once per book.
+    """
+
+    def __init__(self, device=None, accel='fp32', backend='torch', onnx_dir=None):
+        self.device = device
+        self.accel = accel
+        self.backend = backend
+        self.onnx_dir = onnx_dir
+        self.jobs = {}
+        self.queue = queue.Queue()
+        self.started_at = time.time()
+        self.model_load_seconds = None
+        self.processed_chars = 0
+        self.synthesis_seconds = 0.0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.cb_model = None
+
+    def warm_up(self):
+        import core
+        start = time.perf_counter()
+        core.load_spacy()
+        core.get_nlp()
+        self.cb_model = core.load_tts_model(self.device, self.accel, self.backend, self.onnx_dir)
+        self.model_load_seconds = time.perf_counter() - start
+        log.info("Engine ready in %.1f seconds", self.model_load_seconds)
+
+    def submit(self, params):
+        import core
+        if not isinstance(params, dict):
+            raise ValueError("Expected a JSON object of job parameters")
+        if not params.get('file_path') or not Path(params['file_path']).is_file():
+            raise ValueError(f"File does not exist: {params.get('file_path')}")
+        if params.get('audio_prompt_wav') and not Path(params['audio_prompt_wav']).is_file():
+            raise ValueError(f"Voice WAV does not exist: {params['audio_prompt_wav']}")
+        lexicon = params.get('lexicon') or []
+        for path in [lexicon] if isinstance(lexicon, str) else lexicon:
+            if not Path(path).is_file():
+                raise ValueError(f"Lexicon file does not exist: {path}")
+        for key in ('output_format', 'stream_output'):
+            if params.get(key) and params[key] not in core.OUTPUT_PROFILES:
+                raise ValueError(f"Unknown {key} {params[key]!r}, expected one of {', '.join(core.OUTPUT_PROFILES)}")
+        if params.get('intermediate_format') and params['intermediate_format'] not in ('flac', 'wav'):
+            raise ValueError(f"Unknown intermediate_format {params['intermediate_format']!r}, expected flac or wav")
+        pauses = params.get('pauses')
+        if pauses is not None:
+            if (not isinstance(pauses, dict) or set(pauses) != set(core.DEFAULT_PAUSES)
+                    or not all(isinstance(v, (int, float)) and not isinstance(v, bool) and v >= 0
+                               for v in pauses.values())):
+                raise ValueError(f"pauses must be an object of non-negative seconds for "
+                                 f"{', '.join(core.DEFAULT_PAUSES)}, got: {pauses!r}")
+        job_params = {
+            'file_path': str(params['file_path']),
+            'audio_prompt_wav': params.get('audio_prompt_wav') or None,
+            'ignore_list': params.get('ignore_list') or None,
+            'output_folder': params.get('output_folder') or '.',
+            'speed': float(params.get('speed', 1.0)),
+            'stream_output': params.get('stream_output') or None,
+            'output_format': params.get('output_format') or 'aac',
+            'pauses': params.get('pauses') or None,
+            'silence_trim': bool(params.get('silence_trim', True)),
+            'intermediate_format': params.get('intermediate_format') or 'flac',
+            'target_lufs': float(params['target_lufs']) if params.get('target_lufs') is not None else None,
+            'lexicon': params.get('lexicon') or None,
+            'max_part_hours': float(params['max_part_hours']) if params.get('max_part_hours') else None,
+            'max_part_mb': float(params['max_part_mb']) if params.get('max_part_mb') else None,
+            'qa': bool(params.get('qa', True)),
+        }
+        with self._lock:
+            job = Job(str(next(self._ids)), job_params)
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        return job
+
+    def cancel(self, job):
+        job.cancel_requested = True
+        if job.state == QUEUED:
+            job.set_state(CANCELLED)
+
+    def run_forever(self):
+        import core
+        while True:
+            job = self.queue.get()
+            if job.cancel_requested:
+                continue
+            job.set_state(RUNNING)
+            started = time.perf_counter()
+
+            def post_event(evt_name, **kwargs):
+                if evt_name == 'CORE_PROGRESS' and getattr(kwargs.get('stats'), 'processed_chars', None) is not None:
+                    job.processed_chars = kwargs['stats'].processed_chars
+                job.post_event(evt_name, **kwargs)
+
+            job.processed_chars = 0
+            try:
+                core.main(pick_manually=False, post_event=post_event,
+                          should_stop=lambda: job.cancel_requested, cb_model=self.cb_model, **job.params)
+                if job.cancel_requested:
+                    job.set_state(CANCELLED)
+                elif job.error:
+                    job.set_state(FAILED)
+                else:
+                    job.set_state(FINISHED)
+            except Exception as e:
+                log.exception("Job %s failed", job.id)
+                job.error = str(e)
+                job.set_state(FAILED)
+            with self._lock:
+                self.processed_chars += job.processed_chars
+                self.synthesis_seconds += time.perf_counter() - started
+
+    def metrics(self):
+        with self._lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job.state] = counts.get(job.state, 0) + 1
+            return {
+                'uptime_seconds': time.time() - self.started_at,
+                'model_load_seconds': self.model_load_seconds,
+                'weights_load_seconds': getattr(self.cb_model, 'load_seconds', None),
+                'model_source': getattr(self.cb_model, 'model_source', None),
+                'queue_length': self.queue.qsize(),
+                'jobs': counts,
+                'processed_chars': self.processed_chars,
+                'busy_seconds': self.synthesis_seconds,
+                'chars_per_sec': self.processed_chars / self.synthesis_seconds if self.synthesis_seconds else 0.0,
+            }
+
+
+def make_handler(daemon):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, fmt, *args):
+            pass  # progress events would otherwise flood stdout with access logs
+
+        def _send_json(self, obj, status=200):
+            body = json.dumps(obj, default=str).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _job_or_404(self, job_id):
+            job = daemon.jobs.get(job_id)
+            if job is None:
+                self._send_json({'error': f'Unknown job {job_id}'}, 404)
+            return job
+
+        def do_GET(self):
+            parts = [p for p in self.path.split('?')[0].split('/') if p]
+            if parts == ['metrics']:
+                self._send_json(daemon.metrics())
+            elif parts == ['jobs']:
+                self._send_json([job.to_dict() for job in list(daemon.jobs.values())])
+            elif len(parts) == 2 and parts[0] == 'jobs':
+                if job := self._job_or_404(parts[1]):
+                    self._send_json(job.to_dict())
+            elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events':
+                if job := self._job_or_404(parts[1]):
+                    self._stream_events(job)
+            else:
+                self._send_json({'error': 'Not found'}, 404)
+
+        def do_POST(self):
+            parts = [p for p in self.path.split('?')[0].split('/') if p]
+            if parts == ['jobs']:
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    params = json.loads(self.rfile.read(length) or b'{}')
+                    job = daemon.submit(params)
+                except (ValueError, TypeError) as e:
+                    self._send_json({'error': str(e)}, 400)
+                    return
+                self._send_json(job.to_dict(), 201)
+            elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+                if job := self._job_or_404(parts[1]):
+                    daemon.cancel(job)
+                    self._send_json(job.to_dict())
+            else:
+                self._send_json({'error': 'Not found'}, 404)
+
+        def _write_chunk(self, obj):
+            line = (json.dumps(obj, default=str) + '\n').encode('utf-8')
+            self.wfile.write(f'{len(line):X}\r\n'.encode('ascii') + line + b'\r\n')
+
+        def _stream_events(self, job):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            next_seq = 0
+            try:
+                while True:
+                    with job.changed:
+                        if not job.is_done() and not any(e['seq'] >= next_seq for e in job.events):
+                            job.changed.wait(timeout=15)
+                        pending = [e for e in job.events if e['seq'] >= next_seq]
+                        done = job.is_done()
+                    if not pending and not done:
+                        pending = [{'event': 'KEEPALIVE', 'time': time.time()}]
+                    for event in pending:
+                        next_seq = event.get('seq', next_seq - 1) + 1
+                        self._write_chunk(event)
+                    self.wfile.flush()
+                    if done:
+                        break
+                self._write_chunk({'event': 'JOB_' + job.state.upper(), 'job': job.to_dict()})
+                self.wfile.write(b'0\r\n\r\n')
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # client went away
+
+    return Handler
+
+
+def serve_main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='cli.py serve',
+        description="Run Chatterblez as a daemon that keeps the model loaded and accepts jobs over localhost HTTP"
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on (default: 8765)')
+    parser.add_argument('--cuda', default=False, help='Use GPU via Cuda in Torch if available', action='store_true')
+    parser.add_argument('--accel', default='fp32', help='Inference acceleration: fp32, inference, bf16, int8 or compile, or a comma-separated combination (default: fp32)')
+    parser.add_argument('--backend', choices=['torch', 'onnx'], default='torch', help='Run the transformer and vocoder in PyTorch or in ONNX Runtime (default: torch)')
+    parser.add_argument('--onnx-dir', metavar='FOLDER', help='Folder of the ONNX export used by --backend onnx')
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='info', help='Least severe messages to log: info logs one line per job step and chapter, debug adds the chapter text and ffmpeg output (default: info)')
+    parser.add_argument('--log-format', choices=LOG_FORMATS, default='text', help='Log as readable lines or as one JSON object per line (default: text)')
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level, args.log_format)
+
+    device = None
+    if args.cuda:
+        import torch.cuda
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    daemon = Daemon(device=device, accel=args.accel, backend=args.backend, onnx_dir=args.onnx_dir)
+    daemon.warm_up()
+    threading.Thread(target=daemon.run_forever, name='chatterblez-engine', daemon=True).start()
+
+    httpd = ThreadingHTTPServer((args.host, args.port), make_handler(daemon))
+    httpd.daemon_threads = True
+    log.info("Chatterblez daemon listening on http://%s:%d", args.host, args.port)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        log.info("Shutting down")
+    finally:
+        httpd.server_close()
+
+
+if __name__ == '__main__':
+    serve_main()
@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+TEST_EPUB = REPO_DIR / 'test_epubs' / 'Journey-Through-Time.epub'
+
+
+@pytest.fixture(autouse=True)
+def offline_core(monkeypatch):
+    """core without network access: sentence splitting needs only spacy.blank, never the downloaded model."""
+    import core
+    monkeypatch.setattr(core, 'load_spacy', lambda: None)
+    return core
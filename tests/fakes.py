@@ -0,0 +1,49 @@
+import time
+
+import torch
+
+SAMPLE_RATE = 24000
+
+
+class FakeTTS:
+    """Stand-in for ChatterboxTTS: a tone about as long as real speech for the text, without the weights."""
+    sr = SAMPLE_RATE
+
+    def __init__(self):
+        self.conds = None
+
+    def prepare_conditionals(self, wav_fpath, **kwargs):
+        self.conds = ('voice', wav_fpath)
+
+    def generate(self, text, **kwargs):
+        import core
+        t = torch.arange(int(core.QA_TYPICAL_SECONDS_PER_CHAR * self.sr * max(len(text), 1))) / self.sr
+        return (0.3 * torch.sin(2 * torch.pi * 220 * t)).unsqueeze(0)
+
+
+class StepModule(torch.nn.Module):
+    def __init__(self, step_seconds):
+        super().__init__()
+        self.step_seconds = step_seconds
+        self.calls = 0
+
+    def forward(self, x):
+        self.calls += 1
+        time.sleep(self.step_seconds)
+        return x
+
+
+class SteppedTTS(FakeTTS):
+    """FakeTTS whose generate() runs `steps` transformer steps through t3.tfmr, like the real decoding loop."""
+
+    def __init__(self, steps=200, step_seconds=0.01):
+        super().__init__()
+        self.steps = steps
+        self.t3 = torch.nn.Module()
+        self.t3.tfmr = StepModule(step_seconds)
+
+    def generate(self, text, **kwargs):
+        x = torch.zeros(1)
+        for _ in range(self.steps):
+            x = self.t3.tfmr(x)
+        return super().generate(text, **kwargs)
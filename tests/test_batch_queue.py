@@ -0,0 +1,82 @@
+import shutil
+import threading
+
+import pytest
+
+from conftest import TEST_EPUB
+from fakes import FakeTTS
+
+
+@pytest.fixture
+def batch(tmp_path, monkeypatch):
+    """A JobStore of copies of the test book, with model loads and ffmpeg packaging recorded instead of run."""
+    import core
+    from batch_queue import JobStore
+
+    recorded = {'loads': [], 'packaged': []}
+    lock = threading.Lock()
+
+    def load_tts_model(device=None, accel='fp32', backend='torch', onnx_dir=None):
+        with lock:
+            recorded['loads'].append((accel, backend, onnx_dir))
+        return FakeTTS()
+
+    def concat_wavs_with_ffmpeg(chapter_files, work_dir, filename, **kwargs):
+        with lock:
+            recorded['packaged'].append(filename)
+        return work_dir / 'concat'
+
+    monkeypatch.setattr(core, 'load_tts_model', load_tts_model)
+    monkeypatch.setattr(core, 'concat_wavs_with_ffmpeg', concat_wavs_with_ffmpeg)
+    monkeypatch.setattr(core, 'create_m4b', lambda *args, **kwargs: None)
+    monkeypatch.setattr(core.shutil, 'which', lambda name: f'/usr/bin/{name}')
+
+    def make(books):
+        paths = []
+        for i in range(books):
+            path = tmp_path / f'book{i}.epub'
+            shutil.copyfile(TEST_EPUB, path)
+            paths.append(str(path))
+        store = JobStore(str(tmp_path / 'out'), max_attempts=1)
+        store.add_books(paths)
+        return store, recorded
+
+    return make
+
+
+@pytest.mark.parametrize('books, concurrency', [(2, 1), (4, 2)])
+def test_run_batch_loads_one_model_per_worker(tmp_path, batch, books, concurrency):
+    from batch_queue import DONE, run_batch
+
+    store, recorded = batch(books)
+    run_batch(store, concurrency=concurrency, output_folder=str(tmp_path / 'out'), speed=1.0, max_sentences=2,
+              qa=False)
+
+    assert store.summary() == {DONE: books}
+    assert sorted(recorded['packaged']) == [f'book{i}.epub' for i in range(books)]
+    assert 1 <= len(recorded['loads']) <= concurrency
+    assert recorded['loads'][0] == ('fp32', 'torch', None)
+    store.close()
+
+
+def test_run_batch_parses_ahead_and_packages_in_the_background(tmp_path, batch, monkeypatch):
+    import core
+    from batch_queue import DONE, run_batch
+
+    store, recorded = batch(3)
+    threads = {}
+    preprocess_book, package = core.preprocess_book, core.concat_wavs_with_ffmpeg
+
+    def record(stage, fn):
+        def recorded_call(*args, **kwargs):
+            threads.setdefault(stage, set()).add(threading.current_thread().name)
+            return fn(*args, **kwargs)
+        return recorded_call
+
+    monkeypatch.setattr(core, 'preprocess_book', record('parse', preprocess_book))
+    monkeypatch.setattr(core, 'concat_wavs_with_ffmpeg', record('package', package))
+    run_batch(store, concurrency=1, output_folder=str(tmp_path / 'out'), speed=1.0, max_sentences=2, qa=False)
+
+    assert store.summary() == {DONE: 3}
+    assert threads == {'parse': {'batch-parse'}, 'package': {'batch-package'}}
+    store.close()
@@ -0,0 +1,100 @@
+import os
+import signal
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+
+class Vocoder(torch.nn.Module):
+    """Like HiFTGenerator: S3Gen calls inference(), never forward()."""
+
+    def inference(self, speech_feat, cache_source=None):
+        return speech_feat, cache_source
+
+
+def test_vocoder_inference_is_a_checkpoint():
+    import core
+    model = torch.nn.Module()
+    model.s3gen = torch.nn.Module()
+    model.s3gen.mel2wav = Vocoder()
+    core.install_cancel_checkpoints(model)
+
+    mel = torch.zeros(1, 80, 4)
+    with core.cancellable(lambda: False):
+        assert model.s3gen.mel2wav.inference(speech_feat=mel)[0] is mel
+    with core.cancellable(lambda: True), pytest.raises(core.SynthesisCancelled):
+        model.s3gen.mel2wav.inference(speech_feat=mel)
+
+
+def test_stop_ends_main_within_one_decoding_step(tmp_path, monkeypatch):
+    import core
+    from conftest import TEST_EPUB
+    from fakes import SteppedTTS
+
+    monkeypatch.setattr(core.shutil, 'which', lambda name: f'/usr/bin/{name}')
+    model = core.install_cancel_checkpoints(SteppedTTS(steps=200, step_seconds=0.01))
+    tfmr = model.t3.tfmr
+    stop = threading.Event()
+    packaged = []
+    worker = threading.Thread(target=core.main, args=(str(TEST_EPUB), False, 1.0), kwargs=dict(
+        output_folder=str(tmp_path), cb_model=model, should_stop=stop.is_set, qa=False,
+        packager=SimpleNamespace(submit=packaged.append)))
+    worker.start()
+    deadline = time.monotonic() + 30
+    while tfmr.calls < 50 and worker.is_alive() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert tfmr.calls >= 50, 'synthesis did not start'
+
+    steps_at_stop = tfmr.calls
+    requested = time.perf_counter()
+    stop.set()
+    worker.join(timeout=5)
+    latency = time.perf_counter() - requested
+
+    assert not worker.is_alive()
+    assert tfmr.calls <= steps_at_stop + 1  # the step in progress finishes, no further one starts
+    assert latency < 0.5
+    assert packaged == []
+    assert not list(core.job_work_dir(str(tmp_path), str(TEST_EPUB)).glob('*.flac'))
+
+
+@pytest.mark.skipif(sys.platform.startswith('win'), reason='stand-in ffmpeg is a POSIX script')
+def test_stop_kills_ffmpeg(tmp_path, monkeypatch):
+    import core
+
+    # A stand-in ffmpeg that records its pid and would run for a minute
+    pid_file = tmp_path / 'ffmpeg.pid'
+    ffmpeg = tmp_path / 'ffmpeg'
+    ffmpeg.write_text(f"#!{sys.executable}\n"
+                      f"import os, time\n"
+                      f"open({str(pid_file)!r}, 'w').write(str(os.getpid()))\n"
+                      f"time.sleep(60)\n")
+    ffmpeg.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    stop = threading.Event()
+    results = []
+    worker = threading.Thread(target=lambda: results.append(core.run_media_command(
+        ['ffmpeg', '-i', 'book.flac', 'book.m4b'], label='FFmpeg STOP', should_stop=stop.is_set)))
+    worker.start()
+    deadline = time.monotonic() + 10
+    while not (pid_file.is_file() and pid_file.read_text()) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pid = int(pid_file.read_text())
+
+    requested = time.perf_counter()
+    stop.set()
+    worker.join(timeout=5)
+    latency = time.perf_counter() - requested
+
+    assert not worker.is_alive()
+    (result,) = results
+    assert result.interrupted
+    assert result.returncode == -signal.SIGKILL
+    assert latency < core.FFMPEG_STOP_POLL_SECONDS + 0.5
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
@@ -0,0 +1,108 @@
+import threading
+import time
+
+from fakes import FakeTTS
+
+
+class SlowTTS(FakeTTS):
+    """FakeTTS that takes a while per sentence and records the conds each generate() ran with."""
+
+    def __init__(self, seconds=0.03):
+        super().__init__()
+        self.seconds = seconds
+        self.conds = 'shared'
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def generate(self, text, **kwargs):
+        with self._lock:
+            self.calls.append((text, self.conds))
+        time.sleep(self.seconds)
+        return super().generate(text, **kwargs)
+
+
+def test_interactive_session_runs_before_the_next_batch_sentence():
+    from engine import BATCH, INTERACTIVE, Engine
+
+    model = SlowTTS()
+    engine = Engine(cb_model=model)
+    book = engine.client(BATCH)
+    preview = engine.client(INTERACTIVE)
+    book.prepare_conditionals('book.wav')
+    preview.prepare_conditionals('preview.wav')
+    assert model.conds == 'shared'
+
+    stop = threading.Event()
+
+    def render():
+        i = 0
+        while not stop.is_set():
+            book.generate(f'book {i}')
+            i += 1
+
+    worker = threading.Thread(target=render)
+    worker.start()
+    while len(model.calls) < 3:
+        time.sleep(0.005)
+
+    with engine.session(INTERACTIVE):
+        opened = len(model.calls)
+        previews = [preview.generate(f'preview {i}') for i in range(3)]
+    assert all(wav.shape[-1] > 0 for wav in previews)
+    while sum(text.startswith('book') for text, conds in model.calls[opened:]) < 3:
+        time.sleep(0.005)
+    stop.set()
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+
+    texts = [text for text, conds in model.calls]
+    first, last = texts.index('preview 0'), texts.index('preview 2')
+    # At most the book sentence that already held the model when the session opened runs first...
+    assert first - opened <= 1
+    # ...and the book waits for the whole session, not just one preview sentence
+    assert texts[first:last + 1] == ['preview 0', 'preview 1', 'preview 2']
+    assert texts[last + 1].startswith('book')
+
+    for text, conds in model.calls:
+        assert conds == ('voice', 'preview.wav' if text.startswith('preview') else 'book.wav'), text
+    assert model.conds == 'shared'
+
+
+def test_client_without_a_voice_uses_the_shared_conds():
+    from engine import BATCH, INTERACTIVE, Engine
+
+    model = SlowTTS(seconds=0)
+    engine = Engine(cb_model=model)
+    voiced = engine.client(INTERACTIVE)
+    voiced.prepare_conditionals('preview.wav')
+    engine.client(BATCH).generate('default voice')
+    voiced.generate('preview voice')
+
+    assert model.calls == [('default voice', 'shared'), ('preview voice', ('voice', 'preview.wav'))]
+    assert voiced.conds == ('voice', 'preview.wav')
+    assert model.conds == 'shared'
+
+
+def test_waiting_interactive_sentence_goes_before_waiting_batch_sentences():
+    from engine import BATCH, INTERACTIVE, Engine
+
+    model = SlowTTS(seconds=0.05)
+    engine = Engine(cb_model=model)
+
+    def generate(lane, text):
+        engine.client(lane).generate(text)
+
+    holder = threading.Thread(target=generate, args=(BATCH, 'running'))
+    holder.start()
+    while not model.calls:
+        time.sleep(0.001)
+    waiting = [threading.Thread(target=generate, args=(BATCH, f'book {i}')) for i in range(3)]
+    for thread in waiting:
+        thread.start()
+    time.sleep(0.01)
+    interactive = threading.Thread(target=generate, args=(INTERACTIVE, 'preview'))
+    interactive.start()
+    for thread in [holder, interactive, *waiting]:
+        thread.join(timeout=5)
+
+    assert [text for text, conds in model.calls][:2] == ['running', 'preview']
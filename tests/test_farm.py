@@ -0,0 +1,142 @@
+import json
+import multiprocessing
+import time
+
+import pytest
+
+from conftest import TEST_EPUB
+from fakes import FakeTTS
+
+
+class SlowTTS(FakeTTS):
+    def __init__(self, seconds_per_sentence):
+        super().__init__()
+        self.seconds_per_sentence = seconds_per_sentence
+
+    def generate(self, text, **kwargs):
+        time.sleep(self.seconds_per_sentence)
+        return super().generate(text, **kwargs)
+
+
+def farm_worker(output_folder, result_path, seconds_per_sentence, lease_seconds, poll_seconds, accel='fp32'):
+    """One farm process: FakeTTS for the model, ffmpeg packaging recorded instead of run."""
+    import core
+    import farm
+
+    core.load_spacy = lambda: None
+    core.shutil.which = lambda name: f'/usr/bin/{name}'
+    packaged = []
+    core.concat_wavs_with_ffmpeg = lambda files, work_dir, filename, **kwargs: packaged.append(filename) or work_dir
+    core.create_m4b = lambda *args, **kwargs: None
+    started = []
+    errors = []
+
+    def post_event(evt_name, **kwargs):
+        if evt_name == 'CORE_CHAPTER_STARTED':
+            started.append((kwargs['chapter_index'], time.time()))
+        elif evt_name == 'CORE_ERROR':
+            errors.append(kwargs['message'])
+
+    model = SlowTTS(seconds_per_sentence)
+    model.accel = accel
+    farm.run_farm_worker([str(TEST_EPUB)], output_folder, lease_seconds=lease_seconds, poll_seconds=poll_seconds,
+                         post_event=post_event, cb_model=model, speed=1.0, max_sentences=2, qa=False)
+    with open(result_path, 'w') as f:
+        json.dump({'started': started, 'packaged': packaged, 'errors': errors}, f)
+
+
+def start_workers(tmp_path, count, **kwargs):
+    context = multiprocessing.get_context('spawn')
+    workers = []
+    for n in range(count):
+        result_path = tmp_path / f'worker{n}.json'
+        process = context.Process(target=farm_worker, args=(str(tmp_path / 'out'), str(result_path)),
+                                  kwargs=dict(seconds_per_sentence=0.1, lease_seconds=5.0, poll_seconds=0.2, **kwargs))
+        process.start()
+        workers.append((process, result_path))
+    return workers
+
+
+def results_of(workers, timeout=120):
+    results = []
+    for process, result_path in workers:
+        process.join(timeout)
+        assert process.exitcode == 0
+        results.append(json.loads(result_path.read_text()))
+    return results
+
+
+def test_workers_render_each_chapter_once_and_package_once(tmp_path):
+    import core
+    from farm import ASSEMBLED_MARKER, FARM_INPUTS
+
+    results = results_of(start_workers(tmp_path, 3))
+
+    started = [index for result in results for index, _ in result['started']]
+    assert started
+    assert sorted(started) == sorted(set(started))  # no chapter rendered twice
+    assert sum(len(result['packaged']) for result in results) == 1
+    work_dir = core.job_work_dir(str(tmp_path / 'out'), str(TEST_EPUB))
+    assert (work_dir / ASSEMBLED_MARKER).exists()
+    assert not (work_dir / FARM_INPUTS).exists()
+    assert len(list(work_dir.glob('*_chapter_*.flac'))) == len(set(started))
+
+
+def test_lease_of_a_killed_worker_is_taken_over(tmp_path):
+    import core
+    from farm import ASSEMBLED_MARKER, LEASES_DIR
+
+    work_dir = core.job_work_dir(str(tmp_path / 'out'), str(TEST_EPUB))
+    context = multiprocessing.get_context('spawn')
+    stalled = context.Process(target=farm_worker, args=(str(tmp_path / 'out'), str(tmp_path / 'stalled.json')),
+                              kwargs=dict(seconds_per_sentence=600, lease_seconds=2.0, poll_seconds=0.2))
+    stalled.start()
+    deadline = time.monotonic() + 60
+    while not list((work_dir / LEASES_DIR).glob('*.lease')) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    (held,) = list((work_dir / LEASES_DIR).glob('*.lease'))
+    stalled.kill()
+    stalled.join()
+    last_renewed = held.stat().st_mtime
+
+    process = context.Process(target=farm_worker, args=(str(tmp_path / 'out'), str(tmp_path / 'rescuer.json')),
+                              kwargs=dict(seconds_per_sentence=0.01, lease_seconds=2.0, poll_seconds=0.2))
+    process.start()
+    (result,) = results_of([(process, tmp_path / 'rescuer.json')])
+
+    # The chapters nobody held come first; the held one only once its lease expired
+    assert max(started_at for _, started_at in result['started']) >= last_renewed + 2.0
+    assert (work_dir / ASSEMBLED_MARKER).exists()
+    assert len(result['packaged']) == 1
+    assert list(work_dir.glob(f'{held.stem}.flac'))  # the chapter the killed worker held was rendered
+
+
+def test_worker_with_other_render_inputs_refuses(tmp_path):
+    from farm import FarmInputsMismatch, check_render_inputs
+
+    check_render_inputs(tmp_path, {'model': 'store:abc', 'accel': 'fp32'})
+    check_render_inputs(tmp_path, {'accel': 'fp32', 'model': 'store:abc'})
+    with pytest.raises(FarmInputsMismatch, match='model'):
+        check_render_inputs(tmp_path, {'model': 'hub:ResembleAI/chatterbox', 'accel': 'fp32'})
+
+def test_worker_with_another_accel_does_not_render_the_book_again(tmp_path):
+    import core
+    from farm import FARM_INPUTS
+
+    work_dir = core.job_work_dir(str(tmp_path / 'out'), str(TEST_EPUB))
+    context = multiprocessing.get_context('spawn')
+    first = context.Process(target=farm_worker, args=(str(tmp_path / 'out'), str(tmp_path / 'first.json')),
+                            kwargs=dict(seconds_per_sentence=600, lease_seconds=5.0, poll_seconds=0.2))
+    first.start()
+    try:
+        deadline = time.monotonic() + 60
+        while not (work_dir / FARM_INPUTS).exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        (result,) = results_of(start_workers(tmp_path, 1, accel='int8'))
+    finally:
+        first.kill()
+        first.join()
+
+    assert result['started'] == []
+    assert result['packaged'] == []
+    assert 'accel' in result['errors'][0]
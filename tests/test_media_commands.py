@@ -0,0 +1,32 @@
+import sys
+import threading
+
+
+def test_commands_share_one_loop_thread():
+    import core
+
+    results = {}
+
+    def run(n):
+        results[n] = core.run_media_command([sys.executable, '-c', f'print({n}); print("line", {n})'], label='echo')
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    run(8)
+
+    assert sorted(results) == list(range(9))
+    for n, result in results.items():
+        assert result.returncode == 0 and not result.interrupted
+        assert result.stdout == f'{n}\nline {n}'
+    assert [t.name for t in threading.enumerate()].count('media-commands') == 1
+
+
+def test_failing_command_reports_stderr():
+    import core
+
+    result = core.run_media_command([sys.executable, '-c', 'import sys; sys.exit("no such file")'])
+    assert result.returncode == 1
+    assert result.stderr_tail == ['no such file']
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+from onnx_backend import (ONNX_MAX_ABS_ERROR, ONNX_OPSET, HiftDecode, T3Step, conv_istft, conv_stft,
+                          export_transformer, export_vocoder, transformer_parity, vocoder_parity)
+
+N_FFT, HOP = 16, 4  # HiFTGenerator's istft_params
+
+
+def hann(n_fft=N_FFT):
+    return torch.hann_window(n_fft, periodic=True)
+
+
+class TinyHift(torch.nn.Module):
+    """
+    A randomly initialised stand-in for HiFTGenerator with its STFT and inverse
+    STFT and the same decode() flow: source STFT fused with the mel, then
+    magnitude and phase through the inverse STFT.
+    """
+
+    def __init__(self, n_mels=8):
+        super().__init__()
+        self.istft_params = {'n_fft': N_FFT, 'hop_len': HOP}
+        self.stft_window = hann()
+        self.conv_pre = torch.nn.Conv1d(n_mels, N_FFT + 2, 3, padding=1)
+        self.source_down = torch.nn.Conv1d(N_FFT + 2, N_FFT + 2, 3, padding=1)
+        self.conv_post = torch.nn.Conv1d(N_FFT + 2, N_FFT + 2, 3, padding=1)
+
+    def _stft(self, x):
+        spec = torch.view_as_real(torch.stft(x, N_FFT, HOP, N_FFT, window=self.stft_window, return_complex=True))
+        return spec[..., 0], spec[..., 1]
+
+    def _istft(self, magnitude, phase):
+        magnitude = torch.clip(magnitude, max=1e2)
+        return torch.istft(torch.complex(magnitude * torch.cos(phase), magnitude * torch.sin(phase)), N_FFT, HOP,
+                           N_FFT, window=self.stft_window)
+
+    def decode(self, x, s):
+        s_real, s_imag = self._stft(s.squeeze(1))
+        x = F.pad(self.conv_pre(x), (0, 1)) + self.source_down(torch.cat([s_real, s_imag], dim=1))
+        x = self.conv_post(F.leaky_relu(x))
+        magnitude = torch.exp(x[:, :N_FFT // 2 + 1])
+        phase = torch.sin(x[:, N_FFT // 2 + 1:])
+        return torch.clamp(self._istft(magnitude, phase), -0.99, 0.99)
+
+
+def tiny_vocoder_inputs(frames=30, n_mels=8, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return (torch.randn(1, n_mels, frames, generator=generator),
+            0.1 * torch.randn(1, 1, frames * HOP, generator=generator))
+
+
+def test_conv_stft_matches_torch_stft():
+    x = torch.randn(2, 400, generator=torch.Generator().manual_seed(0))
+    spec = torch.stft(x, N_FFT, HOP, window=hann(), center=True, return_complex=True)
+    real, imag = conv_stft(x, N_FFT, HOP, hann())
+    assert real.shape == spec.real.shape
+    assert float((real - spec.real).abs().max()) <= ONNX_MAX_ABS_ERROR
+    assert float((imag - spec.imag).abs().max()) <= ONNX_MAX_ABS_ERROR
+
+
+def test_conv_istft_matches_torch_istft():
+    generator = torch.Generator().manual_seed(1)
+    spec = torch.complex(torch.randn(2, N_FFT // 2 + 1, 101, generator=generator),
+                         torch.randn(2, N_FFT // 2 + 1, 101, generator=generator))
+    reference = torch.istft(spec, N_FFT, HOP, window=hann(), center=True)
+    wav = conv_istft(spec.real, spec.imag, N_FFT, HOP, hann())
+    assert wav.shape == reference.shape
+    assert float((wav - reference).abs().max()) <= ONNX_MAX_ABS_ERROR
+
+
+def test_hift_decode_matches_decode_with_torch_stft():
+    hift = TinyHift().eval()
+    mel, source = tiny_vocoder_inputs()
+    with torch.no_grad():
+        reference = hift.decode(mel, source)
+        wav = HiftDecode(hift)(mel, source)
+    assert float((wav - reference).abs().max()) <= ONNX_MAX_ABS_ERROR
+    assert '_stft' not in vars(hift) and '_istft' not in vars(hift)  # the class methods are back
+
+
+def test_exported_vocoder_matches_pytorch(tmp_path):
+    pytest.importorskip('onnx')
+    ort = pytest.importorskip('onnxruntime')
+    hift = TinyHift().eval()
+    export_vocoder(hift, tmp_path / 'vocoder.onnx', *tiny_vocoder_inputs(frames=20))
+    session = ort.InferenceSession(str(tmp_path / 'vocoder.onnx'), providers=['CPUExecutionProvider'])
+    # Another length than the export was traced with: the frame axis is dynamic
+    assert vocoder_parity(hift, session, *tiny_vocoder_inputs(frames=45, seed=1)) <= ONNX_MAX_ABS_ERROR
+
+
+def test_exported_transformer_matches_pytorch(tmp_path):
+    pytest.importorskip('onnx')
+    ort = pytest.importorskip('onnxruntime')
+    transformers = pytest.importorskip('transformers')
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                                      num_attention_heads=4, num_key_value_heads=2, vocab_size=16)
+    tfmr = transformers.LlamaModel(config).eval()
+    manifest = {'opset': ONNX_OPSET, 'n_layers': 2, 'n_kv_heads': 2, 'head_dim': 8, 'hidden_size': 32}
+    export_transformer(tfmr, tmp_path / 't3.onnx', manifest)
+    session = ort.InferenceSession(str(tmp_path / 't3.onnx'), providers=['CPUExecutionProvider'])
+    error = transformer_parity(tfmr, session, manifest, generator=torch.Generator().manual_seed(0))
+    assert error <= ONNX_MAX_ABS_ERROR
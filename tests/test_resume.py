@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import soundfile
+
+from conftest import TEST_EPUB
+from fakes import FakeTTS
+
+
+class CountingTTS(FakeTTS):
+    def __init__(self):
+        super().__init__()
+        self.sentences = 0
+
+    def generate(self, text, **kwargs):
+        self.sentences += 1
+        return super().generate(text, **kwargs)
+
+
+def render(output_folder, model, intermediate_format):
+    import core
+    submitted = []
+    core.main(str(TEST_EPUB), False, 1.0, output_folder=str(output_folder), cb_model=model, max_sentences=2,
+              qa=False, intermediate_format=intermediate_format, packager=SimpleNamespace(submit=submitted.append))
+    return submitted
+
+
+def test_resume_converts_chapters_from_another_intermediate_format(tmp_path, monkeypatch):
+    import core
+    monkeypatch.setattr(core.shutil, 'which', lambda name: f'/usr/bin/{name}')
+    work_dir = core.job_work_dir(str(tmp_path), str(TEST_EPUB))
+
+    assert render(tmp_path, CountingTTS(), 'wav')
+    wavs = sorted(work_dir.glob('*_chapter_*.wav'))
+    assert wavs
+    samples = {path.stem: soundfile.read(str(path), dtype='int16')[0] for path in wavs}
+
+    model = CountingTTS()
+    assert render(tmp_path, model, 'flac')
+    assert model.sentences == 0  # every chapter reused, none rendered again
+    assert not list(work_dir.glob('*_chapter_*.wav'))
+    flacs = sorted(work_dir.glob('*_chapter_*.flac'))
+    assert [path.stem for path in flacs] == sorted(samples)
+    for path in flacs:
+        assert np.array_equal(soundfile.read(str(path), dtype='int16')[0], samples[path.stem])
+
+
+def render_qa(output_folder, model, qa):
+    import core
+    core.main(str(TEST_EPUB), False, 1.0, output_folder=str(output_folder), cb_model=model, max_sentences=2,
+              qa=qa, packager=SimpleNamespace(submit=lambda package: None))
+
+
+def test_changing_qa_re_renders_chapters(tmp_path, monkeypatch):
+    import core
+    monkeypatch.setattr(core.shutil, 'which', lambda name: f'/usr/bin/{name}')
+
+    first = CountingTTS()
+    render_qa(tmp_path, first, qa=False)
+    assert first.sentences > 0
+
+    same = CountingTTS()
+    render_qa(tmp_path, same, qa=False)
+    assert same.sentences == 0  # identical settings: every chapter reused
+
+    flipped = CountingTTS()
+    render_qa(tmp_path, flipped, qa=True)
+    assert flipped.sentences >= first.sentences  # QA on: every chapter rendered again
+
+
+def test_chapter_write_error_is_reported_not_raised(tmp_path, monkeypatch):
+    import core
+    monkeypatch.setattr(core.shutil, 'which', lambda name: f'/usr/bin/{name}')
+
+    def write_chapter_audio(path, audio_segments, chapter_format, gain=1.0):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(core, 'write_chapter_audio', write_chapter_audio)
+    events, submitted = [], []
+    core.main(str(TEST_EPUB), False, 1.0, output_folder=str(tmp_path), cb_model=FakeTTS(), max_sentences=1, qa=False,
+              post_event=lambda name, **kwargs: events.append((name, kwargs)),
+              packager=SimpleNamespace(submit=submitted.append))
+
+    errors = [kwargs['message'] for name, kwargs in events if name == 'CORE_ERROR']
+    assert len(errors) == 1 and 'No space left on device' in errors[0]
+    assert not submitted
+
+
+def test_chapter_writer_is_closed_when_the_loop_raises(tmp_path, monkeypatch):
+    import core
+    monkeypatch.setattr(core.shutil, 'which', lambda name: f'/usr/bin/{name}')
+    closed = []
+    monkeypatch.setattr(core.ChapterWriter, 'close', lambda self: closed.append(self))
+
+    def chapter_claim(chapter_wav_path, inputs):
+        raise RuntimeError('refused')
+
+    with pytest.raises(RuntimeError, match='refused'):
+        core.main(str(TEST_EPUB), False, 1.0, output_folder=str(tmp_path), cb_model=FakeTTS(), max_sentences=1,
+                  qa=False, chapter_claim=chapter_claim, packager=SimpleNamespace(submit=lambda package: None))
+    assert len(closed) == 1
@@ -0,0 +1,45 @@
+import pytest
+import torch
+
+from fakes import FakeTTS
+
+PAUSES = {'sentence': 0.1, 'paragraph': 0.2, 'chapter': 0.5}
+
+
+def render(text, **kwargs):
+    import core
+    return core.gen_audio_segments(FakeTTS(), core.get_nlp(), text, 1.0, pauses=PAUSES, qa=False, **kwargs)
+
+
+def test_chapter_pause_follows_last_rendered_sentence():
+    import core
+    text = 'One sentence here. Another one there. A third. A fourth. A fifth and last.'
+
+    full = render(text)
+    assert full[-1] is core.silence(PAUSES['chapter'])
+
+    cut = render(text, max_sentences=1)
+    speech = [segment for segment in cut if segment.any()]
+    assert len(speech) == 2
+    assert cut[-1] is core.silence(PAUSES['chapter'])
+    assert sum(segment is core.silence(PAUSES['chapter']) for segment in cut) == 1
+
+
+class PaddedTTS(FakeTTS):
+    """Speech with a second of silence on each side, as the model often renders it."""
+
+    def generate(self, text, **kwargs):
+        pad = torch.zeros(1, self.sr)
+        return torch.cat([pad, super().generate(text, **kwargs), pad], dim=1)
+
+
+@pytest.mark.parametrize('qa', [False, True])
+def test_trimmed_sentences_do_not_keep_the_untrimmed_render_alive(qa):
+    import core
+    text = 'Padded with silence. Twice over.'
+    segments = core.gen_audio_segments(PaddedTTS(), core.get_nlp(), text, 1.0, pauses=PAUSES, qa=qa)
+    speech = [segment for segment in segments if segment.any()]
+    assert len(speech) == 2
+    for segment in speech:
+        assert segment.flags.owndata
+        assert len(segment) < 2 * FakeTTS.sr  # trimmed
@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import TEST_EPUB
+from fakes import SteppedTTS
+
+
+@pytest.fixture
+def daemon_url(tmp_path, monkeypatch):
+    """A daemon on an ephemeral localhost port with a fake model, packaging recorded instead of run."""
+    import core
+    from server import Daemon, ThreadingHTTPServer, make_handler
+
+    monkeypatch.setattr(core.shutil, 'which', lambda name: f'/usr/bin/{name}')
+    monkeypatch.setattr(core, 'concat_wavs_with_ffmpeg', lambda chapter_files, work_dir, filename, **kwargs: work_dir)
+    monkeypatch.setattr(core, 'create_m4b', lambda *args, **kwargs: None)
+
+    daemon = Daemon()
+    daemon.cb_model = core.install_cancel_checkpoints(SteppedTTS(steps=2, step_seconds=0.001))
+    threading.Thread(target=daemon.run_forever, daemon=True).start()
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(daemon))
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        yield f'http://127.0.0.1:{httpd.server_address[1]}', daemon, tmp_path
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def request(url, body=None):
+    data = None if body is None else json.dumps(body).encode('utf-8')
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def stream_events(url):
+    events = []
+    with urllib.request.urlopen(url, timeout=60) as response:
+        assert response.headers['Content-Type'] == 'application/x-ndjson'
+        for line in response:
+            events.append(json.loads(line))
+    return events
+
+
+def wait_for_state(url, state, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status, job = request(url)
+        if job['state'] == state:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'{url} never reached {state}, last: {job["state"]}')
+
+
+def test_submit_status_events_and_metrics(daemon_url):
+    url, daemon, tmp_path = daemon_url
+    status, job = request(f'{url}/jobs', {
+        'file_path': str(TEST_EPUB), 'output_folder': str(tmp_path), 'qa': False,
+        'pauses': {'sentence': 0.1, 'paragraph': 0.2, 'chapter': 0.5}, 'intermediate_format': 'wav',
+    })
+    assert status == 201
+    assert job['state'] in ('queued', 'running')
+
+    events = stream_events(f'{url}/jobs/{job["id"]}/events')
+    assert events[-1]['event'] == 'JOB_FINISHED'
+    names = [e['event'] for e in events]
+    assert 'CORE_STARTED' in names and 'CORE_FINISHED' in names
+    assert [e['seq'] for e in events[:-1]] == sorted(e['seq'] for e in events[:-1])
+
+    status, finished = request(f'{url}/jobs/{job["id"]}')
+    assert status == 200
+    assert finished['state'] == 'finished' and finished['error'] is None
+    assert finished['params']['pauses'] == {'sentence': 0.1, 'paragraph': 0.2, 'chapter': 0.5}
+
+    status, metrics = request(f'{url}/metrics')
+    assert status == 200
+    assert metrics['jobs'] == {'finished': 1}
+    assert metrics['queue_length'] == 0
+    assert metrics['processed_chars'] > 0
+
+
+def test_cancel_running_job(daemon_url):
+    url, daemon, tmp_path = daemon_url
+    daemon.cb_model.t3.tfmr.step_seconds = 0.05
+    status, job = request(f'{url}/jobs', {'file_path': str(TEST_EPUB), 'output_folder': str(tmp_path), 'qa': False})
+    assert status == 201
+    wait_for_state(f'{url}/jobs/{job["id"]}', 'running')
+
+    status, cancelled = request(f'{url}/jobs/{job["id"]}/cancel', {})
+    assert status == 200
+    events = stream_events(f'{url}/jobs/{job["id"]}/events')
+    assert events[-1]['event'] == 'JOB_CANCELLED'
+    assert request(f'{url}/jobs/{job["id"]}')[1]['state'] == 'cancelled'
+
+
+@pytest.mark.parametrize('params, message', [
+    ({'output_format': 'wma'}, 'output_format'),
+    ({'stream_output': 'flac'}, 'stream_output'),
+    ({'intermediate_format': 'mp3'}, 'intermediate_format'),
+    ({'pauses': [0.35, 0.8, 1.5]}, 'pauses'),
+    ({'pauses': {'sentence': 0.35, 'paragraph': 0.8}}, 'pauses'),
+    ({'pauses': {'sentence': '0.35', 'paragraph': 0.8, 'chapter': 1.5}}, 'pauses'),
+    ({'file_path': '/nonexistent.epub'}, 'File does not exist'),
+])
+def test_invalid_jobs_are_rejected(daemon_url, params, message):
+    url, daemon, tmp_path = daemon_url
+    status, body = request(f'{url}/jobs', {'file_path': str(TEST_EPUB), 'output_folder': str(tmp_path), **params})
+    assert status == 400
+    assert message in body['error']
+    assert daemon.jobs == {}
+
+
+def test_unknown_job_is_404(daemon_url):
+    url, daemon, tmp_path = daemon_url
+    assert request(f'{url}/jobs/42')[0] == 404
+    assert request(f'{url}/jobs/42/cancel', {})[0] == 404